@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
+    Contact, ConfirmEmailToken, ImportJob
 from imagekit.admin import AdminThumbnail
 
 
@@ -32,6 +32,12 @@ class ShopAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('url', 'shop', 'state', 'rows_parsed', 'created_at', 'finished_at')
+    list_filter = ('state',)
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     pass
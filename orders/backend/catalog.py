@@ -0,0 +1,273 @@
+import hashlib
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from backend.facets import build_facets
+from backend.models import BestOffer, CatalogEntry, Category, CategoryCount, ProductInfo, ProductParameter
+from backend.search import get_search_backend
+from backend.utils import chunked
+
+# поля ProductInfo и связанных таблиц, которые копируются в CatalogEntry
+CATALOG_ENTRY_FIELDS = {
+    'id': 'id',
+    'shop_id': 'shop_id',
+    'shop_state': 'shop__state',
+    'product_id': 'product_id',
+    'product_name': 'product__name',
+    'category_id': 'product__category_id',
+    'category_name': 'product__category__name',
+    'model': 'model',
+    'quantity': 'quantity',
+    'price': 'price',
+    'price_rrc': 'price_rrc',
+    'photo': 'photo',
+}
+# поля BestOffer и колонки CatalogEntry, из которых они копируются
+BEST_OFFER_FIELDS = {
+    'id': 'product_id',
+    'product_name': 'product_name',
+    'category_id': 'category_id',
+    'category_name': 'category_name',
+    'product_info_id': 'id',
+    'shop_id': 'shop_id',
+    'model': 'model',
+    'quantity': 'quantity',
+    'price': 'price',
+    'price_rrc': 'price_rrc',
+}
+
+
+def catalog_version_key(shop_id=None):
+    return f'catalog:version:{shop_id or "all"}'
+
+
+def catalog_version(shop_id=None):
+    """
+    Текущая версия каталога магазина или, без shop_id, общая версия.
+
+    Версия — случайная строка, а не счетчик: если Redis вытеснит ключ, новая
+    версия не совпадет со старой, и закэшированные под ней ответы не вернутся.
+    :param shop_id: id магазина или None
+    :return: строка версии
+    """
+    key = catalog_version_key(shop_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_catalog_version(shop_id):
+    """
+    Меняет версию каталога магазина и общую версию после фиксации транзакции,
+    чтобы ответы, закэшированные под старой версией, больше не читались
+    :param shop_id: id магазина
+    :return: None
+    """
+    version = uuid4().hex
+    transaction.on_commit(lambda: cache.set_many(
+        {catalog_version_key(shop_id): version, catalog_version_key(): version}, timeout=None))
+
+
+def listing_cache_key(params, shop_id=None, prefix=''):
+    """
+    Ключ кэша ответа списка товаров.
+
+    В ключ входят параметры запроса, упорядоченные по имени и значению, и
+    версии каталога: при фильтре по магазину — версия этого магазина, и
+    импорт другого магазина страницу не сбрасывает, без фильтра — общая
+    версия, которая меняется вместе с версией любого магазина.
+    :param params: QueryDict параметров запроса
+    :param shop_id: id магазина, по которому фильтруется выдача, или None
+    :param prefix: адрес сервера, от которого строятся ссылки next и previous
+    :return: строка ключа
+    """
+    query = urlencode(sorted((name, value) for name in params for value in params.getlist(name)))
+    digest = hashlib.sha256(f'{prefix}?{query}'.encode()).hexdigest()
+    return f'products:{shop_id or "all"}:{catalog_version(shop_id)}:{digest}'
+
+
+def refresh_catalog_entries(product_info_ids):
+    """
+    Пересобирает строки CatalogEntry по текущему состоянию ProductInfo.
+
+    На пакет товаров выполняется три запроса на чтение, удаление старых строк
+    и одна вставка. Строки удаленных товаров просто удаляются.
+    :param product_info_ids: id строк ProductInfo
+    :return: множество id продуктов, к которым товары относились до и после пересборки
+    """
+    product_ids = set()
+    for batch in chunked(product_info_ids, settings.IMPORT_BATCH_SIZE):
+        product_ids.update(CatalogEntry.objects.filter(id__in=batch).values_list('product_id', flat=True))
+        parameters = {}
+        for product_info_id, name, value in ProductParameter.objects.filter(
+                product_info_id__in=batch).order_by('id').values_list('product_info_id', 'parameter__name', 'value'):
+            parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+        entries = [CatalogEntry(**dict(zip(CATALOG_ENTRY_FIELDS, row)), parameters=parameters.get(row[0], []))
+                   for row in ProductInfo.objects.filter(id__in=batch).values_list(*CATALOG_ENTRY_FIELDS.values())]
+        CatalogEntry.objects.filter(id__in=batch).delete()
+        CatalogEntry.objects.bulk_create(entries)
+        product_ids.update(entry.product_id for entry in entries)
+    return product_ids
+
+
+def catalog_product_ids(product_info_ids):
+    """
+    id продуктов, к которым относятся строки каталога
+    :param product_info_ids: id строк ProductInfo
+    :return: множество id продуктов
+    """
+    product_ids = set()
+    for batch in chunked(product_info_ids, settings.IMPORT_BATCH_SIZE):
+        product_ids.update(CatalogEntry.objects.filter(id__in=batch).values_list('product_id', flat=True))
+    return product_ids
+
+
+def refresh_best_offers(product_ids):
+    """
+    Пересобирает строки BestOffer по строкам CatalogEntry.
+
+    Лучшее предложение — самое дешевое из предложений в наличии у магазинов,
+    которые принимают заказы, при равной цене — с меньшим id. Продукты без
+    таких предложений из таблицы убираются. На пакет продуктов выполняется
+    одно чтение, удаление старых строк и одна вставка.
+    :param product_ids: id продуктов
+    :return: None
+    """
+    for batch in chunked(product_ids, settings.IMPORT_BATCH_SIZE):
+        offers = {}
+        for row in CatalogEntry.objects.filter(product_id__in=batch, shop_state=True, quantity__gt=0).order_by(
+                'product_id', 'price', 'id').values_list(*BEST_OFFER_FIELDS.values()):
+            if row[0] in offers:
+                offers[row[0]].offer_count += 1
+            else:
+                offers[row[0]] = BestOffer(**dict(zip(BEST_OFFER_FIELDS, row)), offer_count=1)
+        BestOffer.objects.filter(id__in=batch).delete()
+        BestOffer.objects.bulk_create(offers.values())
+
+
+def offers_changed(product_info_ids, reindex=None, products=None):
+    """
+    Обновляет производные от каталога данные после добавления или изменения товаров
+    :param product_info_ids: id измененных строк ProductInfo
+    :param reindex: id товаров, у которых изменились название, модель, категория или параметры,
+    None — все product_info_ids
+    :param products: множество, в которое добавляются id затронутых продуктов вместо пересборки
+    их лучших предложений; None — пересобрать сразу
+    :return: None
+    """
+    product_info_ids = list(product_info_ids)
+    product_ids = refresh_catalog_entries(product_info_ids)
+    if products is None:
+        refresh_best_offers(product_ids)
+    else:
+        products.update(product_ids)
+    get_search_backend().index(product_info_ids if reindex is None else reindex)
+
+
+def categories_renamed(category_ids):
+    """
+    Переносит новые названия категорий в строки каталога всех магазинов.
+
+    Категории общие для магазинов, поэтому меняется версия каталога каждого
+    магазина, у которого есть товары в этих категориях, а не только того, чей
+    прайс загружается: иначе закэшированные страницы и ETag других магазинов
+    остались бы со старым названием.
+    :param category_ids: id переименованных категорий
+    :return: None
+    """
+    offers_changed(ProductInfo.objects.filter(product__category_id__in=category_ids).values_list('id', flat=True))
+    for shop_id in CatalogEntry.objects.filter(category_id__in=category_ids).values_list(
+            'shop_id', flat=True).distinct().order_by():
+        bump_catalog_version(shop_id)
+
+
+def stock_changed(shop_id, product_infos, fields):
+    """
+    Переносит новые цены и остатки в строки каталога одним bulk_update, без пересборки строк,
+    и пересобирает лучшие предложения их продуктов
+    :param shop_id: id магазина
+    :param product_infos: объекты ProductInfo с id и новыми значениями полей
+    :param fields: измененные поля
+    :return: None
+    """
+    if product_infos:
+        bump_catalog_version(shop_id)
+    CatalogEntry.objects.bulk_update([CatalogEntry(id=product_info.id, **{
+        field: getattr(product_info, field) for field in fields}) for product_info in product_infos], fields)
+    refresh_best_offers(catalog_product_ids([product_info.id for product_info in product_infos]))
+
+
+def offers_deleted(product_info_ids, products=None):
+    """
+    Убирает удаленные товары из производных от каталога данных
+    :param product_info_ids: id удаленных строк ProductInfo
+    :param products: см. offers_changed()
+    :return: None
+    """
+    product_info_ids = list(product_info_ids)
+    product_ids = catalog_product_ids(product_info_ids)
+    for batch in chunked(product_info_ids, settings.IMPORT_BATCH_SIZE):
+        CatalogEntry.objects.filter(id__in=batch).delete()
+    if products is None:
+        refresh_best_offers(product_ids)
+    else:
+        products.update(product_ids)
+    get_search_backend().remove(product_info_ids)
+
+
+def shop_state_changed(shop_ids, state):
+    """
+    Переносит статус магазинов в строки каталога и пересобирает лучшие предложения продуктов,
+    которые эти магазины продают
+    :param shop_ids: id магазинов
+    :param state: новый статус получения заказов
+    :return: None
+    """
+    CatalogEntry.objects.filter(shop_id__in=shop_ids).update(shop_state=state)
+    refresh_best_offers(set(CatalogEntry.objects.filter(shop_id__in=shop_ids).values_list('product_id', flat=True)))
+    for shop_id in shop_ids:
+        bump_catalog_version(shop_id)
+
+
+def refresh_category_counts(shop_id):
+    """
+    Пересчитывает число предложений в наличии по категориям магазина в CategoryCount.
+
+    Выполняется одна группировка по строкам каталога магазина, удаление старых
+    строк и одна вставка. Категории магазина без товаров в наличии остаются с нулем.
+    :param shop_id: id магазина
+    :return: None
+    """
+    counts = dict.fromkeys(Category.shops.through.objects.filter(shop_id=shop_id).values_list(
+        'category_id', flat=True), 0)
+    counts.update(CatalogEntry.objects.filter(shop_id=shop_id, quantity__gt=0, category_id__isnull=False).values(
+        'category_id').annotate(offer_count=Count('id')).values_list('category_id', 'offer_count'))
+    CategoryCount.objects.filter(shop_id=shop_id).delete()
+    CategoryCount.objects.bulk_create([CategoryCount(category_id=category_id, shop_id=shop_id, offer_count=offer_count)
+                                       for category_id, offer_count in counts.items()])
+
+
+def shop_catalog_changed(shop_id, product_ids=()):
+    """
+    Перестраивает сводные данные по каталогу магазина после импорта: лучшие предложения затронутых продуктов
+    и число предложений по категориям сразу, индекс параметров — когда транзакция зафиксирована, и затем
+    меняет версию каталога магазина.
+
+    Лучшие предложения пересобираются здесь, один раз на импорт, а не в частях прайса: части пишутся
+    параллельно и не видят незафиксированные строки друг друга, поэтому пересборка в них гонялась бы
+    за строки BestOffer одних и тех же продуктов.
+    :param shop_id: id магазина
+    :param product_ids: id продуктов, затронутых импортом (CatalogImporter.touched_products)
+    :return: None
+    """
+    refresh_best_offers(product_ids)
+    refresh_category_counts(shop_id)
+    transaction.on_commit(lambda: build_facets(shop_id))
+    bump_catalog_version(shop_id)
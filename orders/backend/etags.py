@@ -0,0 +1,45 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from backend.catalog import catalog_version
+
+
+def make_etag(*parts):
+    """
+    Строгий ETag из дешевых признаков версии ответа (версии каталога, времени изменения заказов)
+    :param parts: значения, от которых зависит ответ
+    :return: ETag в кавычках
+    """
+    return quote_etag(hashlib.sha256(':'.join(str(part) for part in parts).encode()).hexdigest()[:32])
+
+
+def not_modified(request, etag):
+    """
+    Ответ 304, если клиент прислал этот ETag в If-None-Match.
+
+    Проверка идет до запросов за данными и сериализации.
+    :param request: запрос
+    :param etag: результат make_etag()
+    :return: HttpResponseNotModified или None
+    """
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in etags or '*' in etags:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    return None
+
+
+def orders_etag(orders, *parts):
+    """
+    ETag списка заказов: число заказов, время последнего изменения и общая версия каталога,
+    потому что в позициях заказов отдаются текущие цены и параметры товаров
+    :param orders: выборка Order, которую отдает представление
+    :param parts: прочие значения, от которых зависит ответ
+    :return: ETag в кавычках
+    """
+    state = orders.aggregate(count=Count('id', distinct=True), updated=Max('updated'))
+    return make_etag(*parts, state['count'], state['updated'], catalog_version())
@@ -0,0 +1,169 @@
+from array import array
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from backend.models import Parameter, ProductParameter
+
+
+def facet_key(shop_id):
+    return f'facets:{shop_id}'
+
+
+def build_facets(shop_id):
+    """
+    Строит обратный индекс параметров товаров магазина и сохраняет его в кэш.
+
+    Индекс хранится без срока жизни и перестраивается после каждого импорта.
+    :param shop_id: id магазина
+    :return: словарь название параметра -> значение -> отсортированный array id строк ProductInfo
+    """
+    facets = {}
+    for name, value, product_info_id in ProductParameter.objects.filter(
+            product_info__shop_id=shop_id).order_by('product_info_id').values_list(
+            'parameter__name', 'value', 'product_info_id').iterator():
+        facets.setdefault(name, {}).setdefault(value, array('q')).append(product_info_id)
+    cache.set(facet_key(shop_id), facets, timeout=None)
+    return facets
+
+
+def load_facets(shop_ids):
+    """
+    Индексы параметров магазинов, недостающие в кэше строятся заново
+    :param shop_ids: id магазинов
+    :return: словарь id магазина -> результат build_facets()
+    """
+    keys = {facet_key(shop_id): shop_id for shop_id in shop_ids}
+    loaded = {keys[key]: facets for key, facets in cache.get_many(keys).items()}
+    for shop_id in set(shop_ids) - loaded.keys():
+        loaded[shop_id] = build_facets(shop_id)
+    return loaded
+
+
+def parse_parameter_filters(values):
+    """
+    Разбирает фильтры вида "название:значение"
+    :param values: значения параметра запроса param
+    :return: словарь название -> множество значений
+    """
+    filters = {}
+    for item in values:
+        name, separator, value = item.partition(':')
+        if not separator or not name:
+            raise ValueError(f'Фильтр по параметру должен иметь вид "название:значение": {item}')
+        filters.setdefault(name, set()).add(value)
+    return filters
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Оставляет товары, у которых есть одно из выбранных значений каждого параметра
+    :param queryset: выборка CatalogEntry
+    :param filters: результат parse_parameter_filters()
+    :return: выборка CatalogEntry
+    """
+    for name, values in filters.items():
+        queryset = queryset.filter(id__in=ProductParameter.objects.filter(
+            parameter__name=name, value__in=values).values('product_info_id'))
+    return queryset
+
+
+def parse_range_filters(minimums, maximums):
+    """
+    Разбирает границы диапазонов вида "название:число"
+    :param minimums: значения параметра запроса param_min
+    :param maximums: значения параметра запроса param_max
+    :return: словарь название -> [нижняя граница или None, верхняя граница или None]
+    """
+    ranges = {}
+    for position, values in enumerate((minimums, maximums)):
+        for item in values:
+            name, separator, value = item.rpartition(':')
+            try:
+                bound = float(value.replace(',', '.'))
+            except ValueError:
+                bound = None
+            if not separator or not name or bound is None:
+                raise ValueError(f'Граница диапазона должна иметь вид "название:число": {item}')
+            ranges.setdefault(name, [None, None])[position] = bound
+    return ranges
+
+
+def filter_by_ranges(queryset, ranges):
+    """
+    Оставляет товары, у которых числовое значение параметра попадает в диапазон.
+
+    id параметров выбираются заранее, чтобы условие шло по индексу
+    (parameter, numeric_value) как поиск по диапазону.
+    :param queryset: выборка CatalogEntry
+    :param ranges: результат parse_range_filters()
+    :return: выборка CatalogEntry
+    """
+    for name, (minimum, maximum) in ranges.items():
+        conditions = {'parameter_id__in': list(Parameter.objects.filter(name=name).values_list('id', flat=True))}
+        if minimum is not None:
+            conditions['numeric_value__gte'] = minimum
+        if maximum is not None:
+            conditions['numeric_value__lte'] = maximum
+        queryset = queryset.filter(id__in=ProductParameter.objects.filter(**conditions).values('product_info_id'))
+    return queryset
+
+
+def facet_counts(shop_ids, filters):
+    """
+    Число товаров по каждому значению каждого параметра.
+
+    Счетчики параметра учитывают фильтры по остальным параметрам, но не по
+    нему самому, чтобы можно было выбрать несколько значений одного параметра.
+    :param shop_ids: id магазинов в выдаче
+    :param filters: результат parse_parameter_filters()
+    :return: словарь название параметра -> значение -> число товаров
+    """
+    index = {}
+    for facets in load_facets(shop_ids).values():
+        for name, values in facets.items():
+            for value, ids in values.items():
+                index.setdefault(name, {}).setdefault(value, []).append(ids)
+
+    selected = {name: set().union(*(ids for value in values for ids in index.get(name, {}).get(value, ())))
+                for name, values in filters.items()}
+    counts = {}
+    for name, values in index.items():
+        allowed = None
+        for other, ids in selected.items():
+            if other != name:
+                allowed = ids if allowed is None else allowed & ids
+        counts[name] = {}
+        for value, id_arrays in values.items():
+            if allowed is None:
+                count = sum(len(ids) for ids in id_arrays)
+            else:
+                count = sum(1 for ids in id_arrays for product_info_id in ids if product_info_id in allowed)
+            if count:
+                counts[name][value] = count
+    return {name: dict(sorted(values.items())) for name, values in sorted(counts.items()) if values}
+
+
+def count_facets(queryset, filters):
+    """
+    Те же счетчики, что и facet_counts(), для выдачи, суженной поиском, категорией или диапазонами.
+
+    id подходящих товаров не читаются в Python и индекс магазинов не
+    перебирается: счетчики считает база сгруппированным запросом по
+    параметрам этих товаров — один запрос на каждый параметр из фильтров
+    (без фильтра по нему самому) и один на остальные параметры.
+    :param queryset: выборка CatalogEntry без фильтров по параметрам
+    :param filters: результат parse_parameter_filters()
+    :return: словарь название параметра -> значение -> число товаров
+    """
+    groups = [(None, filters)] + [(name, {other: values for other, values in filters.items() if other != name})
+                                  for name in filters]
+    counts = {}
+    for name, other_filters in groups:
+        rows = ProductParameter.objects.filter(product_info_id__in=filter_by_parameters(
+            queryset, other_filters).values('id'))
+        rows = rows.exclude(parameter__name__in=filters) if name is None else rows.filter(parameter__name=name)
+        for parameter, value, count in rows.values('parameter__name', 'value').annotate(
+                count=Count('id')).order_by().values_list('parameter__name', 'value', 'count'):
+            counts.setdefault(parameter, {})[value] = count
+    return {name: dict(sorted(values.items())) for name, values in sorted(counts.items())}
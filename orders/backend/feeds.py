@@ -0,0 +1,520 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zlib
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+import requests
+import yaml
+from yaml.constructor import SafeConstructor
+from yaml.events import (AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent, SequenceEndEvent,
+                         SequenceStartEvent)
+from yaml.nodes import ScalarNode
+from yaml.resolver import Resolver
+
+from backend.utils import chunked
+
+try:
+    # парсер на libyaml, если pyyaml собран с ним
+    from yaml import CSafeDumper as FeedDumper, CSafeLoader as FeedLoader
+except ImportError:
+    from yaml import SafeDumper as FeedDumper, SafeLoader as FeedLoader
+
+STR_TAG = 'tag:yaml.org,2002:str'
+
+
+class FeedDownload:
+    """
+    Результат скачивания прайса: путь до временного файла и валидаторы для
+    следующего условного запроса. path равен None, если сервер ответил 304.
+    """
+
+    def __init__(self, path=None, etag='', last_modified='', digest='', size=0, content_type=''):
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.size = size
+        self.content_type = content_type
+
+    @property
+    def not_modified(self):
+        return self.path is None
+
+
+@contextmanager
+def fetch_feed(url, etag='', last_modified=''):
+    """
+    Скачивает прайс во временный файл частями, не держа его в памяти.
+
+    Если переданы etag или last_modified, запрос отправляется условным.
+    :param url: url до файла прайса
+    :param etag: ETag прошлой загрузки
+    :param last_modified: Last-Modified прошлой загрузки
+    :return: контекстный менеджер с FeedDownload, временный файл удаляется при выходе
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with requests.get(url, stream=True, timeout=settings.FEED_DOWNLOAD_TIMEOUT, headers=headers) as response:
+        if response.status_code == 304:
+            download = FeedDownload(etag=etag, last_modified=last_modified)
+        else:
+            response.raise_for_status()
+            digest, size = hashlib.sha256(), 0
+            with tempfile.NamedTemporaryFile(prefix='feed-', delete=False) as file:
+                try:
+                    for chunk in response.iter_content(chunk_size=settings.FEED_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        file.write(chunk)
+                except BaseException:
+                    os.remove(file.name)
+                    raise
+            download = FeedDownload(file.name, response.headers.get('ETag', ''),
+                                    response.headers.get('Last-Modified', ''), digest.hexdigest(), size,
+                                    response.headers.get('Content-Type', ''))
+    try:
+        yield download
+    finally:
+        if download.path:
+            os.remove(download.path)
+
+
+class FeedTooLarge(ValueError):
+    pass
+
+
+def store_feed(chunks, filename=''):
+    """
+    Сохраняет загруженный прайс в хранилище, не держа его в памяти.
+
+    Прайс, сжатый gzip, распаковывается на лету. Размер распакованного файла
+    ограничен FEED_UPLOAD_MAX_SIZE.
+    :param chunks: поток блоков байт
+    :param filename: имя загруженного файла, по его расширению определяется формат
+    :return: словарь с ключами name (путь в хранилище), filename, digest и size
+    """
+    filename = os.path.basename(filename)
+    if filename.lower().endswith('.gz'):
+        filename = filename[:-3]
+    digest, size = hashlib.sha256(), 0
+    decompressor = None
+    with tempfile.TemporaryFile(prefix='feed-') as file:
+        for chunk in chunks:
+            if decompressor is None:
+                # gzip определяется по сигнатуре, а не по заголовкам клиента
+                gzipped = chunk[:2] == b'\x1f\x8b'
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if gzipped else False
+            if decompressor:
+                try:
+                    chunk = decompressor.decompress(chunk, settings.FEED_UPLOAD_MAX_SIZE - size + 1)
+                except zlib.error:
+                    raise ValueError('Архив gzip поврежден')
+                if decompressor.unconsumed_tail:
+                    raise FeedTooLarge('Прайс больше допустимого размера')
+            size += len(chunk)
+            if size > settings.FEED_UPLOAD_MAX_SIZE:
+                raise FeedTooLarge('Прайс больше допустимого размера')
+            digest.update(chunk)
+            file.write(chunk)
+        if decompressor:
+            chunk = decompressor.flush()
+            size += len(chunk)
+            if size > settings.FEED_UPLOAD_MAX_SIZE:
+                raise FeedTooLarge('Прайс больше допустимого размера')
+            digest.update(chunk)
+            file.write(chunk)
+            if not decompressor.eof:
+                raise ValueError('Архив gzip поврежден')
+        if not size:
+            raise ValueError('Прайс пустой')
+        file.seek(0)
+        extension = os.path.splitext(filename)[1].lower()
+        name = default_storage.save(f'{settings.FEED_UPLOAD_DIR}/{uuid4().hex}{extension}', File(file))
+    return {'name': name, 'filename': filename, 'digest': digest.hexdigest(), 'size': size}
+
+
+@contextmanager
+def open_stored_feed(upload, content_type=''):
+    """
+    Открывает прайс, сохраненный store_feed, как результат скачивания.
+
+    Файл удаляется из хранилища при выходе.
+    :param upload: результат store_feed()
+    :param content_type: заголовок Content-Type загрузки
+    :return: контекстный менеджер с FeedDownload
+    """
+    try:
+        try:
+            path, temporary = default_storage.path(upload['name']), False
+        except NotImplementedError:
+            # хранилище без локальных путей: копия во временный файл
+            with default_storage.open(upload['name']) as source, \
+                    tempfile.NamedTemporaryFile(prefix='feed-', delete=False) as file:
+                for chunk in source.chunks(settings.FEED_CHUNK_SIZE):
+                    file.write(chunk)
+            path, temporary = file.name, True
+        try:
+            yield FeedDownload(path, digest=upload['digest'], size=upload['size'], content_type=content_type)
+        finally:
+            if temporary:
+                os.remove(path)
+    finally:
+        default_storage.delete(upload['name'])
+
+
+class YamlFeed:
+    """
+    Потоковое чтение прайса в формате data/shop1.yaml.
+
+    Документ разбирается по событиям парсера, поэтому в памяти одновременно
+    находится только один товар. Ключи shop и categories читаются при создании
+    объекта, а goods() отдает товары по одному. Если shop или categories идут
+    в файле после goods, документ сначала дочитывается без сборки товаров, а
+    затем читается заново с начала, поэтому такой порядок ключей требует файла
+    с поддержкой seek().
+    """
+
+    def __init__(self, file):
+        self.resolver = Resolver()
+        self.constructor = SafeConstructor()
+        self.anchors = {}
+        self.header = {}
+        self.finished = False
+        start = file.tell() if file.seekable() else None
+        self.events = yaml.parse(file, Loader=FeedLoader)
+        self._read_header()
+        if not self.finished and not {'shop', 'categories'} <= self.header.keys():
+            if start is None:
+                raise ValueError('Ключи shop и categories должны идти в прайсе до goods')
+            self._skip(next(self.events))
+            self._read_header()
+            header = self.header
+            file.seek(start)
+            self.events = yaml.parse(file, Loader=FeedLoader)
+            self.finished = False
+            self._read_header()
+            self.header = header
+        if 'shop' not in self.header:
+            raise ValueError('В прайсе не указан магазин')
+
+    @property
+    def shop(self):
+        return self.header['shop']
+
+    @property
+    def categories(self):
+        return self.header.get('categories') or []
+
+    def goods(self):
+        """
+        Отдает товары из раздела goods по одному
+        :return: генератор словарей товаров
+        """
+        if self.finished:
+            return
+        event = next(self.events)
+        if isinstance(event, SequenceStartEvent):
+            for event in self.events:
+                if isinstance(event, SequenceEndEvent):
+                    break
+                self.anchors.clear()
+                yield self._build(event)
+        self._read_header()
+
+    def _read_header(self):
+        for event in self.events:
+            if isinstance(event, MappingEndEvent):
+                self.finished = True
+                return
+            if isinstance(event, ScalarEvent):
+                if event.value == 'goods':
+                    return
+                self.header[event.value] = self._build(next(self.events))
+
+    def _skip(self, event):
+        depth = int(isinstance(event, (MappingStartEvent, SequenceStartEvent)))
+        while depth:
+            event = next(self.events)
+            if isinstance(event, (MappingStartEvent, SequenceStartEvent)):
+                depth += 1
+            elif isinstance(event, (MappingEndEvent, SequenceEndEvent)):
+                depth -= 1
+
+    def _build(self, event):
+        if isinstance(event, ScalarEvent):
+            value = self._scalar(event)
+        elif isinstance(event, SequenceStartEvent):
+            value = []
+            for item in self.events:
+                if isinstance(item, SequenceEndEvent):
+                    break
+                value.append(self._build(item))
+        elif isinstance(event, MappingStartEvent):
+            value = {}
+            for key in self.events:
+                if isinstance(key, MappingEndEvent):
+                    break
+                value[self._build(key)] = self._build(next(self.events))
+        elif isinstance(event, AliasEvent):
+            return self.anchors[event.anchor]
+        else:
+            raise ValueError(f'Неожиданное событие в прайсе: {event}')
+        if getattr(event, 'anchor', None):
+            self.anchors[event.anchor] = value
+        return value
+
+    def _scalar(self, event):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = self.resolver.resolve(ScalarNode, event.value, event.implicit)
+        if tag == STR_TAG:
+            return event.value
+        node = ScalarNode(tag, event.value, style=event.style)
+        return self.constructor.yaml_constructors[tag](self.constructor, node)
+
+
+class JsonFeed:
+    """
+    Прайс в формате JSON с той же структурой, что и yaml: объект с ключами
+    shop, categories и goods.
+
+    Документ читается целиком, поэтому для больших прайсов лучше NdjsonFeed.
+    """
+
+    def __init__(self, file):
+        self.data = json.load(file)
+        if not isinstance(self.data, dict) or 'shop' not in self.data:
+            raise ValueError('В прайсе не указан магазин')
+
+    @property
+    def shop(self):
+        return self.data['shop']
+
+    @property
+    def categories(self):
+        return self.data.get('categories') or []
+
+    def goods(self):
+        yield from self.data.get('goods') or []
+
+
+class NdjsonFeed:
+    """
+    Прайс в формате NDJSON: первая строка — объект с ключами shop и categories,
+    каждая следующая — один товар в том же виде, что и в разделе goods yaml.
+    Товары читаются по одной строке.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        header = json.loads(self._next_line() or 'null')
+        if not isinstance(header, dict) or 'shop' not in header:
+            raise ValueError('Первая строка прайса должна содержать магазин')
+        self.header = header
+
+    @property
+    def shop(self):
+        return self.header['shop']
+
+    @property
+    def categories(self):
+        return self.header.get('categories') or []
+
+    def goods(self):
+        while line := self._next_line():
+            yield json.loads(line)
+
+    def _next_line(self):
+        for line in self.file:
+            if line.strip():
+                return line
+        return None
+
+
+CSV_FIELDS = ('shop', 'category', 'category_name', 'id', 'name', 'model', 'price', 'price_rrc', 'quantity', 'photo')
+
+
+class CsvFeed:
+    """
+    Прайс в формате CSV: строка на товар, первая строка — заголовок.
+
+    Обязательные колонки: shop, category, category_name, id, name, model, price,
+    price_rrc, quantity; photo необязательна. Остальные колонки — параметры
+    товара, пустые значения пропускаются. Магазин и категории собираются
+    первым проходом по файлу, товары отдаются вторым.
+    """
+    INTEGER_FIELDS = ('category', 'id', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, file):
+        self.file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        self.start = self.file.tell()
+        reader = csv.DictReader(self.file)
+        missing = set(CSV_FIELDS) - {'photo'} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f'В прайсе нет колонок: {", ".join(sorted(missing))}')
+        self.parameters = [name for name in reader.fieldnames if name not in CSV_FIELDS]
+        self.shop = None
+        categories = {}
+        for row in reader:
+            self.shop = self.shop or row['shop']
+            categories.setdefault(int(row['category']), row['category_name'])
+        if not self.shop:
+            raise ValueError('В прайсе не указан магазин')
+        self.categories = [{'id': category_id, 'name': name} for category_id, name in categories.items()]
+
+    def goods(self):
+        self.file.seek(self.start)
+        for row in csv.DictReader(self.file):
+            good = {field: int(row[field]) for field in self.INTEGER_FIELDS}
+            good['name'] = row['name']
+            good['model'] = row['model']
+            good['photo'] = row.get('photo') or ''
+            good['parameters'] = {name: row[name] for name in self.parameters if row[name] not in ('', None)}
+            yield good
+
+
+FEED_FORMATS = {
+    'yaml': YamlFeed,
+    'json': JsonFeed,
+    'ndjson': NdjsonFeed,
+    'csv': CsvFeed,
+}
+CONTENT_TYPES = {
+    'application/x-yaml': 'yaml',
+    'application/yaml': 'yaml',
+    'text/yaml': 'yaml',
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+EXTENSIONS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+# товаров в одном вызове yaml.dump при записи прайса
+WRITE_BATCH_SIZE = 1000
+
+
+class Echo:
+    """
+    Файлоподобный объект для csv.writer, который возвращает записанную строку вместо записи
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_feed(feed_format, shop, categories, goods, parameters=None):
+    """
+    Отдает прайс в одном из форматов FEED_FORMATS по частям, товары читаются из goods по мере записи
+    :param feed_format: ключ FEED_FORMATS
+    :param shop: название магазина
+    :param categories: список словарей с ключами id и name
+    :param goods: поток словарей в формате раздела goods прайса
+    :param parameters: названия параметров для колонок csv, если не указаны — собираются по всем товарам
+    :return: генератор строк
+    """
+    header = {'shop': shop, 'categories': categories}
+    if feed_format == 'yaml':
+        yield yaml.dump(header, Dumper=FeedDumper, allow_unicode=True, sort_keys=False)
+        yield 'goods:\n'
+        for batch in chunked(goods, WRITE_BATCH_SIZE):
+            yield yaml.dump(batch, Dumper=FeedDumper, allow_unicode=True, sort_keys=False)
+    elif feed_format == 'json':
+        yield json.dumps(header, ensure_ascii=False)[:-1] + ', "goods": ['
+        for number, good in enumerate(goods):
+            yield (', ' if number else '') + json.dumps(good, ensure_ascii=False)
+        yield ']}\n'
+    elif feed_format == 'ndjson':
+        yield json.dumps(header, ensure_ascii=False) + '\n'
+        for good in goods:
+            yield json.dumps(good, ensure_ascii=False) + '\n'
+    elif feed_format == 'csv':
+        if parameters is None:
+            goods = list(goods)
+            parameters = list(dict.fromkeys(key for good in goods for key in good.get('parameters', {})))
+        names = {category['id']: category['name'] for category in categories}
+        writer = csv.writer(Echo())
+        yield writer.writerow([*CSV_FIELDS, *parameters])
+        for good in goods:
+            yield writer.writerow([shop, good['category'], names[good['category']], good['id'], good['name'],
+                                   good['model'], good['price'], good['price_rrc'], good['quantity'],
+                                   good.get('photo', ''),
+                                   *[good.get('parameters', {}).get(name, '') for name in parameters]])
+    else:
+        raise ValueError(f'Неизвестный формат прайса: {feed_format}')
+
+
+def write_feed(file, feed_format, shop, categories, goods, parameters=None):
+    """
+    Записывает прайс в файл, см. iter_feed
+    :param file: текстовый файл
+    :return: None
+    """
+    for chunk in iter_feed(feed_format, shop, categories, goods, parameters):
+        file.write(chunk)
+
+
+def detect_format(file, content_type='', url=''):
+    """
+    Определяет формат прайса по Content-Type, расширению в url или началу файла
+    :param file: файл прайса, открытый в двоичном режиме
+    :param content_type: заголовок Content-Type ответа
+    :param url: url прайса
+    :return: ключ FEED_FORMATS
+    """
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+
+    position = file.tell()
+    first_line = file.readline().strip()
+    file.seek(position)
+    if first_line.startswith(b'{'):
+        try:
+            header = json.loads(first_line)
+        except ValueError:
+            # многострочный JSON
+            return 'json'
+        # JSON в одну строку содержит товары, первая строка NDJSON — нет
+        return 'json' if 'goods' in header else 'ndjson'
+    if first_line.startswith(b'['):
+        return 'json'
+    if b',' in first_line and b':' not in first_line:
+        return 'csv'
+    return 'yaml'
+
+
+def open_feed(file, content_type='', url=''):
+    """
+    Открывает прайс подходящим парсером
+    :param file: файл прайса, открытый в двоичном режиме
+    :param content_type: заголовок Content-Type ответа
+    :param url: url прайса
+    :return: объект с атрибутами shop, categories и генератором goods()
+    """
+    return FEED_FORMATS[detect_format(file, content_type, url)](file)
@@ -0,0 +1,396 @@
+import re
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch, Q
+
+from backend.catalog import categories_renamed, offers_changed, offers_deleted, refresh_category_counts, stock_changed
+from backend.models import Category, OrderItem, Parameter, Product, ProductInfo, ProductParameter
+from backend.utils import chunked
+
+# поля ProductInfo, которые сравниваются при обновлении
+OFFER_FIELDS = ('product_id', 'model', 'price', 'price_rrc', 'quantity', 'photo_url')
+# поля, которые меняет update_stock
+STOCK_FIELDS = ('price', 'price_rrc', 'quantity')
+NUMBER = re.compile(r'-?\d+(?:[.,]\d+)?')
+
+
+def parse_number(value):
+    """
+    Числовое значение параметра для фильтров по диапазону
+    :param value: значение параметра строкой
+    :return: float или None, если значение не число
+    """
+    value = value.strip()
+    return float(value.replace(',', '.')) if NUMBER.fullmatch(value) else None
+
+
+def parse_stock(items):
+    """
+    Проверяет список обновлений цен и остатков
+    :param items: список [external_id, price, price_rrc, quantity] или словарей с такими ключами
+    :return: словарь external_id -> (price, price_rrc, quantity), при повторе побеждает последняя запись
+    """
+    if not isinstance(items, list):
+        raise ValueError('items должен быть списком')
+    stock = {}
+    for item in items:
+        if isinstance(item, dict):
+            item = [item.get(field) for field in ('external_id', *STOCK_FIELDS)]
+        if not isinstance(item, (list, tuple)) or len(item) != 4 or not all(
+                isinstance(value, int) and not isinstance(value, bool) and value >= 0 for value in item):
+            raise ValueError(f'Неверный формат строки: {item}')
+        stock[item[0]] = tuple(item[1:])
+    return stock
+
+
+def update_stock(shop_id, stock, batch_size=None):
+    """
+    Обновляет цены и остатки товаров магазина без полного импорта.
+
+    На пакет товаров выполняется один запрос на чтение и один bulk_update
+    только по изменившимся строкам, число предложений по категориям
+    пересчитывается один раз в конце. Вызывающий код должен оборачивать
+    обновление в transaction.atomic().
+    :param shop_id: id магазина
+    :param stock: результат parse_stock()
+    :param batch_size: размер пакета
+    :return: словарь с числом обновленных и неизмененных товаров и списком ненайденных external_id
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    result = {'updated': 0, 'unchanged': 0, 'not_found': []}
+    for batch in chunked(stock, batch_size):
+        changed, found = [], set()
+        for product_info_id, external_id, *values in ProductInfo.objects.filter(
+                shop_id=shop_id, external_id__in=batch).values_list('id', 'external_id', *STOCK_FIELDS):
+            found.add(external_id)
+            if tuple(values) != stock[external_id]:
+                changed.append(ProductInfo(id=product_info_id, **dict(zip(STOCK_FIELDS, stock[external_id]))))
+            else:
+                result['unchanged'] += 1
+        ProductInfo.objects.bulk_update(changed, STOCK_FIELDS)
+        stock_changed(shop_id, changed, STOCK_FIELDS)
+        result['updated'] += len(changed)
+        result['not_found'].extend(external_id for external_id in batch if external_id not in found)
+    if result['updated']:
+        refresh_category_counts(shop_id)
+    return result
+
+
+def export_goods(shop_id, batch_size=None):
+    """
+    Отдает товары магазина в формате раздела goods прайса.
+
+    Строки читаются серверным курсором пакетами по batch_size вместе с
+    параметрами, поэтому память не зависит от размера каталога.
+    :param shop_id: id магазина
+    :param batch_size: размер пакета
+    :return: генератор словарей товаров
+    """
+    product_infos = ProductInfo.objects.filter(shop_id=shop_id).select_related('product').prefetch_related(
+        Prefetch('product_parameters', queryset=ProductParameter.objects.select_related('parameter'))).order_by('id')
+    for product_info in product_infos.iterator(chunk_size=batch_size or settings.IMPORT_BATCH_SIZE):
+        good = {'id': product_info.external_id,
+                'category': product_info.product.category_id,
+                'model': product_info.model,
+                'name': product_info.product.name,
+                'price': product_info.price,
+                'price_rrc': product_info.price_rrc,
+                'quantity': product_info.quantity,
+                'parameters': {parameter.parameter.name: parameter.value
+                               for parameter in product_info.product_parameters.all()}}
+        if product_info.photo_url:
+            good['photo'] = product_info.photo_url
+        yield good
+
+
+def export_categories(shop_id):
+    """
+    Категории для раздела categories выгрузки: привязанные к магазину и те, в которых есть его товары,
+    даже если категория к магазину не привязана
+    :param shop_id: id магазина
+    :return: список словарей с ключами id и name
+    """
+    return [{'id': category_id, 'name': name} for category_id, name in Category.objects.filter(
+        Q(shops=shop_id) | Q(products__product_infos__shop_id=shop_id)).order_by('id').values_list(
+        'id', 'name').distinct()]
+
+
+def export_parameters(shop_id):
+    """
+    Названия параметров товаров магазина, нужны для колонок csv до выгрузки товаров
+    :param shop_id: id магазина
+    :return: список названий
+    """
+    return list(Parameter.objects.filter(product_parameters__product_info__shop_id=shop_id).order_by(
+        'name').values_list('name', flat=True).distinct())
+
+
+class CatalogImporter:
+    """
+    Пакетный импорт каталога магазина.
+
+    Id категорий, продуктов и параметров берутся из словарей в памяти,
+    которые заполняются несколькими запросами на пакет, а строки ProductInfo
+    и ProductParameter пишутся через bulk_create/bulk_update. Число запросов
+    к базе зависит от числа пакетов, а не от числа товаров.
+
+    Товары сопоставляются с уже загруженными по (магазин, external_id):
+    новые вставляются, измененные обновляются, неизменные не трогаются.
+    Вызывающий код должен оборачивать импорт в transaction.atomic().
+
+    Импорт делится на два шага: prepare() переводит товары в строки с готовыми
+    id (меняет общие справочники, поэтому выполняется в одном процессе),
+    а write_rows() пишет строки и может выполняться параллельно для разных
+    частей прайса, в том числе в разных задачах celery. Лучшие предложения
+    затронутых продуктов пересобирает shop_catalog_changed() после импорта.
+    """
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        self.shop = shop
+        # вызывается на границах пакетов с приращениями статистики, например ImportJobTracker.add
+        self.progress = progress
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        # (название, id категории) -> id продукта
+        self.products = {}
+        # название параметра -> id параметра, загружается при первом обращении
+        self.parameters = None
+        # external_id уже подготовленных товаров
+        self.external_ids = set()
+        # id строк ProductInfo, которые есть в текущем прайсе
+        self.seen = set()
+        # в прайсе есть ссылки на фото, которые нужно загрузить после импорта
+        self.has_photos = False
+        # id продуктов, чьи лучшие предложения пересоберет shop_catalog_changed() после импорта
+        self.touched_products = set()
+        self.stats = {'parsed': 0, 'inserted': 0, 'updated': 0, 'deleted': 0}
+
+    def import_categories(self, categories):
+        """
+        Создает недостающие категории, обновляет названия и привязывает категории к магазину
+        :param categories: список словарей с ключами id и name
+        :return: None
+        """
+        names = {category['id']: category['name'] for category in categories}
+        if not names:
+            return
+        existing = dict(Category.objects.filter(id__in=names).values_list('id', 'name'))
+        Category.objects.bulk_create([Category(id=category_id, name=name)
+                                      for category_id, name in names.items() if category_id not in existing])
+        Category.objects.bulk_update([Category(id=category_id, name=names[category_id])
+                                      for category_id, name in existing.items() if name != names[category_id]],
+                                     ['name'])
+        renamed = [category_id for category_id, name in existing.items() if name != names[category_id]]
+        if renamed:
+            categories_renamed(renamed)
+        CategoryShops = Category.shops.through
+        CategoryShops.objects.bulk_create([CategoryShops(category_id=category_id, shop_id=self.shop.id)
+                                           for category_id in names], ignore_conflicts=True)
+
+    def clear(self):
+        """
+        Удаляет текущий каталог магазина целиком (полная перезагрузка вместо сравнения)
+        :return: None
+        """
+        offers_deleted(ProductInfo.objects.filter(shop_id=self.shop.id).values_list('id', flat=True),
+                       products=self.touched_products)
+        deleted, per_model = ProductInfo.objects.filter(shop_id=self.shop.id).delete()
+        self._count(deleted=per_model.get(ProductInfo._meta.label, 0))
+
+    def import_goods(self, goods):
+        """
+        Записывает товары пакетами по batch_size
+        :param goods: поток словарей в формате раздела goods прайса
+        :return: None
+        """
+        for batch in chunked(goods, self.batch_size):
+            self.write_batch(batch)
+
+    def write_batch(self, goods):
+        """
+        Сравнивает пакет товаров с базой и записывает только изменения
+        :param goods: список словарей в формате раздела goods прайса
+        :return: None
+        """
+        self.write_rows(self.prepare(goods))
+
+    def prepare(self, goods):
+        """
+        Создает недостающие продукты и параметры и переводит товары в строки для write_rows
+        :param goods: список словарей в формате раздела goods прайса
+        :return: список словарей с полями ProductInfo и ключом parameters {id параметра: значение}
+        """
+        rows = []
+        for batch in chunked(goods, self.batch_size):
+            self._count(parsed=len(batch))
+            # при повторе external_id в прайсе побеждает первая запись
+            batch = [good for good in {good['id']: good for good in reversed(batch)}.values()
+                     if good['id'] not in self.external_ids]
+            self.external_ids.update(good['id'] for good in batch)
+            self._resolve_products(batch)
+            self._resolve_parameters(batch)
+            for good in batch:
+                row = self._offer_fields(good)
+                row['parameters'] = {self.parameters[key]: str(value)
+                                     for key, value in good.get('parameters', {}).items()}
+                self.has_photos = self.has_photos or bool(row['photo_url'])
+                rows.append(row)
+        return rows
+
+    def write_rows(self, rows):
+        """
+        Сравнивает подготовленные строки с базой и записывает только изменения
+        :param rows: результат prepare()
+        :return: None
+        """
+        for batch in chunked(rows, self.batch_size):
+            self._write_rows(batch)
+
+    def _write_rows(self, rows):
+        existing = {row['external_id']: row for row in ProductInfo.objects.filter(
+            shop_id=self.shop.id, external_id__in=[row['external_id'] for row in rows]).order_by('id').values(
+            'id', 'external_id', *OFFER_FIELDS)}
+        existing_parameters = {}
+        for product_info_id, parameter_id, value in ProductParameter.objects.filter(
+                product_info_id__in=[row['id'] for row in existing.values()]).values_list(
+                'product_info_id', 'parameter_id', 'value'):
+            existing_parameters.setdefault(product_info_id, {})[parameter_id] = value
+
+        new_goods, updated_offers, changed_parameters, changed_photos = [], [], {}, []
+        # строки, у которых поменялись поля поискового индекса
+        reindexed = set()
+        updated = 0
+        for offer in rows:
+            offer = dict(offer)
+            parameters = offer.pop('parameters')
+            row = existing.get(offer['external_id'])
+            if row is None:
+                new_goods.append((offer, parameters))
+                continue
+            self.seen.add(row['id'])
+            offer_changed = any(row[field] != value for field, value in offer.items())
+            if offer_changed:
+                updated_offers.append(ProductInfo(id=row['id'], **offer))
+                if (row['product_id'], row['model']) != (offer['product_id'], offer['model']):
+                    reindexed.add(row['id'])
+            if row['photo_url'] != offer['photo_url']:
+                changed_photos.append(row['id'])
+            if existing_parameters.get(row['id'], {}) != parameters:
+                changed_parameters[row['id']] = parameters
+            if offer_changed or row['id'] in changed_parameters:
+                updated += 1
+
+        product_infos = ProductInfo.objects.bulk_create(
+            [ProductInfo(shop_id=self.shop.id, **offer) for offer, _ in new_goods],
+            batch_size=self.batch_size)
+        self._fill_missing_pks(product_infos)
+        self.seen.update(product_info.pk for product_info in product_infos)
+        for product_info, (_, parameters) in zip(product_infos, new_goods):
+            changed_parameters[product_info.pk] = parameters
+
+        ProductInfo.objects.bulk_update(updated_offers, OFFER_FIELDS, batch_size=self.batch_size)
+        # фото по новой ссылке загрузит ingest_photos
+        ProductInfo.objects.filter(id__in=changed_photos).update(photo='')
+        ProductParameter.objects.filter(
+            product_info_id__in=[product_info_id for product_info_id in changed_parameters
+                                 if product_info_id in existing_parameters]).delete()
+        ProductParameter.objects.bulk_create(
+            [ProductParameter(product_info_id=product_info_id, parameter_id=parameter_id, value=value,
+                              numeric_value=parse_number(value))
+             for product_info_id, parameters in changed_parameters.items()
+             for parameter_id, value in parameters.items()],
+            batch_size=self.batch_size)
+        # цена, остаток и фото не входят в поисковый индекс, но попадают в CatalogEntry
+        offers_changed(sorted(reindexed.union(changed_parameters, changed_photos,
+                                              (product_info.id for product_info in updated_offers))),
+                       reindex=sorted(reindexed.union(changed_parameters)), products=self.touched_products)
+        self._count(inserted=len(product_infos), updated=updated)
+
+    def result(self):
+        """
+        Итог работы для объединения с результатами других частей прайса через merge()
+        :return: словарь со статистикой, id записанных строк и id затронутых продуктов
+        """
+        return {'stats': self.stats, 'seen': list(self.seen), 'products': list(self.touched_products)}
+
+    def merge(self, result):
+        """
+        Добавляет итог работы другого импортера того же прайса
+        :param result: результат result()
+        :return: None
+        """
+        for key, value in result['stats'].items():
+            self.stats[key] += value
+        self.seen.update(result['seen'])
+        # результаты задач, поставленных до появления ключа products, его не содержат
+        self.touched_products.update(result.get('products', ()))
+
+    def delete_missing(self):
+        """
+        Удаляет товары магазина, которых нет в прайсе.
+
+        Строки, на которые ссылаются заказы, не удаляются, а снимаются
+        с продажи (quantity=0), чтобы не потерять историю заказов.
+        :return: None
+        """
+        stale = ProductInfo.objects.filter(shop_id=self.shop.id).values_list('id', flat=True)
+        stale = [product_info_id for product_info_id in stale.iterator() if product_info_id not in self.seen]
+        ordered = Exists(OrderItem.objects.filter(product_info_id=OuterRef('pk')))
+        for batch in chunked(stale, self.batch_size):
+            kept = set(ProductInfo.objects.filter(ordered, id__in=batch).values_list('id', flat=True))
+            withdrawn = ProductInfo.objects.filter(id__in=kept).exclude(quantity=0).update(quantity=0)
+            offers_changed(kept, reindex=(), products=self.touched_products)
+            offers_deleted([product_info_id for product_info_id in batch if product_info_id not in kept],
+                           products=self.touched_products)
+            deleted, per_model = ProductInfo.objects.filter(id__in=batch).exclude(id__in=kept).delete()
+            self._count(updated=withdrawn, deleted=per_model.get(ProductInfo._meta.label, 0))
+
+    def _count(self, **counters):
+        for key, value in counters.items():
+            self.stats[key] += value
+        if self.progress:
+            self.progress(**counters)
+
+    def _offer_fields(self, good):
+        return {'product_id': self.products[(good['name'], good['category'])],
+                'external_id': good['id'],
+                'model': good['model'],
+                'price': good['price'],
+                'price_rrc': good['price_rrc'],
+                'quantity': good['quantity'],
+                'photo_url': good.get('photo', '')}
+
+    def _resolve_products(self, goods):
+        missing = {(good['name'], good['category']) for good in goods} - self.products.keys()
+        if not missing:
+            return
+        self._load_products({name for name, _ in missing})
+        new_products = [Product(name=name, category_id=category_id)
+                        for name, category_id in missing - self.products.keys()]
+        if new_products:
+            Product.objects.bulk_create(new_products, batch_size=self.batch_size)
+            self._load_products({product.name for product in new_products})
+
+    def _load_products(self, names):
+        for name, category_id, product_id in Product.objects.filter(
+                name__in=names).order_by('id').values_list('name', 'category_id', 'id'):
+            self.products.setdefault((name, category_id), product_id)
+
+    def _resolve_parameters(self, goods):
+        if self.parameters is None:
+            self.parameters = dict(Parameter.objects.values_list('name', 'id'))
+        missing = {key for good in goods for key in good.get('parameters', {})} - self.parameters.keys()
+        if not missing:
+            return
+        Parameter.objects.bulk_create([Parameter(name=name) for name in missing], batch_size=self.batch_size)
+        self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def _fill_missing_pks(self, product_infos):
+        # не все базы возвращают id строк из bulk_create
+        if all(product_info.pk for product_info in product_infos):
+            return
+        ids = {(product_id, external_id): pk for product_id, external_id, pk in ProductInfo.objects.filter(
+            shop_id=self.shop.id,
+            external_id__in={product_info.external_id for product_info in product_infos}).values_list(
+            'product_id', 'external_id', 'id')}
+        for product_info in product_infos:
+            product_info.pk = ids[(product_info.product_id, product_info.external_id)]
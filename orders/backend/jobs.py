@@ -0,0 +1,109 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from backend.models import ImportJob
+
+# счетчики импорта: имя в кэше -> поле ImportJob
+COUNTERS = {
+    'parsed': 'rows_parsed',
+    'inserted': 'rows_inserted',
+    'updated': 'rows_updated',
+    'deleted': 'rows_deleted',
+    'bytes': 'bytes_downloaded',
+}
+PHASES = ('download', 'prepare', 'write', 'finish')
+
+
+class ImportJobTracker:
+    """
+    Счетчики и длительности этапов импорта для ImportJob.
+
+    Импорт идет в транзакции, поэтому текущие значения копятся в кэше:
+    они видны сразу, обновляются на границах пакетов и суммируются между
+    задачами celery, которые пишут части одного прайса. В базу они
+    переносятся при завершении импорта.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def key(self, name):
+        return f'import-job:{self.job_id}:{name}'
+
+    def keys(self):
+        return [self.key(name) for name in COUNTERS] + [self.key(f'time:{phase}') for phase in PHASES]
+
+    def add(self, **counters):
+        """
+        Увеличивает счетчики
+        :param counters: приращения счетчиков из COUNTERS
+        :return: None
+        """
+        for name, value in counters.items():
+            if value:
+                self._incr(name, value)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Добавляет длительность блока к времени этапа
+        :param name: этап из PHASES
+        :return: контекстный менеджер
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._incr(f'time:{name}', round((time.perf_counter() - started) * 1000))
+
+    def progress(self):
+        """
+        Текущие значения счетчиков
+        :return: словарь с полями ImportJob
+        """
+        values = cache.get_many(self.keys())
+        progress = {field: values.get(self.key(name), 0) for name, field in COUNTERS.items()}
+        progress['timings'] = {phase: values[self.key(f'time:{phase}')] / 1000
+                               for phase in PHASES if self.key(f'time:{phase}') in values}
+        return progress
+
+    def apply(self, job):
+        """
+        Подставляет текущие значения счетчиков в выполняющийся ImportJob
+        :param job: экземпляр ImportJob
+        :return: None
+        """
+        for field, value in self.progress().items():
+            setattr(job, field, value)
+
+    def start(self, **fields):
+        """
+        Отмечает начало импорта
+        :param fields: дополнительные поля ImportJob
+        :return: None
+        """
+        ImportJob.objects.filter(id=self.job_id).update(state='running', started_at=timezone.now(), **fields)
+
+    def finish(self, state, stats=None, error=''):
+        """
+        Записывает итог импорта в базу и очищает кэш
+        :param state: итоговый статус
+        :param stats: статистика CatalogImporter, точнее счетчиков в кэше
+        :param error: текст ошибки
+        :return: None
+        """
+        progress = self.progress()
+        for name, value in (stats or {}).items():
+            progress[COUNTERS[name]] = value
+        ImportJob.objects.filter(id=self.job_id).update(state=state, error=error, finished_at=timezone.now(),
+                                                        **progress)
+        cache.delete_many(self.keys())
+
+    def _incr(self, name, value):
+        key = self.key(name)
+        cache.add(key, 0, timeout=settings.IMPORT_CHUNK_TIMEOUT)
+        cache.incr(key, value)
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import yaml
+from yaml import Loader, load as load_yaml
+
+from backend.feeds import FeedLoader, YamlFeed
+
+
+def write_scaled_feed(source, path, copies):
+    """
+    Записывает копию прайса, в которой список товаров повторен copies раз
+    :param source: путь до исходного прайса
+    :param path: путь до создаваемого файла
+    :param copies: во сколько раз увеличить список товаров
+    :return: число товаров в созданном файле
+    """
+    with open(source, 'rb') as file:
+        data = load_yaml(file, Loader=Loader)
+    goods = data.pop('goods')
+    step = max(good['id'] for good in goods) + 1
+    with open(path, 'w', encoding='utf-8') as file:
+        yaml.safe_dump(data, file, allow_unicode=True, sort_keys=False)
+        file.write('goods:\n')
+        for copy in range(copies):
+            yaml.safe_dump([dict(good, id=good['id'] + copy * step) for good in goods], file,
+                           allow_unicode=True, sort_keys=False)
+    return len(goods) * copies
+
+
+def parse_with_loader(path):
+    with open(path, 'rb') as file:
+        return len(load_yaml(file, Loader=Loader)['goods'])
+
+
+def parse_streaming(path):
+    with open(path, 'rb') as file:
+        return sum(1 for _ in YamlFeed(file).goods())
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость разбора прайса yaml.Loader и потокового парсера на увеличенных копиях data/shop1.yaml'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.BASE_DIR.parent / 'data' / 'shop1.yaml'))
+        parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000],
+                            help='во сколько раз увеличить список товаров')
+        parser.add_argument('--memory', action='store_true',
+                            help='дополнительно измерить пиковое потребление памяти через tracemalloc')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Потоковый парсер: {FeedLoader.__name__}')
+        parsers = (('yaml.Loader', parse_with_loader), ('YamlFeed', parse_streaming))
+        for scale in options['scales']:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'feed.yaml')
+                goods = write_scaled_feed(options['source'], path, scale)
+                size = os.path.getsize(path) / 1024 / 1024
+                self.stdout.write(f'x{scale}: {goods} товаров, {size:.1f} МБ')
+                for name, parse in parsers:
+                    started = time.perf_counter()
+                    parsed = parse(path)
+                    elapsed = time.perf_counter() - started
+                    line = f'  {name:12} {elapsed:8.2f} с {parsed / elapsed:12.0f} товаров/с {size / elapsed:8.2f} МБ/с'
+                    if options['memory']:
+                        tracemalloc.start()
+                        parse(path)
+                        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                        tracemalloc.stop()
+                        line += f' пик памяти {peak:.1f} МБ'
+                    self.stdout.write(line)
@@ -0,0 +1,169 @@
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from backend.catalog import bump_catalog_version, catalog_product_ids, offers_deleted
+from backend.feeds import FEED_FORMATS
+from backend.management.commands.generate_feed import (CATEGORY_ID_START, PARAMETERS, generate_categories,
+                                                       write_generated_feed)
+from backend.models import Category, ImportJob, Product, ProductInfo, Shop, User
+from backend.tasks import do_import
+from orders.celery import app as celery_app
+
+EXTENSIONS = {'yaml': '.yaml', 'json': '.json', 'ndjson': '.ndjson', 'csv': '.csv'}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryCounter:
+    """
+    Считает запросы к базе, не сохраняя их текст
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def peak_rss_mb():
+    # ru_maxrss — максимум за всю жизнь процесса: в килобайтах на Linux и в байтах на macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет do_import на сгенерированных прайсах через локальный HTTP-сервер: время, число запросов, '
+            'пиковую память и скорость в товарах в секунду. Результат пишется в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                            help='число товаров в прайсах, лучше по возрастанию: пиковая память считается на процесс')
+        parser.add_argument('--parameters', type=int, default=len(PARAMETERS), help='число параметров у товара')
+        parser.add_argument('--format', default='yaml', choices=sorted(FEED_FORMATS))
+        parser.add_argument('--output', help='файл для результата в JSON, по умолчанию вывод в консоль')
+
+    def handle(self, *args, **options):
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'format': options['format'],
+            'parameters': options['parameters'],
+            'batch_size': settings.IMPORT_BATCH_SIZE,
+            'chunk_size': settings.IMPORT_CHUNK_SIZE,
+            'results': [],
+        }
+        # части большого прайса выполняются в этом же процессе, чтобы их запросы и память попали в замер
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                try:
+                    for size in options['sizes']:
+                        report['results'].extend(self.run_size(server, directory, size, options))
+                finally:
+                    server.shutdown()
+                    server.server_close()
+        finally:
+            celery_app.conf.task_always_eager = always_eager
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_size(self, server, directory, size, options):
+        """
+        Импорт нового прайса, повтор без изменений и импорт прайса с измененными товарами
+        :return: список результатов по сценариям
+        """
+        name = f'feed-{size}{EXTENSIONS[options["format"]]}'
+        path = os.path.join(directory, name)
+        url = f'http://127.0.0.1:{server.server_address[1]}/{name}'
+        write_generated_feed(path, options['format'], size, options['parameters'])
+
+        existing_categories = set(Category.objects.filter(
+            id__in=[category['id'] for category in generate_categories()]).values_list('id', flat=True))
+        user = User.objects.create_user(f'benchmark-{uuid4().hex}@example.com', uuid4().hex, type='shop',
+                                        is_active=True)
+        results = []
+        try:
+            for scenario, revision in (('initial', None), ('unchanged', None), ('update', 1)):
+                if revision is not None:
+                    write_generated_feed(path, options['format'], size, options['parameters'], revision=revision)
+                    # Last-Modified отдается с точностью до секунды
+                    modified = os.path.getmtime(path) + 2
+                    os.utime(path, (modified, modified))
+                result = self.measure(url, user)
+                result.update(scenario=scenario, goods=size, file_mb=round(os.path.getsize(path) / 1024 / 1024, 2))
+                results.append(result)
+                self.stderr.write(f'{size} {scenario}: {result["wall_seconds"]} с, {result["queries"]} запросов, '
+                                  f'{result["rows_per_second"]} товаров/с')
+        finally:
+            self.cleanup(user, existing_categories)
+        return results
+
+    def cleanup(self, user, existing_categories):
+        """
+        Удаляет магазин замера вместе с его строками каталога, лучших предложений, числа предложений
+        по категориям и поискового индекса, а также созданные им продукты и категории
+        :param user: пользователь магазина замера
+        :param existing_categories: id сгенерированных категорий, которые были в базе до замера
+        :return: None
+        """
+        with transaction.atomic():
+            shop_ids = list(Shop.objects.filter(user=user).values_list('id', flat=True))
+            offer_ids = list(ProductInfo.objects.filter(shop_id__in=shop_ids).values_list('id', flat=True))
+            product_ids = catalog_product_ids(offer_ids)
+            offers_deleted(offer_ids)
+            # вместе с магазинами каскадом удаляются их товары и строки CategoryCount
+            user.delete()
+            Product.objects.filter(id__in=product_ids, product_infos__isnull=True).delete()
+            Category.objects.filter(id__gte=CATEGORY_ID_START, id__lt=CATEGORY_ID_START + len(
+                generate_categories())).exclude(id__in=existing_categories).delete()
+            for shop_id in shop_ids:
+                bump_catalog_version(shop_id)
+
+    def measure(self, url, user):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            do_import(url, user.id)
+        wall = time.perf_counter() - started
+        job = ImportJob.objects.filter(user=user).first()
+        return {
+            'wall_seconds': round(wall, 3),
+            'queries': counter.count,
+            'peak_rss_mb': peak_rss_mb(),
+            'rows_per_second': round(job.rows_parsed / wall, 1),
+            'state': job.state,
+            'stats': {'parsed': job.rows_parsed, 'inserted': job.rows_inserted, 'updated': job.rows_updated,
+                      'deleted': job.rows_deleted},
+            'bytes_downloaded': job.bytes_downloaded,
+            'timings': job.timings,
+        }
@@ -0,0 +1,94 @@
+import json
+import platform
+import time
+
+import django
+from cachalot.api import cachalot_disabled
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from backend.management.commands.benchmark_import import QueryCounter
+from backend.models import CatalogEntry, Order, ProductInfo
+from backend.payloads import PRODUCT_FIELDS, catalog_payload, catalog_values, order_payload, with_total_sum
+from backend.serializers import CatalogEntrySerializer, OrderSerializer, ProductInfoSerializer
+
+# поля товара при compact=1
+COMPACT_FIELDS = tuple(field for field in PRODUCT_FIELDS if field != 'product_parameters')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает сериализаторы DRF и сборку ответов из values() (backend.payloads) на товарах и заказах '
+            'из базы: объекты в секунду и число запросов. Результат пишется в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='число товаров и заказов в одном замере')
+        parser.add_argument('--repeat', type=int, default=5, help='число повторов, в результат идет лучший')
+        parser.add_argument('--output', help='файл для результата в JSON, по умолчанию вывод в консоль')
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        entry_ids = list(CatalogEntry.objects.order_by('id').values_list('id', flat=True)[:limit])
+        order_ids = list(Order.objects.order_by('id').values_list('id', flat=True)[:limit])
+        if not entry_ids:
+            raise CommandError('Каталог пуст: загрузите прайс, например сгенерированный командой generate_feed')
+
+        cases = {
+            'products': (len(entry_ids), {
+                'product_info_serializer': lambda: ProductInfoSerializer(
+                    ProductInfo.objects.filter(id__in=entry_ids).select_related('product__category').prefetch_related(
+                        'product_parameters__parameter'), many=True).data,
+                'catalog_entry_serializer': lambda: CatalogEntrySerializer(
+                    CatalogEntry.objects.filter(id__in=entry_ids), many=True).data,
+                'payload': lambda: catalog_payload(CatalogEntry.objects.filter(id__in=entry_ids).values(
+                    *catalog_values(PRODUCT_FIELDS))),
+                'payload_compact': lambda: catalog_payload(CatalogEntry.objects.filter(id__in=entry_ids).values(
+                    *catalog_values(COMPACT_FIELDS)), COMPACT_FIELDS),
+            }),
+        }
+        if order_ids:
+            cases['orders'] = (len(order_ids), {
+                'order_serializer': lambda: OrderSerializer(with_total_sum(Order.objects.filter(
+                    id__in=order_ids)).prefetch_related(
+                    'ordered_items__product_info__product__category',
+                    'ordered_items__product_info__product_parameters__parameter').select_related('contact'),
+                    many=True).data,
+                'payload': lambda: order_payload(with_total_sum(Order.objects.filter(id__in=order_ids))),
+                'payload_compact': lambda: order_payload(with_total_sum(Order.objects.filter(id__in=order_ids)),
+                                                         COMPACT_FIELDS, {'product_info'}),
+            })
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'results': [],
+        }
+        for case, (objects, variants) in cases.items():
+            for variant, build in variants.items():
+                result = self.measure(build, options['repeat'])
+                result.update(case=case, variant=variant, objects=objects,
+                              objects_per_second=round(objects / result['seconds'], 1))
+                report['results'].append(result)
+                self.stderr.write(f'{case} {variant}: {result["objects_per_second"]} объектов/с, '
+                                  f'{result["queries"]} запросов')
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def measure(self, build, repeat):
+        timings = []
+        for _ in range(repeat):
+            counter = QueryCounter()
+            started = time.perf_counter()
+            # повторы должны читать базу, а не кэш cachalot
+            with cachalot_disabled(), connection.execute_wrapper(counter):
+                build()
+            timings.append(time.perf_counter() - started)
+        return {'seconds': round(min(timings), 6), 'queries': counter.count}
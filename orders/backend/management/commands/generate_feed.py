@@ -0,0 +1,113 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from backend.feeds import FEED_FORMATS, write_feed
+
+# категории и параметры как в data/shop1.yaml, id категорий взяты из диапазона,
+# которого нет в реальных прайсах, чтобы сгенерированный прайс не затирал их названия
+CATEGORIES = ('Смартфоны', 'Аксессуары', 'Flash-накопители', 'Телевизоры')
+CATEGORY_ID_START = 900000
+PARAMETERS = ('Диагональ (дюйм)', 'Разрешение (пикс)', 'Встроенная память (Гб)', 'Цвет')
+COLORS = ('черный', 'белый', 'красный', 'золотистый', 'серебристый', 'синий')
+GOOD_ID_START = 10000000
+
+
+def generate_categories(count=len(CATEGORIES)):
+    """
+    Список категорий прайса
+    :param count: число категорий
+    :return: список словарей с ключами id и name
+    """
+    return [{'id': CATEGORY_ID_START + number,
+             'name': CATEGORIES[number] if number < len(CATEGORIES) else f'Категория {number}'}
+            for number in range(count)]
+
+
+def parameter_names(count):
+    """
+    Названия параметров товаров: сначала параметры из data/shop1.yaml, затем синтетические
+    :param count: число параметров
+    :return: список названий
+    """
+    return [PARAMETERS[number] if number < len(PARAMETERS) else f'Параметр {number}' for number in range(count)]
+
+
+def parameter_value(name, rng):
+    if name == 'Диагональ (дюйм)':
+        return rng.choice((5.5, 6.1, 6.5, 32, 43, 55))
+    if name == 'Разрешение (пикс)':
+        return rng.choice(('1792x828', '2688x1242', '1920x1080', '3840x2160'))
+    if name == 'Встроенная память (Гб)':
+        return rng.choice((16, 32, 64, 128, 256, 512))
+    if name == 'Цвет':
+        return rng.choice(COLORS)
+    return rng.randint(1, 1000)
+
+
+def generate_goods(count, parameters=len(PARAMETERS), categories=None, seed=0, revision=0):
+    """
+    Генерирует товары в формате раздела goods data/shop1.yaml.
+
+    При одинаковых count, parameters и seed товары совпадают, а revision
+    меняет цену и остаток каждого десятого товара, чтобы проверить обновление прайса.
+    :param count: число товаров
+    :param parameters: число параметров у товара
+    :param categories: результат generate_categories()
+    :param seed: зерно генератора случайных чисел
+    :param revision: номер версии прайса
+    :return: генератор словарей товаров
+    """
+    rng = random.Random(seed)
+    categories = categories or generate_categories()
+    names = parameter_names(parameters)
+    for number in range(count):
+        category = categories[number % len(categories)]
+        price = rng.randint(10, 2000) * 100
+        quantity = rng.randint(0, 50)
+        if revision and number % 10 == 0:
+            price += revision * 100
+            quantity = (quantity + revision) % 51
+        yield {'id': GOOD_ID_START + number,
+               'category': category['id'],
+               'model': f'brand{number % 97}/model-{number % 1009}',
+               'name': f'{category["name"]} Модель {number}',
+               'price': price,
+               'price_rrc': price + price // 10,
+               'quantity': quantity,
+               'parameters': {name: parameter_value(name, rng) for name in names}}
+
+
+def write_generated_feed(path, feed_format, goods, parameters=len(PARAMETERS), seed=0, revision=0):
+    """
+    Записывает сгенерированный прайс в файл
+    :param path: путь до создаваемого файла
+    :param feed_format: ключ FEED_FORMATS
+    :param goods: число товаров
+    :param parameters: число параметров у товара
+    :param seed: зерно генератора случайных чисел
+    :param revision: номер версии прайса
+    :return: None
+    """
+    categories = generate_categories()
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        write_feed(file, feed_format, 'Тестовый магазин', categories,
+                   generate_goods(goods, parameters, categories, seed, revision), parameter_names(parameters))
+
+
+class Command(BaseCommand):
+    help = 'Генерирует прайс по образцу data/shop1.yaml с заданным числом товаров и параметров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='путь до создаваемого файла')
+        parser.add_argument('--goods', type=int, default=1000, help='число товаров, например 1000, 100000, 1000000')
+        parser.add_argument('--parameters', type=int, default=len(PARAMETERS), help='число параметров у товара')
+        parser.add_argument('--format', default='yaml', choices=sorted(FEED_FORMATS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--revision', type=int, default=0,
+                            help='версия прайса: меняет цену и остаток каждого десятого товара')
+
+    def handle(self, *args, **options):
+        write_generated_feed(options['output'], options['format'], options['goods'], options['parameters'],
+                             options['seed'], options['revision'])
+        self.stdout.write(f'{options["output"]}: {options["goods"]} товаров')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.catalog import bump_catalog_version, refresh_best_offers, refresh_catalog_entries, refresh_category_counts
+from backend.models import BestOffer, CatalogEntry, ProductInfo, Shop
+
+
+class Command(BaseCommand):
+    help = ('Строит таблицы каталога для выдачи товаров (CatalogEntry), лучших предложений (BestOffer) '
+            'и числа предложений по категориям (CategoryCount) заново')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            CatalogEntry.objects.all().delete()
+            BestOffer.objects.all().delete()
+            refresh_best_offers(refresh_catalog_entries(
+                ProductInfo.objects.order_by('id').values_list('id', flat=True).iterator()))
+            for shop_id in Shop.objects.values_list('id', flat=True):
+                refresh_category_counts(shop_id)
+                # после фиксации меняются версии всех магазинов и общая, кэш выдачи и ETag строятся заново
+                bump_catalog_version(shop_id)
+        self.stdout.write(f'Строк каталога: {CatalogEntry.objects.count()}, '
+                          f'лучших предложений: {BestOffer.objects.count()}')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from backend.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Строит поисковый индекс товаров заново'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(f'Индекс перестроен: {type(backend).__name__}')
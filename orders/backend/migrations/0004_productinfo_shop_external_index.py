@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_productinfo_photo_alter_user_avatar'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['shop', 'external_id'], name='product_info_shop_external'),
+        ),
+    ]
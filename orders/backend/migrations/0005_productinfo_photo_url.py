@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_productinfo_shop_external_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='photo_url',
+            field=models.URLField(blank=True, default='', max_length=500, verbose_name='Ссылка на фото'),
+        ),
+    ]
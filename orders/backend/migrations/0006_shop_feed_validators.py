@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_productinfo_photo_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='feed_digest',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='sha256 прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_etag',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='ETag прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Last-Modified прайса'),
+        ),
+    ]
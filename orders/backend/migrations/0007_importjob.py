@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_shop_feed_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(blank=True, max_length=500, verbose_name='Ссылка на прайс')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('skipped', 'Прайс не изменился'), ('success', 'Выполнен'), ('failure', 'Ошибка')], default='pending', max_length=15, verbose_name='Статус')),
+                ('rows_parsed', models.PositiveIntegerField(default=0, verbose_name='Прочитано товаров')),
+                ('rows_inserted', models.PositiveIntegerField(default=0, verbose_name='Добавлено товаров')),
+                ('rows_updated', models.PositiveIntegerField(default=0, verbose_name='Обновлено товаров')),
+                ('rows_deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено товаров')),
+                ('bytes_downloaded', models.PositiveBigIntegerField(default=0, verbose_name='Скачано байт')),
+                ('timings', models.JSONField(blank=True, default=dict, verbose_name='Длительность этапов (сек)')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начат')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершен')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='backend.shop', verbose_name='Магазин')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Импорт прайса',
+                'verbose_name_plural': 'Список импортов прайсов',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+TABLE = 'backend_productsearch'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+                          f"name, model, category, parameters, tokenize = 'unicode61 remove_diacritics 2')")
+    # веса колонок для bm25: название, модель, категория, параметры
+    schema_editor.execute(f"INSERT INTO {TABLE} ({TABLE}, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')")
+    schema_editor.execute(
+        f"INSERT INTO {TABLE} (rowid, name, model, category, parameters) "
+        f"SELECT info.id, product.name, info.model, category.name, "
+        f"COALESCE((SELECT group_concat(value, ' ') FROM backend_productparameter "
+        f"WHERE product_info_id = info.id), '') "
+        f"FROM backend_productinfo info JOIN backend_product product ON product.id = info.product_id "
+        f"LEFT JOIN backend_category category ON category.id = product.category_id")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_importjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
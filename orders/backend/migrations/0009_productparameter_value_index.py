@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_productsearch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value'),
+        ),
+    ]
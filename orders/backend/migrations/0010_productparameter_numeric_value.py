@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:45
+
+import re
+
+from django.db import migrations, models
+
+NUMBER = re.compile(r'-?\d+(?:[.,]\d+)?')
+
+
+def fill_numeric_values(apps, schema_editor):
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    batch = []
+    for product_parameter in ProductParameter.objects.only('id', 'value').iterator():
+        if NUMBER.fullmatch(product_parameter.value.strip()):
+            product_parameter.numeric_value = float(product_parameter.value.strip().replace(',', '.'))
+            batch.append(product_parameter)
+        if len(batch) == 1000:
+            ProductParameter.objects.bulk_update(batch, ['numeric_value'])
+            batch = []
+    ProductParameter.objects.bulk_update(batch, ['numeric_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_productparameter_value_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productparameter',
+            name='numeric_value',
+            field=models.FloatField(blank=True, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'numeric_value'], name='product_parameter_numeric'),
+        ),
+        migrations.RunPython(fill_numeric_values, migrations.RunPython.noop),
+    ]
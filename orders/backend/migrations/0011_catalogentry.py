@@ -0,0 +1,59 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_catalog(apps, schema_editor):
+    CatalogEntry = apps.get_model('backend', 'CatalogEntry')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.order_by('id').values_list(
+            'product_info_id', 'parameter__name', 'value').iterator():
+        parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+    fields = {'id': 'id', 'shop_id': 'shop_id', 'shop_state': 'shop__state', 'product_id': 'product_id',
+              'product_name': 'product__name', 'category_id': 'product__category_id',
+              'category_name': 'product__category__name', 'model': 'model', 'quantity': 'quantity',
+              'price': 'price', 'price_rrc': 'price_rrc', 'photo': 'photo'}
+    batch = []
+    for row in ProductInfo.objects.values_list(*fields.values()).iterator():
+        batch.append(CatalogEntry(**dict(zip(fields, row)), parameters=parameters.get(row[0], [])))
+        if len(batch) == 1000:
+            CatalogEntry.objects.bulk_create(batch)
+            batch = []
+    CatalogEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_productparameter_numeric_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='ИД информации о продукте')),
+                ('shop_state', models.BooleanField(verbose_name='статус получения заказов')),
+                ('product_id', models.PositiveIntegerField(verbose_name='ИД продукта')),
+                ('product_name', models.CharField(max_length=80, verbose_name='Название продукта')),
+                ('category_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ИД категории')),
+                ('category_name', models.CharField(blank=True, max_length=40, null=True, verbose_name='Категория')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')),
+                ('photo', models.ImageField(blank=True, default='', upload_to='media/products', verbose_name='Фото')),
+                ('parameters', models.JSONField(blank=True, default=list, verbose_name='Параметры')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Строка каталога',
+                'verbose_name_plural': 'Каталог для выдачи товаров',
+                'indexes': [models.Index(fields=['shop_state', 'id'], name='catalog_entry_state'), models.Index(fields=['shop_state', 'shop', 'id'], name='catalog_entry_shop'), models.Index(fields=['shop_state', 'category_id', 'id'], name='catalog_entry_category')],
+            },
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_best_offers(apps, schema_editor):
+    BestOffer = apps.get_model('backend', 'BestOffer')
+    CatalogEntry = apps.get_model('backend', 'CatalogEntry')
+    fields = {'id': 'product_id', 'product_name': 'product_name', 'category_id': 'category_id',
+              'category_name': 'category_name', 'product_info_id': 'id', 'shop_id': 'shop_id', 'model': 'model',
+              'quantity': 'quantity', 'price': 'price', 'price_rrc': 'price_rrc'}
+    offers = {}
+    for row in CatalogEntry.objects.filter(shop_state=True, quantity__gt=0).order_by(
+            'product_id', 'price', 'id').values_list(*fields.values()).iterator():
+        if row[0] in offers:
+            offers[row[0]].offer_count += 1
+        else:
+            offers[row[0]] = BestOffer(**dict(zip(fields, row)), offer_count=1)
+    BestOffer.objects.bulk_create(offers.values(), batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_order_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestOffer',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='ИД продукта')),
+                ('product_name', models.CharField(max_length=80, verbose_name='Название продукта')),
+                ('category_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ИД категории')),
+                ('category_name', models.CharField(blank=True, max_length=40, null=True, verbose_name='Категория')),
+                ('product_info_id', models.PositiveIntegerField(verbose_name='ИД информации о продукте')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')),
+                ('offer_count', models.PositiveIntegerField(verbose_name='Число предложений в наличии')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_offers', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Лучшее предложение',
+                'verbose_name_plural': 'Лучшие предложения по продуктам',
+                'indexes': [models.Index(fields=['category_id', 'id'], name='best_offer_category')],
+            },
+        ),
+        migrations.RunPython(fill_best_offers, migrations.RunPython.noop),
+    ]
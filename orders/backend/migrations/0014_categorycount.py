@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_category_counts(apps, schema_editor):
+    CatalogEntry = apps.get_model('backend', 'CatalogEntry')
+    Category = apps.get_model('backend', 'Category')
+    CategoryCount = apps.get_model('backend', 'CategoryCount')
+    counts = {(category_id, shop_id): 0 for category_id, shop_id in Category.shops.through.objects.values_list(
+        'category_id', 'shop_id')}
+    for category_id, shop_id, offer_count in CatalogEntry.objects.filter(
+            quantity__gt=0, category_id__isnull=False).values('category_id', 'shop_id').annotate(
+            offer_count=Count('id')).values_list('category_id', 'shop_id', 'offer_count'):
+        counts[category_id, shop_id] = offer_count
+    CategoryCount.objects.bulk_create([CategoryCount(category_id=category_id, shop_id=shop_id, offer_count=offer_count)
+                                       for (category_id, shop_id), offer_count in counts.items()], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_bestoffer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offer_count', models.PositiveIntegerField(verbose_name='Число предложений в наличии')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_counts', to='backend.category', verbose_name='Категория')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_counts', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Число предложений категории',
+                'verbose_name_plural': 'Число предложений по категориям и магазинам',
+                'constraints': [models.UniqueConstraint(fields=('category', 'shop'), name='unique_category_count')],
+            },
+        ),
+        migrations.RunPython(fill_category_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-18 21:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_categorycount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogentry',
+            name='product_info',
+            field=models.ForeignObject(from_fields=['id'], on_delete=django.db.models.deletion.CASCADE,
+                                       related_name='+', to='backend.productinfo', to_fields=['id']),
+        ),
+        migrations.AddField(
+            model_name='bestoffer',
+            name='product',
+            field=models.ForeignObject(from_fields=['id'], on_delete=django.db.models.deletion.CASCADE,
+                                       related_name='+', to='backend.product', to_fields=['id']),
+        ),
+        migrations.AddField(
+            model_name='bestoffer',
+            name='product_info',
+            field=models.ForeignObject(from_fields=['product_info_id'], on_delete=django.db.models.deletion.CASCADE,
+                                       related_name='+', to='backend.productinfo', to_fields=['id']),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+TABLE = 'backend_productsearch'
+TRIGGER = 'backend_productsearch_delete'
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # строки индекса, оставшиеся от товаров, удаленных каскадом или из админки
+    schema_editor.execute(f'DELETE FROM {TABLE} WHERE rowid NOT IN (SELECT id FROM backend_productinfo)')
+    schema_editor.execute(f'CREATE TRIGGER {TRIGGER} AFTER DELETE ON backend_productinfo '
+                          f'BEGIN DELETE FROM {TABLE} WHERE rowid = OLD.id; END')
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_catalog_cascade'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 from imagekit.models import ImageSpecField
@@ -22,6 +23,14 @@ USER_TYPE_CHOICES = (
     ('buyer', 'Покупатель'),
 )
 
+IMPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('skipped', 'Прайс не изменился'),
+    ('success', 'Выполнен'),
+    ('failure', 'Ошибка'),
+)
+
 
 # Create your models here.
 
@@ -113,6 +122,10 @@ class Shop(models.Model):
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    feed_etag = models.CharField(max_length=255, verbose_name='ETag прайса', blank=True, default='')
+    feed_last_modified = models.CharField(max_length=64, verbose_name='Last-Modified прайса', blank=True,
+                                          default='')
+    feed_digest = models.CharField(max_length=64, verbose_name='sha256 прайса', blank=True, default='')
 
     # filename
 
@@ -166,6 +179,7 @@ class ProductInfo(models.Model):
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
     photo = models.ImageField(upload_to='media/products', verbose_name='Фото', blank=True, default='')
+    photo_url = models.URLField(max_length=500, verbose_name='Ссылка на фото', blank=True, default='')
     photo_thumbnail = ImageSpecField(source='photo',
                                       processors=[ResizeToFill(300, 300)],
                                       format='JPEG',
@@ -177,6 +191,9 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            models.Index(fields=['shop', 'external_id'], name='product_info_shop_external'),
+        ]
 
 
 class Parameter(models.Model):
@@ -200,6 +217,7 @@ class ProductParameter(models.Model):
     parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='product_parameters', blank=True,
                                   on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Значение', max_length=100)
+    numeric_value = models.FloatField(verbose_name='Числовое значение', blank=True, null=True)
 
     class Meta:
         verbose_name = 'Параметр'
@@ -207,6 +225,135 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            # фильтр товаров по значению параметра
+            models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value'),
+            # фильтр по диапазону числового значения
+            models.Index(fields=['parameter', 'numeric_value'], name='product_parameter_numeric'),
+        ]
+
+
+class CatalogEntry(models.Model):
+    """
+    Строка каталога для выдачи товаров: предложение магазина вместе со статусом
+    магазина, названиями продукта и категории и параметрами, чтобы список
+    товаров читался из одной таблицы. id совпадает с id ProductInfo, строки
+    обновляет backend.catalog при импорте и смене статуса магазина.
+    """
+    objects = models.manager.Manager()
+    id = models.PositiveIntegerField(primary_key=True, verbose_name='ИД информации о продукте')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='catalog_entries', on_delete=models.CASCADE)
+    shop_state = models.BooleanField(verbose_name='статус получения заказов')
+    product_id = models.PositiveIntegerField(verbose_name='ИД продукта')
+    product_name = models.CharField(max_length=80, verbose_name='Название продукта')
+    category_id = models.PositiveIntegerField(verbose_name='ИД категории', blank=True, null=True)
+    category_name = models.CharField(max_length=40, verbose_name='Категория', blank=True, null=True)
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    photo = models.ImageField(upload_to='media/products', verbose_name='Фото', blank=True, default='')
+    parameters = models.JSONField(verbose_name='Параметры', default=list, blank=True)
+    # связь без своей колонки: строка удаляется вместе с ProductInfo, в том числе из админки и каскадом от Shop
+    product_info = models.ForeignObject(ProductInfo, on_delete=models.CASCADE, from_fields=['id'], to_fields=['id'],
+                                        related_name='+')
+
+    class Meta:
+        verbose_name = 'Строка каталога'
+        verbose_name_plural = "Каталог для выдачи товаров"
+        indexes = [
+            # страницы выдачи по курсору id среди работающих магазинов
+            models.Index(fields=['shop_state', 'id'], name='catalog_entry_state'),
+            models.Index(fields=['shop_state', 'shop', 'id'], name='catalog_entry_shop'),
+            models.Index(fields=['shop_state', 'category_id', 'id'], name='catalog_entry_category'),
+        ]
+
+
+class BestOffer(models.Model):
+    """
+    Лучшее предложение продукта среди магазинов: самое дешевое предложение
+    в наличии у магазинов, которые принимают заказы. id совпадает с id Product,
+    строки обновляет backend.catalog вместе со строками CatalogEntry.
+    """
+    objects = models.manager.Manager()
+    id = models.PositiveIntegerField(primary_key=True, verbose_name='ИД продукта')
+    product_name = models.CharField(max_length=80, verbose_name='Название продукта')
+    category_id = models.PositiveIntegerField(verbose_name='ИД категории', blank=True, null=True)
+    category_name = models.CharField(max_length=40, verbose_name='Категория', blank=True, null=True)
+    product_info_id = models.PositiveIntegerField(verbose_name='ИД информации о продукте')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='best_offers', on_delete=models.CASCADE)
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    offer_count = models.PositiveIntegerField(verbose_name='Число предложений в наличии')
+    # связи без своих колонок: строка удаляется вместе с продуктом или выбранным предложением,
+    # до следующего пересчета продукт без строки просто не попадает в выдачу
+    product = models.ForeignObject(Product, on_delete=models.CASCADE, from_fields=['id'], to_fields=['id'],
+                                   related_name='+')
+    product_info = models.ForeignObject(ProductInfo, on_delete=models.CASCADE, from_fields=['product_info_id'],
+                                        to_fields=['id'], related_name='+')
+
+    class Meta:
+        verbose_name = 'Лучшее предложение'
+        verbose_name_plural = "Лучшие предложения по продуктам"
+        indexes = [
+            models.Index(fields=['category_id', 'id'], name='best_offer_category'),
+        ]
+
+
+class CategoryCount(models.Model):
+    """
+    Число предложений в наличии по категории и магазину для списка категорий.
+    Строки пересчитывает backend.catalog после импорта прайса и обновления остатков.
+    """
+    objects = models.manager.Manager()
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='shop_counts',
+                                 on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='category_counts', on_delete=models.CASCADE)
+    offer_count = models.PositiveIntegerField(verbose_name='Число предложений в наличии')
+
+    class Meta:
+        verbose_name = 'Число предложений категории'
+        verbose_name_plural = "Число предложений по категориям и магазинам"
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'shop'], name='unique_category_count'),
+        ]
+
+
+class ImportJob(models.Model):
+    objects = models.manager.Manager()
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_jobs', blank=True, null=True,
+                             on_delete=models.CASCADE)
+    url = models.URLField(max_length=500, verbose_name='Ссылка на прайс', blank=True)
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=15, default='pending')
+    rows_parsed = models.PositiveIntegerField(verbose_name='Прочитано товаров', default=0)
+    rows_inserted = models.PositiveIntegerField(verbose_name='Добавлено товаров', default=0)
+    rows_updated = models.PositiveIntegerField(verbose_name='Обновлено товаров', default=0)
+    rows_deleted = models.PositiveIntegerField(verbose_name='Удалено товаров', default=0)
+    bytes_downloaded = models.PositiveBigIntegerField(verbose_name='Скачано байт', default=0)
+    timings = models.JSONField(verbose_name='Длительность этапов (сек)', default=dict, blank=True)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(verbose_name='Создан', auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name='Начат', blank=True, null=True)
+    finished_at = models.DateTimeField(verbose_name='Завершен', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Импорт прайса'
+        verbose_name_plural = "Список импортов прайсов"
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.url} {self.state}'
+
+    @property
+    def rows_per_second(self):
+        if self.started_at is None:
+            return None
+        seconds = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.rows_parsed / seconds, 1) if seconds > 0 else None
 
 
 class Contact(models.Model):
@@ -237,6 +384,8 @@ class Order(models.Model):
                              related_name='orders', blank=True,
                              on_delete=models.CASCADE)
     dt = models.DateTimeField(auto_now_add=True)
+    # меняется и при изменении позиций и контакта заказа, входит в ETag списков заказов
+    updated = models.DateTimeField(auto_now=True, verbose_name='Изменен')
     state = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15)
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
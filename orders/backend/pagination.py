@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Постраничный вывод товаров по курсору.
+
+    Страница выбирается условием id > последнего id предыдущей страницы,
+    а не OFFSET, поэтому дальние страницы обходятся так же дешево, как первая.
+    """
+    ordering = 'id'
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page_size_query_param = 'limit'
+    max_page_size = settings.PRODUCTS_MAX_PAGE_SIZE
+
+
+class ProductSearchPagination(ProductCursorPagination):
+    """
+    Постраничный вывод результатов поиска по релевантности, при равной релевантности — по id
+    """
+    ordering = ('search_rank', 'id')
@@ -0,0 +1,233 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F, Sum
+from rest_framework.fields import DateTimeField
+
+from backend.models import Contact, OrderItem, ProductInfo, ProductParameter
+from backend.utils import chunked
+
+# Ответы списков товаров и заказов собираются из values() без моделей и вложенных
+# сериализаторов, в том же виде, что и CatalogEntrySerializer и OrderSerializer
+
+# поля товара в порядке ProductInfoSerializer
+PRODUCT_FIELDS = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters', 'photo')
+# вложенные объекты, которые отдаются только если раскрыты: без product_info позиция заказа содержит id товара,
+# без contact заказ содержит id контакта, без product_parameters параметры не читаются и не отдаются
+EXPANSIONS = ('product_info', 'product_parameters', 'contact')
+# колонки values() для полей товара; параметры товара в CatalogEntry хранятся в колонке parameters
+PRODUCT_COLUMNS = {
+    'id': ('id',),
+    'model': ('model',),
+    'product': ('product_name', 'category_name'),
+    'shop': ('shop_id',),
+    'quantity': ('quantity',),
+    'price': ('price',),
+    'price_rrc': ('price_rrc',),
+    'product_parameters': ('parameters',),
+    'photo': ('photo',),
+}
+CONTACT_VALUES = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+ORDER_VALUES = ('id', 'state', 'dt', 'total_sum', 'contact_id')
+BEST_OFFER_VALUES = ('id', 'product_name', 'category_name', 'product_info_id', 'shop_id', 'model', 'quantity', 'price',
+                     'price_rrc', 'offer_count')
+
+datetime_field = DateTimeField()
+
+
+def photo_url(name):
+    # как serializers.ImageField без request в контексте
+    return default_storage.url(name) if name else None
+
+
+def parse_fieldset(params):
+    """
+    Разбирает параметры fields, expand и compact запроса.
+
+    fields — поля товара через запятую, по умолчанию все. expand — раскрываемые
+    вложенные объекты из EXPANSIONS, по умолчанию все, а с compact=1 — ни одного.
+    :param params: QueryDict параметров запроса
+    :return: кортеж (поля товара, множество раскрытых объектов)
+    """
+    requested = {field for field in params.get('fields', '').split(',') if field}
+    if 'expand' in params:
+        expand = {name for name in params['expand'].split(',') if name}
+    elif params.get('compact', '').lower() in ('1', 'true', 'yes'):
+        expand = set()
+    else:
+        expand = set(EXPANSIONS)
+    unknown = (requested - set(PRODUCT_FIELDS)) | (expand - set(EXPANSIONS))
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    fields = tuple(field for field in PRODUCT_FIELDS if (not requested or field in requested)
+                   and (field != 'product_parameters' or field in expand))
+    return fields, expand
+
+
+def catalog_values(fields):
+    """
+    Колонки CatalogEntry для values(): id нужен курсору всегда
+    :param fields: поля товара
+    :return: кортеж колонок
+    """
+    return tuple(dict.fromkeys(('id',) + tuple(column for field in fields for column in PRODUCT_COLUMNS[field])))
+
+
+def product_payload(row, fields):
+    payload = {}
+    for field in fields:
+        if field == 'product':
+            payload['product'] = {'name': row['product_name'], 'category': row['category_name']}
+        elif field == 'shop':
+            payload['shop'] = row['shop_id']
+        elif field == 'product_parameters':
+            payload['product_parameters'] = row['parameters']
+        elif field == 'photo':
+            payload['photo'] = photo_url(row['photo'])
+        else:
+            payload[field] = row[field]
+    return payload
+
+
+def catalog_payload(rows, fields=PRODUCT_FIELDS):
+    """
+    Товары выдачи из строк CatalogEntry
+    :param rows: словари CatalogEntry.objects.values(*catalog_values(fields))
+    :param fields: поля товара
+    :return: список словарей в формате CatalogEntrySerializer
+    """
+    return [product_payload(row, fields) for row in rows]
+
+
+def best_offer_payload(rows):
+    """
+    Лучшие предложения из строк BestOffer
+    :param rows: словари BestOffer.objects.values(*BEST_OFFER_VALUES)
+    :return: список словарей в формате BestOfferSerializer
+    """
+    return [{
+        'id': row['id'],
+        'product': {'name': row['product_name'], 'category': row['category_name']},
+        'product_info': row['product_info_id'],
+        'shop': row['shop_id'],
+        'model': row['model'],
+        'quantity': row['quantity'],
+        'price': row['price'],
+        'price_rrc': row['price_rrc'],
+        'offer_count': row['offer_count'],
+    } for row in rows]
+
+
+def category_payload(categories, counts):
+    """
+    Категории с магазинами и числом предложений в наличии
+    :param categories: словари Category.objects.values('id', 'name')
+    :param counts: кортежи (id категории, id магазина, название магазина, число предложений)
+    :return: список словарей категорий
+    """
+    shops = {}
+    for category_id, shop_id, shop_name, offer_count in counts:
+        shops.setdefault(category_id, []).append({'id': shop_id, 'name': shop_name, 'offer_count': offer_count})
+    return [{
+        'id': category['id'],
+        'name': category['name'],
+        'offer_count': sum(shop['offer_count'] for shop in shops.get(category['id'], ())),
+        'shops': shops.get(category['id'], []),
+    } for category in categories]
+
+
+def product_info_payloads(product_info_ids, fields=PRODUCT_FIELDS):
+    """
+    Товары в формате ProductInfoSerializer: строки с продуктом и категорией и, если нужны, их параметры
+    :param product_info_ids: id строк ProductInfo
+    :param fields: поля товара
+    :return: словарь id -> словарь товара
+    """
+    parameters = {}
+    if 'product_parameters' in fields:
+        for product_info_id, name, value in ProductParameter.objects.filter(
+                product_info_id__in=product_info_ids).order_by('id').values_list(
+                'product_info_id', 'parameter__name', 'value'):
+            parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+    columns = {column: F(lookup) for column, lookup in (('product_name', 'product__name'),
+                                                        ('category_name', 'product__category__name'))}
+    payloads = {}
+    for row in ProductInfo.objects.filter(id__in=product_info_ids).values(
+            'id', 'model', 'shop_id', 'quantity', 'price', 'price_rrc', 'photo', **columns):
+        row['parameters'] = parameters.get(row['id'], [])
+        payloads[row['id']] = product_payload(row, fields)
+    return payloads
+
+
+def with_total_sum(orders):
+    """
+    Добавляет к заказам сумму позиций. Если выборка уже отфильтрована по позициям
+    (заказы поставщика), сумма считается только по ним
+    :param orders: выборка Order
+    :return: выборка Order с аннотацией total_sum
+    """
+    return orders.annotate(
+        total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+
+
+def order_payload(orders, fields=PRODUCT_FIELDS, expand=EXPANSIONS):
+    """
+    Заказы в формате OrderSerializer.
+
+    Вместо prefetch_related по товарам, продуктам, категориям и параметрам
+    выполняется по запросу на заказы, позиции и раскрытые объекты: товары,
+    параметры и контакты.
+    :param orders: выборка Order с аннотацией total_sum
+    :param fields: поля товара в позициях
+    :param expand: раскрытые вложенные объекты, см. EXPANSIONS
+    :return: список словарей заказов
+    """
+    orders = list(orders.values(*ORDER_VALUES))
+    items = {}
+    for item_id, order_id, product_info_id, quantity in OrderItem.objects.filter(
+            order_id__in=[order['id'] for order in orders]).order_by('id').values_list(
+            'id', 'order_id', 'product_info_id', 'quantity'):
+        items.setdefault(order_id, []).append((item_id, product_info_id, quantity))
+    if 'product_info' in expand:
+        products = product_info_payloads({product_info_id for order_items in items.values()
+                                          for _, product_info_id, _ in order_items}, fields)
+    else:
+        products = None
+    if 'contact' in expand:
+        contacts = {contact['id']: contact for contact in Contact.objects.filter(
+            id__in={order['contact_id'] for order in orders if order['contact_id']}).values(*CONTACT_VALUES)}
+    else:
+        contacts = None
+    return [{
+        'id': order['id'],
+        'ordered_items': [{'id': item_id,
+                           'product_info': product_info_id if products is None else products[product_info_id],
+                           'quantity': quantity}
+                          for item_id, product_info_id, quantity in items.get(order['id'], [])],
+        'state': order['state'],
+        'dt': datetime_field.to_representation(order['dt']),
+        'total_sum': order['total_sum'],
+        'contact': order['contact_id'] if contacts is None else contacts.get(order['contact_id']),
+    } for order in orders]
+
+
+def iter_order_payloads(orders, fields=PRODUCT_FIELDS, expand=EXPANSIONS, chunk_size=None):
+    """
+    Заказы в формате OrderSerializer по одному, для потоковой выдачи.
+
+    id заказов читаются серверным курсором, а суммы, позиции, товары и
+    контакты — пакетами по chunk_size заказов, поэтому память не зависит от
+    числа заказов. Заказы идут по возрастанию id: Meta.ordering не действует
+    на запросы с аннотацией total_sum, и прежний ответ тоже шел в порядке id.
+    :param orders: выборка Order без аннотации total_sum
+    :param fields: поля товара в позициях
+    :param expand: раскрытые вложенные объекты, см. EXPANSIONS
+    :param chunk_size: размер пакета, по умолчанию ORDERS_STREAM_CHUNK_SIZE
+    :return: генератор словарей заказов
+    """
+    chunk_size = chunk_size or settings.ORDERS_STREAM_CHUNK_SIZE
+    ids = orders.order_by('id').values_list('id', flat=True).distinct().iterator(chunk_size=chunk_size)
+    for batch in chunked(ids, chunk_size):
+        payloads = {order['id']: order
+                    for order in order_payload(with_total_sum(orders.filter(id__in=batch)), fields, expand)}
+        for order_id in batch:
+            yield payloads[order_id]
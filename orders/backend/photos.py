@@ -0,0 +1,106 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.catalog import bump_catalog_version, offers_changed
+from backend.models import ProductInfo
+
+PHOTO_DIR = ProductInfo._meta.get_field('photo').upload_to
+
+
+class PhotoFetcher:
+    """
+    Параллельное скачивание фото через общий пул HTTP-соединений.
+
+    Одновременных загрузок не больше PHOTO_FETCH_WORKERS и не больше
+    PHOTO_HOST_CONCURRENCY на один хост. Файлы сохраняются под именем
+    из sha256 содержимого, поэтому одинаковые картинки хранятся один раз.
+    """
+
+    def __init__(self, workers=None, per_host=None):
+        self.workers = workers or settings.PHOTO_FETCH_WORKERS
+        self.per_host = per_host or settings.PHOTO_HOST_CONCURRENCY
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.host_limits = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self.lock = threading.Lock()
+
+    def fetch_all(self, urls):
+        """
+        Скачивает и сохраняет фото
+        :param urls: ссылки на фото
+        :return: словарь ссылка -> имя сохраненного файла, неудачные загрузки пропускаются
+        """
+        with self.session, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = executor.map(self.fetch, urls)
+            return {url: name for url, name in zip(urls, results) if name}
+
+    def fetch(self, url):
+        """
+        Скачивает и сохраняет одно фото
+        :param url: ссылка на фото
+        :return: имя сохраненного файла или None
+        """
+        with self.lock:
+            host_limit = self.host_limits[urlparse(url).netloc]
+        try:
+            with host_limit:
+                response = self.session.get(url, timeout=settings.PHOTO_FETCH_TIMEOUT)
+        except requests.RequestException:
+            return None
+        if response.status_code != 200 or not response.content:
+            return None
+        return self.save(url, response.content, response.headers.get('Content-Type'))
+
+    def save(self, url, content, content_type=None):
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if not extension and content_type:
+            extension = mimetypes.guess_extension(content_type.split(';')[0]) or ''
+        name = f'{PHOTO_DIR}/{hashlib.sha256(content).hexdigest()}{extension}'
+        with self.lock:
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(content))
+        return name
+
+
+def ingest_photos(shop_id, fetcher=None):
+    """
+    Загружает фото для товаров магазина, у которых указана ссылка, но нет файла.
+
+    Ссылки, фото по которым у магазина уже сохранены, повторно не скачиваются.
+    :param shop_id: id магазина
+    :param fetcher: экземпляр PhotoFetcher
+    :return: число товаров, получивших фото
+    """
+    pending = defaultdict(list)
+    for product_info_id, url in ProductInfo.objects.filter(
+            shop_id=shop_id, photo='').exclude(photo_url='').values_list('id', 'photo_url').iterator():
+        pending[url].append(product_info_id)
+    if not pending:
+        return 0
+
+    stored = {url: name for url, name in ProductInfo.objects.filter(shop_id=shop_id).exclude(
+        photo='').exclude(photo_url='').values_list('photo_url', 'photo').iterator() if url in pending}
+    missing = [url for url in pending if url not in stored]
+    if missing:
+        stored.update((fetcher or PhotoFetcher()).fetch_all(missing))
+
+    photos = [ProductInfo(id=product_info_id, photo=stored[url])
+              for url, ids in pending.items() if url in stored for product_info_id in ids]
+    updated = ProductInfo.objects.bulk_update(photos, ['photo'], batch_size=settings.IMPORT_BATCH_SIZE)
+    offers_changed([product_info.id for product_info in photos], reindex=())
+    if updated:
+        bump_catalog_version(shop_id)
+    return updated
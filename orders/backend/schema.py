@@ -1,5 +1,21 @@
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
 from rest_framework import serializers
 
+from backend.serializers import BestOfferSerializer, CatalogEntrySerializer
+
+# параметры fields, expand и compact списков товаров и заказов (backend.payloads.parse_fieldset)
+FIELDSET_PARAMETERS = [
+    OpenApiParameter('fields', OpenApiTypes.STR, required=False,
+                     description='поля товара через запятую: id, model, product, shop, quantity, price, price_rrc, '
+                                 'product_parameters, photo'),
+    OpenApiParameter('expand', OpenApiTypes.STR, required=False,
+                     description='раскрываемые объекты через запятую: product_info, product_parameters, contact; '
+                                 'по умолчанию все'),
+    OpenApiParameter('compact', OpenApiTypes.BOOL, required=False,
+                     description='не раскрывать вложенные объекты, если не указан expand'),
+]
+
 class BaseResponse(serializers.Serializer):
     Status = serializers.BooleanField()
 
@@ -27,7 +43,20 @@ class PartnerUpdateRequest(serializers.Serializer):
     url = serializers.URLField()
     
 class PartnerUpdateResponse(BaseResponse):
-    pass
+    job_id = serializers.IntegerField()
+
+class PartnerUploadRequest(serializers.Serializer):
+    file = serializers.FileField()
+
+class PartnerStockRequest(serializers.Serializer):
+    items = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField(), min_length=4,
+                                                              max_length=4),
+                                  help_text='[external_id, price, price_rrc, quantity]')
+
+class PartnerStockResponse(BaseResponse):
+    updated = serializers.IntegerField()
+    unchanged = serializers.IntegerField()
+    not_found = serializers.ListField(child=serializers.IntegerField())
 
 class PartnerStateRequest(serializers.Serializer):
     state = serializers.CharField(default='True')
@@ -71,4 +100,33 @@ class OrderResponse(BaseResponse):
 
 class OrderUpdateRequest(serializers.Serializer):
     order_id = serializers.IntegerField()
-    state = serializers.CharField()
\ No newline at end of file
+    state = serializers.CharField()
+
+class ProductInfoPageResponse(serializers.Serializer):
+    next = serializers.URLField(allow_null=True)
+    previous = serializers.URLField(allow_null=True)
+    results = CatalogEntrySerializer(many=True)
+    facets = serializers.DictField(child=serializers.DictField(child=serializers.IntegerField()), required=False)
+
+class CategoryShopCount(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    offer_count = serializers.IntegerField()
+
+class CategoryResponse(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    offer_count = serializers.IntegerField()
+    shops = CategoryShopCount(many=True)
+
+class ProductSuggestion(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+class ProductSuggestResponse(serializers.Serializer):
+    suggestions = ProductSuggestion(many=True)
+
+class BestOfferPageResponse(serializers.Serializer):
+    next = serializers.URLField(allow_null=True)
+    previous = serializers.URLField(allow_null=True)
+    results = BestOfferSerializer(many=True)
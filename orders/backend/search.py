@@ -0,0 +1,157 @@
+import re
+from functools import reduce
+from operator import and_
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from backend.models import ProductInfo, ProductParameter
+from backend.utils import chunked
+
+# поиск по полям: параметр запроса -> колонка индекса
+SEARCH_FIELDS = {
+    'q': None,
+    'product_name': 'name',
+    'model': 'model',
+    'category_name': 'category',
+}
+WORD = re.compile(r'\w+')
+
+
+def search_terms(params):
+    """
+    Слова поискового запроса по колонкам индекса
+    :param params: словарь параметр запроса -> строка из SEARCH_FIELDS
+    :return: список (колонка или None для всех колонок, слово)
+    """
+    return [(SEARCH_FIELDS[param], word.lower())
+            for param, value in params.items() if param in SEARCH_FIELDS and value
+            for word in WORD.findall(value)]
+
+
+class SearchBackend:
+    """
+    Поиск товаров. Индекс обновляется импортом через index() и remove(),
+    а search() добавляет к выборке CatalogEntry, у строк которой id
+    совпадает с id ProductInfo, фильтр и, если индекс умеет ранжировать,
+    аннотацию search_rank (меньше — выше в выдаче).
+    """
+    ranked = False
+
+    def index(self, product_info_ids):
+        """
+        Добавляет или обновляет товары в индексе
+        :param product_info_ids: id строк ProductInfo
+        :return: None
+        """
+
+    def remove(self, product_info_ids):
+        """
+        Удаляет товары из индекса
+        :param product_info_ids: id строк ProductInfo
+        :return: None
+        """
+
+    def rebuild(self):
+        """
+        Строит индекс заново по всем товарам
+        :return: None
+        """
+
+    def search(self, queryset, terms):
+        """
+        Оставляет товары, подходящие под слова запроса
+        :param queryset: выборка CatalogEntry, ранжирующий поиск сверяет rowid индекса с id ее таблицы
+        :param terms: результат search_terms()
+        :return: выборка CatalogEntry
+        """
+        raise NotImplementedError
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Поиск без индекса через __icontains, для баз без полнотекстового поиска
+    """
+    lookups = {
+        'name': ('product__name__icontains',),
+        'model': ('model__icontains',),
+        'category': ('product__category__name__icontains',),
+        None: ('product__name__icontains', 'model__icontains', 'product__category__name__icontains',
+               'product_parameters__value__icontains'),
+    }
+
+    def search(self, queryset, terms):
+        conditions = [reduce(lambda left, right: left | right, (Q(**{lookup: word}) for lookup in self.lookups[column]))
+                      for column, word in terms]
+        matched = ProductInfo.objects.filter(reduce(and_, conditions)).values('id')
+        return queryset.filter(id__in=matched)
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск на SQLite FTS5.
+
+    Таблица backend_productsearch (миграция 0008) хранит по строке на
+    ProductInfo с rowid = id: название продукта, модель, категорию и значения
+    параметров. Слова запроса ищутся по префиксу и объединяются через И,
+    выдача упорядочена по bm25 с весами колонок из миграции. Строки
+    удаленных ProductInfo убирает триггер из миграции 0016, в том числе при
+    каскадном удалении и удалении из админки, поэтому освободившийся id не
+    находится по названию старого товара.
+    """
+    ranked = True
+    table = 'backend_productsearch'
+
+    def index(self, product_info_ids):
+        for batch in chunked(product_info_ids, settings.IMPORT_BATCH_SIZE):
+            parameters = {}
+            for product_info_id, value in ProductParameter.objects.filter(
+                    product_info_id__in=batch).order_by('id').values_list('product_info_id', 'value'):
+                parameters.setdefault(product_info_id, []).append(value)
+            rows = [(product_info_id, name, model, category, ' '.join(parameters.get(product_info_id, ())))
+                    for product_info_id, name, model, category in ProductInfo.objects.filter(id__in=batch).values_list(
+                        'id', 'product__name', 'model', 'product__category__name')]
+            self._delete(batch)
+            with connection.cursor() as cursor:
+                cursor.executemany(f'INSERT INTO {self.table} (rowid, name, model, category, parameters) '
+                                   f'VALUES (%s, %s, %s, %s, %s)', rows)
+
+    def remove(self, product_info_ids):
+        for batch in chunked(product_info_ids, settings.IMPORT_BATCH_SIZE):
+            self._delete(batch)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        self.index(ProductInfo.objects.order_by('id').values_list('id', flat=True).iterator())
+
+    def search(self, queryset, terms):
+        match = ' '.join(self._term(column, word) for column, word in terms)
+        matched = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+        rank = RawSQL(f'SELECT rank FROM {self.table} WHERE {self.table} MATCH %s '
+                      f'AND rowid = {queryset.model._meta.db_table}.id', [match], output_field=FloatField())
+        return queryset.filter(id__in=matched).annotate(search_rank=rank)
+
+    def _term(self, column, word):
+        # слово в кавычках с * — поиск по префиксу без разбора синтаксиса FTS5 из запроса
+        term = f'"{word}"*'
+        return f'{column} : {term}' if column else term
+
+    def _delete(self, product_info_ids):
+        product_info_ids = list(product_info_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({", ".join(["%s"] * len(product_info_ids))})',
+                           product_info_ids)
+
+
+def get_search_backend():
+    """
+    Поиск из настройки SEARCH_BACKEND, по умолчанию FTS5 для SQLite и поиск без индекса для остальных баз
+    :return: экземпляр SearchBackend
+    """
+    if settings.SEARCH_BACKEND:
+        return import_string(settings.SEARCH_BACKEND)()
+    return SqliteSearchBackend() if connection.vendor == 'sqlite' else LikeSearchBackend()
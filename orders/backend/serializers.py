@@ -1,7 +1,8 @@
 import requests
 from rest_framework import serializers
 
-from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
+from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, \
+    ImportJob, CatalogEntry, BestOffer
 from django.core.files.base import ContentFile
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -75,6 +76,44 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class CatalogProductSerializer(serializers.Serializer):
+    name = serializers.CharField(source='product_name')
+    category = serializers.CharField(source='category_name', allow_null=True)
+
+
+class CatalogParameterSerializer(serializers.Serializer):
+    parameter = serializers.CharField()
+    value = serializers.CharField()
+
+
+class CatalogEntrySerializer(serializers.ModelSerializer):
+    """
+    Строка CatalogEntry в том же виде, что и ProductInfoSerializer
+    """
+    product = CatalogProductSerializer(source='*', read_only=True)
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+    product_parameters = CatalogParameterSerializer(source='parameters', read_only=True, many=True)
+
+    class Meta:
+        model = CatalogEntry
+        fields = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters', 'photo')
+        read_only_fields = fields
+
+
+class BestOfferSerializer(serializers.ModelSerializer):
+    """
+    Лучшее предложение продукта: товар магазина с самой низкой ценой и число предложений в наличии
+    """
+    product = CatalogProductSerializer(source='*', read_only=True)
+    product_info = serializers.IntegerField(source='product_info_id', read_only=True)
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+
+    class Meta:
+        model = BestOffer
+        fields = ('id', 'product', 'product_info', 'shop', 'model', 'quantity', 'price', 'price_rrc', 'offer_count')
+        read_only_fields = fields
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
@@ -98,4 +137,15 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact',)
-        read_only_fields = ('id',)
\ No newline at end of file
+        read_only_fields = ('id',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_per_second = serializers.FloatField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'state', 'rows_parsed', 'rows_inserted', 'rows_updated', 'rows_deleted',
+                  'bytes_downloaded', 'timings', 'rows_per_second', 'error', 'created_at', 'started_at',
+                  'finished_at',)
+        read_only_fields = fields
@@ -0,0 +1,123 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+from django.conf import settings
+
+from backend.catalog import catalog_version
+from backend.models import CatalogEntry
+from backend.search import WORD
+
+
+def normalize(text):
+    """
+    Строка для сравнения по префиксу: слова в нижнем регистре через пробел
+    :param text: исходная строка
+    :return: нормализованная строка
+    """
+    return ' '.join(WORD.findall(text.lower().replace('ё', 'е')))
+
+
+class ShopSuggestions:
+    """
+    Префиксный индекс товаров одного магазина: отсортированный список ключей
+    и параллельный массив номеров продуктов. Ключи — название продукта и
+    модель с каждого слова, поэтому "iphone" находит "Apple iPhone XR".
+    """
+
+    def __init__(self, shop_id, version):
+        self.version = version
+        self.products = []
+        product_numbers = {}
+        pairs = []
+        for product_id, name, model in CatalogEntry.objects.filter(shop_id=shop_id, shop_state=True).values_list(
+                'product_id', 'product_name', 'model').iterator():
+            number = product_numbers.get(product_id)
+            if number is None:
+                number = product_numbers[product_id] = len(self.products)
+                self.products.append({'id': product_id, 'name': name})
+            for text in (name, model):
+                words = normalize(text).split()
+                pairs.extend((' '.join(words[position:]), number) for position in range(len(words)))
+        pairs = sorted(set(pairs))
+        self.keys = [key for key, _ in pairs]
+        self.numbers = array('I', (number for _, number in pairs))
+
+    def find(self, prefix):
+        """
+        Продукты, у которых есть ключ с этим префиксом, в порядке ключей
+        :param prefix: нормализованный префикс
+        :return: генератор пар (ключ, словарь продукта)
+        """
+        for position in range(bisect_left(self.keys, prefix), len(self.keys)):
+            key = self.keys[position]
+            if not key.startswith(prefix):
+                return
+            yield key, self.products[self.numbers[position]]
+
+
+class SuggestIndex:
+    """
+    Подсказки для строки поиска из памяти процесса, без запросов к базе.
+
+    Индекс строится по магазинам. Общая версия каталога сверяется не чаще
+    раза в SUGGEST_CHECK_INTERVAL секунд, и только когда она изменилась,
+    перечитываются версии магазинов и перестраиваются те магазины, чья
+    версия стала другой.
+    """
+
+    def __init__(self):
+        self.shops = {}
+        self.version = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < settings.SUGGEST_CHECK_INTERVAL:
+            return
+        with self.lock:
+            self.checked = now
+            version = catalog_version()
+            if version == self.version:
+                return
+            shops = {}
+            for shop_id in CatalogEntry.objects.filter(shop_state=True).values_list(
+                    'shop_id', flat=True).distinct().order_by():
+                # версия читается до товаров: если каталог изменится во время сборки, магазин соберется заново
+                shop_version = catalog_version(shop_id)
+                shop = self.shops.get(shop_id)
+                shops[shop_id] = shop if shop and shop.version == shop_version else ShopSuggestions(
+                    shop_id, shop_version)
+            self.shops = shops
+            self.version = version
+
+    def suggest(self, text, shop_id=None, limit=None):
+        """
+        Продукты, название или модель которых содержит слово, начинающееся с введенной строки
+        :param text: введенная строка
+        :param shop_id: id магазина или None для всех магазинов
+        :param limit: наибольшее число подсказок, по умолчанию SUGGEST_LIMIT, приводится к 1..SUGGEST_MAX_LIMIT
+        :return: список словарей {'id': id продукта, 'name': название}
+        """
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        self.refresh()
+        shops = self.shops
+        if shop_id is not None:
+            shops = {shop_id: shops[shop_id]} if shop_id in shops else {}
+        limit = min(max(settings.SUGGEST_LIMIT if limit is None else limit, 1), settings.SUGGEST_MAX_LIMIT)
+        suggestions, seen = [], set()
+        for _, product in merge(*(shop.find(prefix) for shop in shops.values()), key=lambda pair: pair[0]):
+            if product['id'] not in seen:
+                seen.add(product['id'])
+                suggestions.append(product)
+                if len(suggestions) == limit:
+                    break
+        return suggestions
+
+
+suggest_index = SuggestIndex()
@@ -1,12 +1,20 @@
-from celery import shared_task
+from contextlib import ExitStack
+from itertools import chain
+from uuid import uuid4
+
+from celery import chord, shared_task
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
-from requests import get
-import requests
-from yaml import Loader, load as load_yaml
-from backend.models import Product, ProductInfo, Category, Shop, Parameter, ProductParameter
+from django.db import transaction
+from backend.catalog import shop_catalog_changed
+from backend.feeds import fetch_feed, open_feed, open_stored_feed
+from backend.importer import CatalogImporter
+from backend.jobs import ImportJobTracker
+from backend.models import BestOffer, CatalogEntry, ImportJob, Shop
+from backend.photos import ingest_photos
+from backend.utils import chunked
 from PIL import Image
-from django.core.files.base import ContentFile
 
 @shared_task
 def send_email(title, email, text_content, html_content = None):
@@ -34,50 +42,209 @@ def send_email(title, email, text_content, html_content = None):
     msg.send()
     
 @shared_task
-def do_import(url, user_id):
+def do_import(url, user_id, replace=False, job_id=None, upload=None):
+    """
+    Выполняет импорт прайса в формате yaml, json, ndjson или csv.
+
+    Повторный импорт того же url отправляет условный запрос и пропускается,
+    если сервер ответил 304 или содержимое прайса не изменилось.
+    Прайс длиннее IMPORT_CHUNK_SIZE товаров делится на части, которые пишут
+    не больше IMPORT_CHUNK_CONCURRENCY задач import_chunk, после чего
+    finish_import удаляет пропавшие товары. Каждая часть фиксируется своей
+    транзакцией: если одна из них упала, записанные части остаются в каталоге,
+    fail_import пересчитывает по ним сводные данные, а валидаторы прайса не
+    сохраняются, и следующий импорт загружает прайс целиком заново.
+    Ход импорта записывается в ImportJob.
+    :param url: url до файла прайса
+    :param user_id: id пользователя, который выполняет импорт
+    :param replace: удалить каталог магазина и загрузить заново вместо сравнения с текущим
+    :param job_id: id ImportJob, если не указан — создается новый
+    :param upload: прайс, загруженный через partner/upload (результат store_feed), вместо скачивания по url
+    :return: статистика импорта, если он выполнен в этой задаче, иначе None
+    """
+    if job_id is None:
+        job_id = ImportJob.objects.create(user_id=user_id, url=url).id
+    tracker = ImportJobTracker(job_id)
+    tracker.start()
+    try:
+        return import_feed(tracker, url, user_id, replace, upload)
+    except Exception as error:
+        tracker.finish('failure', error=str(error))
+        raise
+
+def import_feed(tracker, url, user_id, replace, upload=None):
     """
-    Выполняет импорт данных из yaml
-    :param url: url до файла yaml
+    Скачивает прайс и импортирует его, см. do_import
+    :param tracker: ImportJobTracker задачи
+    :param url: url до файла прайса
     :param user_id: id пользователя, который выполняет импорт
+    :param replace: удалить каталог магазина и загрузить заново вместо сравнения с текущим
+    :param upload: загруженный прайс (результат store_feed)
+    :return: статистика импорта, если он выполнен в этой задаче, иначе None
+    """
+    shop = Shop.objects.filter(user_id=user_id).first()
+    if upload:
+        same_feed = shop is not None and not replace
+        validators = ()
+        source = open_stored_feed(upload, upload.get('content_type', ''))
+    else:
+        same_feed = shop is not None and shop.url == url and not replace
+        validators = (shop.feed_etag, shop.feed_last_modified) if same_feed else ()
+        source = fetch_feed(url, *validators)
+
+    with ExitStack() as stack:
+        with tracker.phase('download'):
+            download = stack.enter_context(source)
+        tracker.add(bytes=download.size)
+        if same_feed and (download.not_modified or download.digest == shop.feed_digest):
+            if validators and (download.etag, download.last_modified) != validators:
+                Shop.objects.filter(id=shop.id).update(feed_etag=download.etag,
+                                                       feed_last_modified=download.last_modified)
+            tracker.finish('skipped')
+            return None
+        feed_validators = {'feed_etag': download.etag,
+                           'feed_last_modified': download.last_modified,
+                           'feed_digest': download.digest}
+
+        file = stack.enter_context(open(download.path, 'rb'))
+        feed = open_feed(file, download.content_type, upload['filename'] if upload else url)
+        chunks = chunked(feed.goods(), settings.IMPORT_CHUNK_SIZE)
+        with transaction.atomic():
+            if shop is None:
+                shop = Shop(user_id=user_id)
+            shop.name = feed.shop
+            # загруженный файл заменяет прайс по ссылке: ссылка сбрасывается, иначе poll_shop_feeds
+            # скачал бы старый прайс и перезаписал им загруженный каталог
+            shop.url = url or None
+            shop.save()
+            ImportJob.objects.filter(id=tracker.job_id).update(shop=shop)
+
+            importer = CatalogImporter(shop, progress=tracker.add)
+            with tracker.phase('prepare'):
+                importer.import_categories(feed.categories)
+                if replace:
+                    importer.clear()
+                rows = importer.prepare(next(chunks, []))
+                next_chunk = next(chunks, None)
+            if next_chunk is None:
+                with tracker.phase('write'):
+                    importer.write_rows(rows)
+                return finish_import([], tracker.job_id, feed_validators, importer.has_photos, importer.result())
+
+            with tracker.phase('prepare'):
+                keys = [stash_rows(rows)]
+                for chunk in chain([next_chunk], chunks):
+                    keys.append(stash_rows(importer.prepare(chunk)))
+            # части раскладываются по задачам по кругу, каждая задача пишет свои части по очереди
+            concurrency = min(settings.IMPORT_CHUNK_CONCURRENCY, len(keys))
+            import_chord = chord(import_chunk.s(tracker.job_id, keys[index::concurrency])
+                                 for index in range(concurrency))
+            finish = finish_import.s(tracker.job_id, feed_validators, importer.has_photos, importer.result())
+            transaction.on_commit(lambda: import_chord(finish.on_error(fail_import.s(tracker.job_id, keys))))
+    return None
+
+def stash_rows(rows):
+    """
+    Сохраняет подготовленную часть прайса в кэш для задачи import_chunk
+    :param rows: результат CatalogImporter.prepare()
+    :return: ключ кэша
+    """
+    key = f'import-chunk:{uuid4().hex}'
+    cache.set(key, rows, timeout=settings.IMPORT_CHUNK_TIMEOUT)
+    return key
+
+@shared_task
+def import_chunk(job_id, keys):
+    """
+    Записывает части прайса по очереди, каждую в своей транзакции
+    :param job_id: id ImportJob
+    :param keys: ключи кэша, под которыми stash_rows сохранил части прайса
+    :return: список результатов CatalogImporter.result() по частям
+    """
+    tracker = ImportJobTracker(job_id)
+    shop = ImportJob.objects.select_related('shop').get(id=job_id).shop
+    results = []
+    for key in keys:
+        rows = cache.get(key)
+        if rows is None:
+            raise RuntimeError(f'Часть прайса {key} не найдена в кэше')
+        importer = CatalogImporter(shop, progress=tracker.add)
+        with tracker.phase('write'), transaction.atomic():
+            importer.write_rows(rows)
+        cache.delete(key)
+        results.append(importer.result())
+    return results
+
+@shared_task
+def finish_import(results, job_id, feed_validators, has_photos, prepared):
+    """
+    Завершает импорт: удаляет пропавшие из прайса товары и сохраняет валидаторы прайса
+    :param results: результаты задач import_chunk
+    :param job_id: id ImportJob
+    :param feed_validators: ETag, Last-Modified и sha256 импортированного прайса
+    :param has_photos: в прайсе есть ссылки на фото
+    :param prepared: результат CatalogImporter.result() задачи do_import
+    :return: статистика импорта
+    """
+    tracker = ImportJobTracker(job_id)
+    shop = ImportJob.objects.select_related('shop').get(id=job_id).shop
+    importer = CatalogImporter(shop, progress=tracker.add)
+    for result in [prepared, *chain.from_iterable(results)]:
+        importer.merge(result)
+    with tracker.phase('finish'), transaction.atomic():
+        importer.delete_missing()
+        Shop.objects.filter(id=shop.id).update(**feed_validators)
+        shop_catalog_changed(shop.id, importer.touched_products)
+        if has_photos:
+            transaction.on_commit(lambda: import_photos.delay(shop.id))
+    tracker.finish('success', importer.stats)
+    return importer.stats
+
+@shared_task
+def fail_import(request, exc, traceback, job_id, keys=()):
+    """
+    Завершает импорт, если одна из задач import_chunk упала: удаляет из кэша
+    оставшиеся части и отмечает импорт неудачным.
+
+    Записанные до ошибки части уже зафиксированы, поэтому лучшие предложения,
+    число предложений по категориям и версия каталога пересчитываются по всем
+    товарам магазина. Пропавшие из прайса товары не удаляются, а валидаторы
+    прайса не сохраняются, так что следующий импорт пройдет целиком.
+    :param request: контекст упавшей задачи
+    :param exc: исключение
+    :param traceback: трассировка
+    :param job_id: id ImportJob
+    :param keys: ключи кэша всех частей прайса
     :return: None
     """
-    
-    stream = get(url).content
-    data = load_yaml(stream, Loader=Loader)
-    shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
-    
-    for category in data['categories']:
-        category, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-        category.shops.add(shop.id)
-        category.save()
-        
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-    
-    for good in data['goods']:
-        product, _ = Product.objects.get_or_create(name=good['name'], category_id=good['category'])
-        
-        file = None
-        if 'photo' in good:
-            response = requests.get(good['photo'])
-            if response.status_code == 200:
-                file_name = f"{good['id']}.{value.split('.')[-1]}"
-                file = ContentFile(response.content)
-                file.name = file_name
-                
-                
-        product_info = ProductInfo.objects.create(product_id=product.id,
-                                                    external_id=good['id'],
-                                                    model=good['model'],
-                                                    price=good['price'],
-                                                    price_rrc=good['price_rrc'],
-                                                    quantity=good['quantity'],
-                                                    photo=file,
-                                                    shop_id=shop.id)
-        for key, value in good['parameters'].items():
-            parameter, _ = Parameter.objects.get_or_create(name=key)
-            ProductParameter.objects.create(product_info_id=product_info.id,
-                                            parameter_id=parameter.id,
-                                            value=value)
+    cache.delete_many(keys)
+    shop_id = ImportJob.objects.filter(id=job_id).values_list('shop_id', flat=True).first()
+    if shop_id is not None:
+        with transaction.atomic():
+            # продукты, которые магазин продает сейчас, и те, чье лучшее предложение было у него до импорта
+            product_ids = set(CatalogEntry.objects.filter(shop_id=shop_id).values_list('product_id', flat=True))
+            product_ids.update(BestOffer.objects.filter(shop_id=shop_id).values_list('id', flat=True))
+            shop_catalog_changed(shop_id, product_ids)
+    ImportJobTracker(job_id).finish('failure', error=str(exc))
+
+@shared_task
+def poll_shop_feeds():
+    """
+    Запускает условный импорт для всех магазинов с сохраненной ссылкой на прайс
+    :return: None
+    """
+    for url, user_id in Shop.objects.filter(user__isnull=False).exclude(url=None).exclude(
+            url='').values_list('url', 'user_id'):
+        do_import.delay(url, user_id)
+
+@shared_task
+def import_photos(shop_id):
+    """
+    Загружает фото товаров магазина после того, как каталог сохранен
+    :param shop_id: id магазина
+    :return: число товаров, получивших фото
+    """
+    return ingest_photos(shop_id)
 
 @shared_task
 def create_thumbnail(path):
@@ -1,11 +1,42 @@
-import unittest
+import csv
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
 import json
-from django.test import RequestFactory, TestCase
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from cachalot.api import cachalot_disabled
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import AnonymousUser
 from django.urls import reverse
-from rest_framework.test import APIRequestFactory
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework.authtoken.models import Token
-from backend.models import Shop, User
+from yaml import Loader, dump as yaml_dump, load as load_yaml
+from backend.catalog import bump_catalog_version, catalog_version, offers_changed, offers_deleted, refresh_best_offers, \
+    refresh_catalog_entries, shop_catalog_changed
+from backend.facets import build_facets, count_facets, facet_counts, facet_key, parse_parameter_filters
+from backend.feeds import CsvFeed, YamlFeed, detect_format, open_feed
+from backend.importer import CatalogImporter
+from backend.jobs import ImportJobTracker
+from backend.management.commands.generate_feed import generate_goods
+from backend.photos import ingest_photos
+from backend.tasks import do_import, fail_import, finish_import, import_chunk, poll_shop_feeds, stash_rows
+from orders.celery import app as celery_app
+from backend.models import BestOffer, CatalogEntry, Category, CategoryCount, Contact, ImportJob, Order, OrderItem, Parameter, Product, ProductInfo, ProductParameter, Shop, User
+from backend.payloads import order_payload, with_total_sum
+from backend.suggest import suggest_index
+from backend.serializers import BestOfferSerializer, OrderSerializer, ProductInfoSerializer
 from backend.views import RegisterAccount, LoginAccount, PartnerOrders, PartnerState
 from rest_framework.authtoken.models import Token
 
@@ -353,4 +384,1663 @@ class PartnerStateTestCase(TestCase):
         response_data = json.loads(response_content)
 
         self.assertEqual(response_data, {'Status': False, 'Error': 'Только для магазинов'})
-    
\ No newline at end of file
+
+
+SHOP_FEED = settings.BASE_DIR.parent / 'data' / 'shop1.yaml'
+
+
+class CatalogImporterTestCase(TestCase):
+    def setUp(self):
+        """
+        Load the sample price list and create the shop it is imported into.
+        """
+
+        with open(SHOP_FEED, encoding='utf-8') as file:
+            self.data = load_yaml(file, Loader=Loader)
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.shop = Shop.objects.create(name=self.data['shop'], user=self.user)
+
+    def run_import(self, batch_size=None, replace=False):
+        with transaction.atomic():
+            importer = CatalogImporter(self.shop, batch_size=batch_size)
+            importer.import_categories(self.data['categories'])
+            if replace:
+                importer.clear()
+            importer.import_goods(self.data['goods'])
+            importer.delete_missing()
+        return importer
+
+    def test_import_creates_catalog(self):
+        """
+        Tests that every good of the price list becomes a ProductInfo with its
+        parameters, and that categories are linked to the shop.
+        """
+
+        importer = self.run_import()
+        goods = self.data['goods']
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), len(goods))
+        self.assertEqual(ProductParameter.objects.count(), sum(len(good['parameters']) for good in goods))
+        self.assertEqual(Category.objects.filter(shops=self.shop).count(), len(self.data['categories']))
+        self.assertEqual(importer.stats['inserted'], len(goods))
+
+        good = goods[0]
+        product_info = ProductInfo.objects.get(shop=self.shop, external_id=good['id'])
+        self.assertEqual(product_info.product.name, good['name'])
+        self.assertEqual(product_info.price, good['price'])
+        self.assertEqual(dict(product_info.product_parameters.values_list('parameter__name', 'value')),
+                         {key: str(value) for key, value in good['parameters'].items()})
+
+    def test_import_queries_grow_with_batches(self):
+        """
+        Tests that the number of queries depends on the number of batches
+        and not on the number of goods.
+        """
+
+        with CaptureQueriesContext(connection) as one_batch:
+            self.run_import(batch_size=len(self.data['goods']))
+        with CaptureQueriesContext(connection) as two_batches:
+            self.run_import(batch_size=len(self.data['goods']) // 2 + 1)
+        # silk adds EXPLAIN for its own profiling once a request has been made in the same process
+        one_batch, two_batches = ([query for query in queries if not query['sql'].startswith('EXPLAIN')]
+                                  for queries in (one_batch, two_batches))
+        # includes twelve queries per batch that keep the search index, the catalog and the best offers in sync
+        self.assertLess(len(one_batch), 34)
+        self.assertLess(len(two_batches), 2 * len(one_batch))
+
+    def test_reimport_replaces_catalog(self):
+        """
+        Tests that a repeated full import does not duplicate offers, products or parameters.
+        """
+
+        self.run_import()
+        products = Product.objects.count()
+        parameters = Parameter.objects.count()
+        importer = self.run_import(batch_size=3, replace=True)
+        self.assertEqual(importer.stats['deleted'], len(self.data['goods']))
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), len(self.data['goods']))
+        self.assertEqual(Product.objects.count(), products)
+        self.assertEqual(Parameter.objects.count(), parameters)
+
+    def test_reimport_unchanged_writes_nothing(self):
+        """
+        Tests that importing the same price list again keeps every row id and
+        reports no inserts, updates or deletes.
+        """
+
+        self.run_import()
+        ids = set(ProductInfo.objects.values_list('id', flat=True))
+        importer = self.run_import(batch_size=3)
+        self.assertEqual(set(ProductInfo.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(importer.stats, {'parsed': len(self.data['goods']), 'inserted': 0, 'updated': 0, 'deleted': 0})
+
+    def test_reimport_applies_differences(self):
+        """
+        Tests that only changed, new and missing goods are written, and that
+        goods referenced by orders are withdrawn instead of deleted.
+        """
+
+        self.run_import()
+        changed, removed, ordered = self.data['goods'][:3]
+        order = Order.objects.create(user=self.user, state='new')
+        ordered_info = ProductInfo.objects.get(shop=self.shop, external_id=ordered['id'])
+        OrderItem.objects.create(order=order, product_info=ordered_info, quantity=1)
+
+        changed['price'] += 100
+        changed['parameters']['Цвет'] = 'синий'
+        added = dict(removed, id=removed['id'] + 1000000)
+        self.data['goods'] = [added] + self.data['goods'][3:] + [changed]
+        importer = self.run_import()
+
+        self.assertEqual(importer.stats['inserted'], 1)
+        self.assertEqual(importer.stats['deleted'], 1)
+        self.assertEqual(importer.stats['updated'], 2)
+        product_info = ProductInfo.objects.get(shop=self.shop, external_id=changed['id'])
+        self.assertEqual(product_info.price, changed['price'])
+        self.assertEqual(product_info.product_parameters.get(parameter__name='Цвет').value, 'синий')
+        self.assertFalse(ProductInfo.objects.filter(shop=self.shop, external_id=removed['id']).exists())
+        ordered_info.refresh_from_db()
+        self.assertEqual(ordered_info.quantity, 0)
+        self.assertTrue(OrderItem.objects.filter(order=order).exists())
+
+
+class YamlFeedTestCase(TestCase):
+    def test_streaming_parse_matches_loader(self):
+        """
+        Tests that the streaming parser returns the same shop, categories and
+        goods as yaml.load on the sample price list.
+        """
+
+        with open(SHOP_FEED, 'rb') as file:
+            data = load_yaml(file, Loader=Loader)
+        with open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            goods = list(feed.goods())
+        self.assertEqual(feed.shop, data['shop'])
+        self.assertEqual(feed.categories, data['categories'])
+        self.assertEqual(goods, data['goods'])
+
+    def test_header_after_goods(self):
+        """
+        Tests that shop and categories listed after goods are read from a
+        seekable file, that a stream without seek() is rejected with a clear
+        error and that a price list without a shop is rejected.
+        """
+
+        with open(SHOP_FEED, 'rb') as file:
+            data = load_yaml(file, Loader=Loader)
+        content = yaml_dump({'goods': data['goods'], 'categories': data['categories'], 'shop': data['shop']},
+                            allow_unicode=True, sort_keys=False).encode()
+        feed = YamlFeed(io.BytesIO(content))
+        self.assertEqual(feed.shop, data['shop'])
+        self.assertEqual(feed.categories, data['categories'])
+        self.assertEqual(list(feed.goods()), data['goods'])
+
+        class Stream(io.RawIOBase):
+            def __init__(self, content):
+                self.content = io.BytesIO(content)
+
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                return self.content.readinto(buffer)
+
+        with self.assertRaisesMessage(ValueError, 'до goods'):
+            YamlFeed(Stream(content))
+        with self.assertRaises(ValueError):
+            YamlFeed(io.BytesIO('goods:\n- id: 1\ncategories: []\n'.encode()))
+
+
+def convert_feed(data, feed_format):
+    """
+    Convert a parsed yaml price list to the given feed format.
+    """
+
+    if feed_format == 'json':
+        return json.dumps(data, ensure_ascii=False).encode()
+    if feed_format == 'ndjson':
+        lines = [{'shop': data['shop'], 'categories': data['categories']}, *data['goods']]
+        return '\n'.join(json.dumps(line, ensure_ascii=False) for line in lines).encode()
+    categories = {category['id']: category['name'] for category in data['categories']}
+    parameters = list(dict.fromkeys(key for good in data['goods'] for key in good['parameters']))
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['shop', 'category', 'category_name', 'id', 'name', 'model', 'price', 'price_rrc', 'quantity',
+                     *parameters])
+    for good in data['goods']:
+        writer.writerow([data['shop'], good['category'], categories[good['category']], good['id'], good['name'],
+                         good['model'], good['price'], good['price_rrc'], good['quantity'],
+                         *[good['parameters'].get(key, '') for key in parameters]])
+    return output.getvalue().encode()
+
+
+class FeedFormatsTestCase(TestCase):
+    def setUp(self):
+        """
+        Read the sample price list.
+        """
+
+        with open(SHOP_FEED, 'rb') as file:
+            self.data = load_yaml(file, Loader=Loader)
+
+    def test_formats_yield_the_same_goods(self):
+        """
+        Tests that the JSON, NDJSON and CSV parsers, chosen by sniffing the
+        content, return the same shop, categories and goods as the yaml feed.
+        """
+
+        for feed_format in ('json', 'ndjson', 'csv'):
+            with self.subTest(feed_format=feed_format):
+                file = io.BytesIO(convert_feed(self.data, feed_format))
+                self.assertEqual(detect_format(file), feed_format)
+                feed = open_feed(file)
+                self.assertEqual(feed.shop, self.data['shop'])
+                self.assertEqual(sorted(feed.categories, key=lambda category: category['id']),
+                                 sorted(self.data['categories'], key=lambda category: category['id']))
+                goods = list(feed.goods())
+                self.assertEqual([good['id'] for good in goods], [good['id'] for good in self.data['goods']])
+                self.assertEqual([{key: str(value) for key, value in good['parameters'].items()} for good in goods],
+                                 [{key: str(value) for key, value in good['parameters'].items()}
+                                  for good in self.data['goods']])
+                self.assertEqual([good['price'] for good in goods], [good['price'] for good in self.data['goods']])
+
+    def test_format_from_content_type_and_url(self):
+        """
+        Tests that Content-Type takes precedence over the url extension and
+        that the yaml layout is the fallback.
+        """
+
+        file = io.BytesIO('shop: Связной'.encode())
+        self.assertEqual(detect_format(file, 'text/csv; charset=utf-8', 'http://example.com/feed.json'), 'csv')
+        self.assertEqual(detect_format(file, 'application/octet-stream', 'http://example.com/feed.jsonl'), 'ndjson')
+        self.assertEqual(detect_format(file, '', 'http://example.com/feed'), 'yaml')
+
+    def test_csv_without_required_columns_is_rejected(self):
+        """
+        Tests that a CSV price list without the shop column is rejected.
+        """
+
+        with self.assertRaises(ValueError):
+            CsvFeed(io.BytesIO(b'id,name\n1,test\n'))
+
+
+class ImportBenchmarkTestCase(TestCase):
+    def test_generated_feed_is_parsed_back(self):
+        """
+        Tests that the generated price list has the requested number of goods
+        and parameters in every format and that a new revision changes only
+        every tenth good.
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            for feed_format in ('yaml', 'json', 'ndjson', 'csv'):
+                with self.subTest(feed_format=feed_format):
+                    path = os.path.join(directory, f'feed.{feed_format}')
+                    call_command('generate_feed', path, goods=25, parameters=6, format=feed_format, stdout=io.StringIO())
+                    with open(path, 'rb') as file:
+                        goods = list(open_feed(file, url=path).goods())
+                    self.assertEqual(len(goods), 25)
+                    self.assertTrue(all(len(good['parameters']) == 6 for good in goods))
+
+        changed = [first['id'] for first, second in zip(generate_goods(30), generate_goods(30, revision=1))
+                   if first != second]
+        self.assertEqual(changed, [good['id'] for good in generate_goods(30)][::10])
+
+    def test_benchmark_report(self):
+        """
+        Tests that the benchmark imports, re-imports and updates a generated
+        feed, writes the measurements as JSON and removes the data it created.
+        """
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_import', sizes=[30], output=output.name, stderr=io.StringIO())
+            report = json.load(output)
+        self.assertEqual([(result['scenario'], result['state']) for result in report['results']],
+                         [('initial', 'success'), ('unchanged', 'skipped'), ('update', 'success')])
+        self.assertEqual(report['results'][0]['stats']['inserted'], 30)
+        self.assertEqual(report['results'][2]['stats']['updated'], 3)
+        self.assertTrue(all(result['queries'] and result['peak_rss_mb'] for result in report['results']))
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Category.objects.exists())
+        self.assertFalse(CatalogEntry.objects.exists())
+        self.assertFalse(BestOffer.objects.exists())
+        self.assertFalse(CategoryCount.objects.exists())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM backend_productsearch')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class LocalHTTPServer:
+    """
+    Serve fixed responses over HTTP on localhost and count the requests made.
+
+    `routes` maps a path to (status, body bytes) or (status, body bytes, headers).
+    A route with an ETag header answers 304 to a matching If-None-Match.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.hits = []
+        self.statuses = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits.append(self.path)
+                status, body, *headers = server.routes.get(self.path, (404, b''))
+                headers = headers[0] if headers else {}
+                if 'ETag' in headers and self.headers.get('If-None-Match') == headers['ETag']:
+                    status, body = 304, b''
+                server.statuses.append(status)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_port}{path}'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class PhotoIngestTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a shop with a product category and redirect media files to a
+        temporary directory.
+        """
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.shop = Shop.objects.create(name='Test Shop')
+        category = Category.objects.create(id=1, name='Смартфоны')
+        self.product = Product.objects.create(name='Смартфон', category=category)
+
+    def create_offer(self, external_id, photo_url, shop=None):
+        return ProductInfo.objects.create(product=self.product, shop=shop or self.shop, external_id=external_id,
+                                          quantity=1, price=1, price_rrc=1, photo_url=photo_url)
+
+    def test_ingest_deduplicates_urls_and_content(self):
+        """
+        Tests that each URL is fetched once, identical images share one stored
+        file, failed downloads are skipped and a second run fetches nothing.
+        """
+
+        routes = {'/a.jpg': (200, b'same image'), '/b.jpg': (200, b'same image'), '/c.jpg': (200, b'other')}
+        with LocalHTTPServer(routes) as server:
+            offers = [self.create_offer(1, server.url('/a.jpg')),
+                      self.create_offer(2, server.url('/a.jpg')),
+                      self.create_offer(3, server.url('/b.jpg')),
+                      self.create_offer(4, server.url('/c.jpg')),
+                      self.create_offer(5, server.url('/missing.jpg'))]
+            self.assertEqual(ingest_photos(self.shop.id), 4)
+            self.assertEqual(sorted(server.hits), ['/a.jpg', '/b.jpg', '/c.jpg', '/missing.jpg'])
+
+            for offer in offers:
+                offer.refresh_from_db()
+            self.assertEqual(offers[0].photo.name, offers[2].photo.name)
+            self.assertNotEqual(offers[0].photo.name, offers[3].photo.name)
+            self.assertEqual(offers[4].photo.name, '')
+
+            self.create_offer(6, server.url('/a.jpg'))
+            self.assertEqual(ingest_photos(self.shop.id), 1)
+            self.assertEqual(server.hits.count('/a.jpg'), 1)
+
+
+class DoImportTestCase(TestCase):
+    def setUp(self):
+        """
+        Read the sample price list and create the shop user that imports it.
+        """
+
+        with open(SHOP_FEED, 'rb') as file:
+            self.feed = file.read()
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+
+    def test_import_and_conditional_reimport(self):
+        """
+        Tests that the first import loads the catalog and stores the feed
+        validators, and that repeated imports of an unchanged feed are skipped
+        both on 304 and on an identical content digest.
+        """
+
+        with LocalHTTPServer({'/shop.yaml': (200, self.feed, {'ETag': '"v1"'}),
+                              '/plain.yaml': (200, self.feed)}) as server:
+            stats = do_import(server.url('/shop.yaml'), self.user.id)
+            self.assertEqual(stats['inserted'], ProductInfo.objects.count())
+            shop = Shop.objects.get(user=self.user)
+            self.assertEqual((shop.url, shop.feed_etag), (server.url('/shop.yaml'), '"v1"'))
+
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIsNone(do_import(server.url('/shop.yaml'), self.user.id))
+            self.assertEqual(server.statuses[-1], 304)
+            self.assertFalse([query for query in queries if 'backend_productinfo' in query['sql']])
+            self.assertEqual(ImportJob.objects.first().state, 'skipped')
+
+            self.assertIsNotNone(do_import(server.url('/plain.yaml'), self.user.id))
+            self.assertIsNone(do_import(server.url('/plain.yaml'), self.user.id))
+            self.assertEqual(server.statuses[-1], 200)
+
+            server.routes['/plain.yaml'] = (200, self.feed.replace(b'price: 110000', b'price: 100000'))
+            stats = do_import(server.url('/plain.yaml'), self.user.id)
+            self.assertEqual(stats['updated'], 1)
+
+    def test_large_feed_is_imported_in_parallel_chunks(self):
+        """
+        Tests that a feed longer than IMPORT_CHUNK_SIZE is split into chunk
+        subtasks whose results are merged by the finalizing callback, which
+        also removes goods missing from the feed.
+        """
+
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        stale = ProductInfo.objects.create(
+            product=Product.objects.create(name='Старый товар', category=Category.objects.create(id=999, name='Старое')),
+            shop=Shop.objects.create(name='Связной', user=self.user),
+            external_id=1, quantity=1, price=1, price_rrc=1)
+
+        # two tasks share the chunks, as they do on databases other than SQLite
+        with override_settings(IMPORT_CHUNK_SIZE=4, IMPORT_CHUNK_CONCURRENCY=2), \
+                LocalHTTPServer({'/shop.yaml': (200, self.feed)}) as server:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.assertIsNone(do_import(server.url('/shop.yaml'), self.user.id))
+        # the chord fan-out, the facet index rebuild and the catalog version bump
+        self.assertEqual(len(callbacks), 3)
+
+        goods = load_yaml(self.feed, Loader=Loader)['goods']
+        self.assertEqual(ProductInfo.objects.count(), len(goods))
+        self.assertFalse(ProductInfo.objects.filter(id=stale.id).exists())
+        self.assertEqual(ProductParameter.objects.count(), sum(len(good['parameters']) for good in goods))
+        self.assertTrue(Shop.objects.get(user=self.user).feed_digest)
+
+        job = ImportJob.objects.get()
+        self.assertEqual(job.state, 'success')
+        self.assertEqual((job.rows_parsed, job.rows_inserted, job.rows_deleted), (len(goods), len(goods), 1))
+        self.assertEqual(job.bytes_downloaded, len(self.feed))
+        self.assertEqual(set(job.timings), {'download', 'prepare', 'write', 'finish'})
+        self.assertFalse(cache.get_many(ImportJobTracker(job.id).keys()))
+
+    def test_failed_chunk_cleans_up(self):
+        """
+        Tests that a failed chunk leaves the chunks written before it in the
+        catalog with their best offers, and that fail_import drops the chunks
+        left in the cache and marks the job failed.
+        """
+
+        cache.clear()
+        shop = Shop.objects.create(name='Связной', user=self.user, state=True)
+        job = ImportJob.objects.create(user=self.user, shop=shop)
+        importer = CatalogImporter(shop)
+        feed = YamlFeed(io.BytesIO(self.feed))
+        importer.import_categories(feed.categories)
+        goods = list(feed.goods())
+        keys = [stash_rows(importer.prepare(goods[:2])), 'import-chunk:missing', stash_rows(importer.prepare(goods[2:]))]
+
+        with self.assertRaises(RuntimeError):
+            import_chunk(job.id, keys)
+        self.assertEqual(ProductInfo.objects.count(), 2)
+        self.assertFalse(BestOffer.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fail_import(None, RuntimeError('chunk failed'), None, job.id, keys)
+        self.assertFalse(cache.get_many(keys))
+        self.assertEqual(BestOffer.objects.count(), 2)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error), ('failure', 'chunk failed'))
+        self.assertEqual(Shop.objects.get(id=shop.id).feed_digest, '')
+
+    def test_import_csv_and_ndjson_feeds(self):
+        """
+        Tests that CSV and NDJSON price lists load the same catalog as the yaml one.
+        """
+
+        data = load_yaml(self.feed, Loader=Loader)
+        routes = {'/shop.yaml': (200, self.feed),
+                  '/shop.csv': (200, convert_feed(data, 'csv')),
+                  '/feed': (200, convert_feed(data, 'ndjson'), {'Content-Type': 'application/x-ndjson'})}
+        catalog = lambda: sorted(ProductInfo.objects.values_list(
+            'external_id', 'product__name', 'product__category_id', 'price', 'quantity'))
+        with LocalHTTPServer(routes) as server:
+            do_import(server.url('/shop.yaml'), self.user.id)
+            expected = catalog()
+            for path in ('/shop.csv', '/feed'):
+                stats = do_import(server.url(path), self.user.id, replace=True)
+                self.assertEqual(stats['inserted'], len(data['goods']))
+                self.assertEqual(catalog(), expected)
+                self.assertEqual(ProductParameter.objects.count(),
+                                 sum(len(good['parameters']) for good in data['goods']))
+
+
+class ImportJobTestCase(TestCase):
+    def setUp(self):
+        """
+        Create the shop user and an authenticated API client.
+        """
+
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with open(SHOP_FEED, 'rb') as file:
+            self.feed = file.read()
+
+    def test_failed_import_is_recorded(self):
+        """
+        Tests that a feed that cannot be downloaded marks the job as failed
+        with the error text.
+        """
+
+        job = ImportJob.objects.create(user=self.user, url='http://127.0.0.1/missing.yaml')
+        with LocalHTTPServer({}) as server, self.assertRaises(Exception):
+            do_import(server.url('/missing.yaml'), self.user.id, job_id=job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failure')
+        self.assertIn('404', job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_partner_imports(self):
+        """
+        Tests that partner/update returns the job id and that partner/imports
+        shows the finished job with its counters and the live counters of a
+        running job.
+        """
+
+        with LocalHTTPServer({'/shop.yaml': (200, self.feed)}) as server, \
+                patch('backend.views.do_import.delay', side_effect=lambda *args, **kwargs: do_import(*args, **kwargs)):
+            response = self.client.post(reverse('backend:partner-update'), {'url': server.url('/shop.yaml')})
+        job_id = response.json()['job_id']
+
+        response = self.client.get(reverse('backend:partner-imports'), {'id': job_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['state'], 'success')
+        self.assertEqual(response.json()['rows_inserted'], ProductInfo.objects.count())
+        self.assertIsNotNone(response.json()['rows_per_second'])
+
+        running = ImportJob.objects.create(user=self.user, state='running', started_at=timezone.now())
+        tracker = ImportJobTracker(running.id)
+        self.addCleanup(cache.delete_many, tracker.keys())
+        tracker.add(parsed=5, inserted=3)
+        response = self.client.get(reverse('backend:partner-imports'))
+        self.assertEqual([job['id'] for job in response.json()], [running.id, job_id])
+        self.assertEqual((response.json()[0]['rows_parsed'], response.json()[0]['rows_inserted']), (5, 3))
+
+        other = User.objects.create_user('buyer@example.com', 'testpassword', is_active=True)
+        self.client.force_authenticate(other)
+        response = self.client.get(reverse('backend:partner-imports'))
+        self.assertEqual(response.status_code, 403)
+
+
+class PartnerUploadTestCase(TestCase):
+    def setUp(self):
+        """
+        Create the shop user, store uploads in a temporary media directory and
+        run the import task synchronously.
+        """
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        patcher = patch('backend.views.do_import.delay', side_effect=lambda *args, **kwargs: do_import(*args, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with open(SHOP_FEED, 'rb') as file:
+            self.data = load_yaml(file, Loader=Loader)
+
+    def uploads_left(self):
+        directory = os.path.join(self.media_root, settings.FEED_UPLOAD_DIR)
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+    def test_multipart_gzip_upload(self):
+        """
+        Tests that a gzip-compressed NDJSON file sent as a multipart form is
+        unpacked, imported and removed from storage afterwards.
+        """
+
+        content = gzip.compress(convert_feed(self.data, 'ndjson'))
+        response = self.client.post(reverse('backend:partner-upload'),
+                                    {'file': SimpleUploadedFile('shop.ndjson.gz', content, 'application/gzip')})
+        self.assertEqual(response.status_code, 200)
+        job = ImportJob.objects.get(id=response.json()['job_id'])
+        self.assertEqual(job.state, 'success')
+        self.assertEqual(job.rows_inserted, len(self.data['goods']))
+        self.assertEqual(ProductInfo.objects.count(), len(self.data['goods']))
+        self.assertEqual(Shop.objects.get(user=self.user).name, self.data['shop'])
+        self.assertEqual(self.uploads_left(), [])
+
+    def test_raw_body_upload_and_unchanged_reupload(self):
+        """
+        Tests that a CSV file sent as the request body is imported and that
+        uploading the same file again is skipped by its digest.
+        """
+
+        content = convert_feed(self.data, 'csv')
+        url = reverse('backend:partner-upload') + '?filename=shop.csv'
+        response = self.client.post(url, content, content_type='application/octet-stream')
+        self.assertEqual(ImportJob.objects.get(id=response.json()['job_id']).state, 'success')
+        self.assertEqual(ProductInfo.objects.count(), len(self.data['goods']))
+
+        response = self.client.post(url, content, content_type='application/octet-stream')
+        self.assertEqual(ImportJob.objects.get(id=response.json()['job_id']).state, 'skipped')
+        self.assertEqual(self.uploads_left(), [])
+
+    def test_upload_replaces_polled_feed(self):
+        """
+        Tests that a shop whose catalog was uploaded is no longer polled by
+        its old feed url, so the uploaded catalog stays as it is.
+        """
+
+        shop = Shop.objects.create(name='Связной', user=self.user, url='http://127.0.0.1:9/shop.yaml')
+        content = convert_feed(self.data, 'csv')
+        self.client.post(reverse('backend:partner-upload') + '?filename=shop.csv', content,
+                         content_type='application/octet-stream')
+        catalog = sorted(ProductInfo.objects.values_list('external_id', 'price', 'quantity'))
+
+        with patch('backend.tasks.do_import.delay') as delay:
+            poll_shop_feeds()
+        delay.assert_not_called()
+        self.assertIsNone(Shop.objects.get(id=shop.id).url)
+        self.assertEqual(sorted(ProductInfo.objects.values_list('external_id', 'price', 'quantity')), catalog)
+
+    def test_upload_size_limit(self):
+        """
+        Tests that files larger than FEED_UPLOAD_MAX_SIZE are rejected both
+        by the request size and by the unpacked size of a gzip file.
+        """
+
+        content = convert_feed(self.data, 'ndjson')
+        with override_settings(FEED_UPLOAD_MAX_SIZE=len(content) - 1):
+            response = self.client.post(reverse('backend:partner-upload'), content,
+                                        content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 413)
+            response = self.client.post(reverse('backend:partner-upload'), gzip.compress(content),
+                                        content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 413)
+        response = self.client.post(reverse('backend:partner-upload'), b'\x1f\x8bnot gzip',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertEqual(self.uploads_left(), [])
+
+
+class PartnerStockTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a shop user with two goods.
+        """
+
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        shop = Shop.objects.create(name='Связной', user=self.user)
+        category = Category.objects.create(id=1, name='Смартфоны')
+        for external_id in (1, 2):
+            ProductInfo.objects.create(product=Product.objects.create(name=f'Смартфон {external_id}', category=category),
+                                       shop=shop, external_id=external_id, quantity=1, price=100, price_rrc=110)
+
+    def test_stock_update(self):
+        """
+        Tests that changed prices and quantities are written in a constant
+        number of queries and that unknown external ids are reported.
+        """
+
+        items = [[1, 90, 100, 5], {'external_id': 2, 'price': 100, 'price_rrc': 110, 'quantity': 1}, [3, 1, 1, 1]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('backend:partner-stock'), {'items': items}, format='json')
+        self.assertEqual(response.json(), {'Status': True, 'updated': 1, 'unchanged': 1, 'not_found': [3]})
+        self.assertEqual(ProductInfo.objects.filter(external_id=1).values_list('price', 'price_rrc', 'quantity').get(),
+                         (90, 100, 5))
+        # silk adds its own EXPLAIN and INSERT queries
+        self.assertEqual([query['sql'].split()[0] for query in queries
+                          if query['sql'].startswith(('SELECT', 'UPDATE')) and 'backend_productinfo' in query['sql']],
+                         ['SELECT', 'UPDATE'])
+
+    def test_invalid_rows_are_rejected(self):
+        """
+        Tests that rows with negative or missing values and items that are not a list are rejected without changes.
+        """
+
+        for items in ([[1, -1, 100, 5]], [[1, 90, 100]], [{'external_id': 1, 'price': 90}], 5, {'1': [90, 100, 5]}):
+            response = self.client.post(reverse('backend:partner-stock'), {'items': items}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(ProductInfo.objects.get(external_id=1).price, 100)
+
+
+class PartnerExportTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list for a shop user.
+        """
+
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with open(SHOP_FEED, 'rb') as file:
+            self.data = load_yaml(file, Loader=Loader)
+        shop = Shop.objects.create(name=self.data['shop'], user=self.user)
+        with open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+
+    def test_export_round_trip(self):
+        """
+        Tests that every export format streams a price list which parses back
+        to the imported goods.
+        """
+
+        expected = sorted((good['id'], good['name'], good['price'], good['quantity'],
+                           {key: str(value) for key, value in good['parameters'].items()})
+                          for good in self.data['goods'])
+        for feed_format in ('yaml', 'json', 'ndjson', 'csv'):
+            with self.subTest(feed_format=feed_format):
+                response = self.client.get(reverse('backend:partner-export'), {'type': feed_format})
+                self.assertTrue(response.streaming)
+                feed = open_feed(io.BytesIO(b''.join(response.streaming_content)), response['Content-Type'])
+                self.assertEqual(feed.shop, self.data['shop'])
+                self.assertEqual(sorted(category['id'] for category in feed.categories),
+                                 sorted(category['id'] for category in self.data['categories']))
+                self.assertEqual(sorted((good['id'], good['name'], good['price'], good['quantity'],
+                                         {key: str(value) for key, value in good['parameters'].items()})
+                                        for good in feed.goods()), expected)
+
+    def test_export_includes_unlinked_categories(self):
+        """
+        Tests that goods in a category not linked to the shop are exported
+        with that category in every format instead of breaking the stream.
+        """
+
+        shop = Shop.objects.get(user=self.user)
+        category = Category.objects.create(id=100, name='Планшеты')
+        Product.objects.filter(id=ProductInfo.objects.filter(shop=shop).order_by('id').first().product_id).update(
+            category=category)
+        self.assertFalse(shop.categories.filter(id=category.id).exists())
+        for feed_format in ('yaml', 'json', 'ndjson', 'csv'):
+            with self.subTest(feed_format=feed_format):
+                response = self.client.get(reverse('backend:partner-export'), {'type': feed_format})
+                feed = open_feed(io.BytesIO(b''.join(response.streaming_content)), response['Content-Type'])
+                self.assertIn({'id': 100, 'name': 'Планшеты'}, feed.categories)
+                self.assertEqual(len(list(feed.goods())), len(self.data['goods']))
+
+    def test_export_requires_shop(self):
+        """
+        Tests that buyers cannot export and that unknown formats are rejected.
+        """
+
+        response = self.client.get(reverse('backend:partner-export'), {'type': 'xml'})
+        self.assertFalse(response.json()['Status'])
+        self.client.force_authenticate(User.objects.create_user('buyer@example.com', 'testpassword', is_active=True))
+        self.assertEqual(self.client.get(reverse('backend:partner-export')).status_code, 403)
+
+
+class ProductInfoPaginationTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a shop with seven goods.
+        """
+
+        # /products responses are cached in Redis, which is not rolled back with the database
+        cache.clear()
+        shop = Shop.objects.create(name='Связной', state=True)
+        category = Category.objects.create(id=1, name='Смартфоны')
+        self.ids = [ProductInfo.objects.create(
+            product=Product.objects.create(name=f'Смартфон {number}', category=category), shop=shop,
+            external_id=number, quantity=1, price=100, price_rrc=110).id for number in range(7)]
+        refresh_catalog_entries(self.ids)
+        self.client = APIClient()
+
+    def test_cursor_pages(self):
+        """
+        Tests that following the next links returns every product once in id
+        order and that a later page costs the same number of queries as the first.
+        """
+
+        url = reverse('backend:shops') + '?limit=3'
+        seen, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            # silk adds its own EXPLAIN and INSERT queries
+            queries.append(len([query for query in captured if query['sql'].startswith('SELECT')
+                                and 'backend_catalogentry' in query['sql']]))
+            self.assertLessEqual(len(response.json()['results']), 3)
+            seen.extend(product['id'] for product in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(seen, self.ids)
+        self.assertEqual(queries, [1, 1, 1])
+
+    def test_invalid_filters(self):
+        """
+        Tests that non-integer or repeated shop_id and category_id return 400 instead of a server error.
+        """
+
+        self.assertEqual(len(self.client.get(reverse('backend:shops'), {'category_id': 1}).json()['results']), 7)
+        for query in ('category_id=abc', 'shop_id=abc', 'category_id=-1', 'category_id=1&category_id=2'):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('backend:shops') + '?' + query)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['Status'])
+
+
+class CatalogEntryTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list into an active shop owned by a partner.
+        """
+
+        # /products responses are cached in Redis, which is not rolled back with the database
+        cache.clear()
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.shop = Shop.objects.create(name='Связной', state=True, user=self.user)
+        with transaction.atomic(), open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+        self.client = APIClient()
+
+    def get(self, **params):
+        return self.client.get(reverse('backend:shops'), {'limit': 100, **params}).json()['results']
+
+    def test_listing_matches_product_info(self):
+        """
+        Tests that the listing built from CatalogEntry has the same shape and
+        values as ProductInfoSerializer over the joined tables.
+        """
+
+        product_infos = ProductInfo.objects.filter(shop=self.shop).order_by('id').select_related(
+            'product__category').prefetch_related('product_parameters__parameter')
+        self.assertEqual(json.loads(json.dumps(self.get())),
+                         json.loads(json.dumps(ProductInfoSerializer(product_infos, many=True).data)))
+
+    def test_entries_follow_stock_and_state(self):
+        """
+        Tests that stock updates and PartnerState.post are reflected in the
+        catalog table and that goods of a disabled shop leave the listing.
+        """
+
+        product_info = ProductInfo.objects.filter(shop=self.shop).first()
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('backend:partner-stock'), {'items': [[product_info.external_id, 1, 2, 3]]},
+                         format='json')
+        self.assertEqual(CatalogEntry.objects.filter(id=product_info.id).values_list(
+            'price', 'price_rrc', 'quantity').get(), (1, 2, 3))
+
+        self.client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        self.assertFalse(CatalogEntry.objects.filter(shop=self.shop, shop_state=True).exists())
+        self.assertEqual(self.get(), [])
+
+    def test_deleted_goods_leave_catalog(self):
+        """
+        Tests that goods missing from a repeated import are removed from the catalog table.
+        """
+
+        with transaction.atomic(), open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(list(feed.goods())[1:])
+            importer.delete_missing()
+        self.assertEqual(set(CatalogEntry.objects.values_list('id', flat=True)),
+                         set(ProductInfo.objects.values_list('id', flat=True)))
+
+
+class BestOfferTestCase(TestCase):
+    def setUp(self):
+        """
+        Create two partner shops that sell the same two products at different prices.
+        """
+
+        cache.clear()
+        category = Category.objects.create(id=1, name='Смартфоны')
+        self.products = [Product.objects.create(name=f'Смартфон {number}', category=category) for number in range(2)]
+        self.partners, self.shops, self.offers = [], [], []
+        for number, price in enumerate((100, 90)):
+            partner = User.objects.create_user(f'shop{number}@example.com', 'testpassword', type='shop',
+                                               is_active=True)
+            shop = Shop.objects.create(name=f'Магазин {number}', state=True, user=partner)
+            self.partners.append(partner)
+            self.shops.append(shop)
+            self.offers.append([ProductInfo.objects.create(product=product, shop=shop, external_id=index,
+                                                           quantity=5, price=price + index, price_rrc=200)
+                                for index, product in enumerate(self.products)])
+        offers_changed([offer.id for offers in self.offers for offer in offers])
+        self.client = APIClient()
+
+    def best(self, product):
+        return BestOffer.objects.filter(id=product.id).values_list('shop_id', 'price', 'offer_count').first()
+
+    def test_endpoint_reads_best_offer_table(self):
+        """
+        Tests that /products/best returns the cheapest offer of every product
+        and reads no table but BestOffer.
+        """
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('backend:products-best'))
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([(result['id'], result['shop'], result['price'], result['offer_count'])
+                          for result in results],
+                         [(self.products[0].id, self.shops[1].id, 90, 2), (self.products[1].id, self.shops[1].id, 91, 2)])
+        self.assertEqual(results[0]['product'], {'name': 'Смартфон 0', 'category': 'Смартфоны'})
+        self.assertEqual(results[0]['product_info'], self.offers[1][0].id)
+        self.assertEqual(json.loads(json.dumps(results)), json.loads(json.dumps(BestOfferSerializer(
+            BestOffer.objects.order_by('id'), many=True).data)))
+        tables = {query['sql'].split('FROM ')[1].split()[0] for query in captured
+                  if query['sql'].startswith('SELECT') and 'backend_' in query['sql']}
+        self.assertEqual(tables, {'"backend_bestoffer"'})
+
+        self.assertEqual(len(self.client.get(reverse('backend:products-best'),
+                                             {'product_id': self.products[1].id}).json()['results']), 1)
+        self.assertEqual(self.client.get(reverse('backend:products-best'), {'category_id': 2}).json()['results'], [])
+        for params in ({'category_id': 'x'}, {'product_id': '1.5'}):
+            self.assertEqual(self.client.get(reverse('backend:products-best'), params).status_code, 400)
+
+    def test_import_chunks_defer_best_offers(self):
+        """
+        Tests that import chunks written separately leave BestOffer alone and
+        that finishing the import picks the cheapest offer across the chunks.
+        """
+
+        shop = self.shops[0]
+        importer = CatalogImporter(shop)
+        rows = importer.prepare([{'id': external_id, 'category': 1, 'model': '', 'name': 'Смартфон 0', 'price': price,
+                                  'price_rrc': 200, 'quantity': 1, 'parameters': {}}
+                                 for external_id, price in ((10, 70), (11, 50))])
+        chunks = [CatalogImporter(shop), CatalogImporter(shop)]
+        for chunk, chunk_rows in zip(chunks, (rows[:1], rows[1:])):
+            chunk.write_rows(chunk_rows)
+        self.assertEqual(self.best(self.products[0]), (self.shops[1].id, 90, 2))
+
+        for chunk in chunks:
+            importer.merge(chunk.result())
+        shop_catalog_changed(shop.id, importer.touched_products)
+        self.assertEqual(self.best(self.products[0]), (shop.id, 50, 4))
+
+    def test_follows_stock_and_state(self):
+        """
+        Tests that stock updates, sold out offers and shop state changes move the best offer.
+        """
+
+        self.client.force_authenticate(self.partners[0])
+        self.client.post(reverse('backend:partner-stock'), {'items': [[0, 80, 200, 5]]}, format='json')
+        self.assertEqual(self.best(self.products[0]), (self.shops[0].id, 80, 2))
+        self.client.post(reverse('backend:partner-stock'), {'items': [[0, 80, 200, 0]]}, format='json')
+        self.assertEqual(self.best(self.products[0]), (self.shops[1].id, 90, 1))
+
+        self.client.force_authenticate(self.partners[1])
+        self.client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        self.assertIsNone(self.best(self.products[0]))
+        self.assertEqual(self.best(self.products[1]), (self.shops[0].id, 101, 1))
+        self.client.post('/api/v1/partner/state', {'state': 'on'}, format='json')
+        self.assertEqual(self.best(self.products[1]), (self.shops[1].id, 91, 2))
+
+    def test_deleted_offers_and_rebuild(self):
+        """
+        Tests that deleted offers leave the best offers and that rebuild_catalog produces the same rows.
+        """
+
+        offers_deleted([self.offers[1][0].id])
+        ProductInfo.objects.filter(id=self.offers[1][0].id).delete()
+        self.assertEqual(self.best(self.products[0]), (self.shops[0].id, 100, 1))
+
+        rows = list(BestOffer.objects.order_by('id').values())
+        versions = [catalog_version(), catalog_version(self.shops[0].id)]
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_catalog', stdout=io.StringIO())
+        self.assertEqual(list(BestOffer.objects.order_by('id').values()), rows)
+        self.assertNotIn(catalog_version(), versions)
+        self.assertNotEqual(catalog_version(self.shops[0].id), versions[1])
+
+    def test_orm_deletes_remove_rows(self):
+        """
+        Tests that offers, products and shops deleted without backend.catalog,
+        as the admin does, take their CatalogEntry and BestOffer rows along.
+        """
+
+        self.offers[1][0].delete()
+        self.assertFalse(CatalogEntry.objects.filter(id=self.offers[1][0].id).exists())
+        self.assertIsNone(self.best(self.products[0]))
+
+        self.products[1].delete()
+        self.assertFalse(BestOffer.objects.filter(id=self.products[1].id).exists())
+        self.assertFalse(CatalogEntry.objects.filter(product_id=self.products[1].id).exists())
+
+        refresh_best_offers([self.products[0].id])
+        Shop.objects.filter(id=self.shops[0].id).delete()
+        self.assertFalse(CatalogEntry.objects.exists())
+        self.assertFalse(BestOffer.objects.exists())
+
+
+@override_settings(SUGGEST_CHECK_INTERVAL=0)
+class SuggestTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list into an active shop owned by a partner.
+        """
+
+        # the catalog version lives in Redis, which is not rolled back with the database
+        cache.clear()
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.shop = Shop.objects.create(name='Связной', state=True, user=self.user)
+        with transaction.atomic(), open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+        self.client = APIClient()
+
+    def suggest(self, q, **params):
+        response = self.client.get(reverse('backend:products-suggest'), {'q': q, **params})
+        return [suggestion['name'] for suggestion in response.json()['suggestions']]
+
+    def test_prefix_matches_words_and_models(self):
+        """
+        Tests that suggestions match the start of any word of the name or the
+        model and that repeated requests do not read the database.
+        """
+
+        self.assertCountEqual(self.suggest('iPhone XR'), ['Смартфон Apple iPhone XR 128GB (синий)',
+                                                          'Смартфон Apple iPhone XR 256GB (красный)',
+                                                          'Смартфон Apple iPhone XR 256GB (черный)'])
+        self.assertEqual(self.suggest('galaxy n'), ['Smartphone Samsung Galaxy Note20 256GB (mystic bronze)'])
+        self.assertEqual(self.suggest('xiaomi/mi'), ['Smartphone Xiaomi Mi 10T Pro 256GB (cosmic black)'])
+        self.assertEqual(len(self.suggest('смартфон', limit=2)), 2)
+        self.assertEqual(self.suggest('samsung', shop_id=self.shop.id + 1), [])
+        self.assertEqual(self.suggest(' '), [])
+        for limit in ('x', '0', '-1'):
+            self.assertEqual(self.client.get(reverse('backend:products-suggest'),
+                                             {'q': 'smart', 'limit': limit}).status_code, 400)
+        with override_settings(SUGGEST_MAX_LIMIT=2):
+            self.assertEqual(len(self.suggest('smart', limit=50)), 2)
+            self.assertEqual(len(suggest_index.suggest('smart', limit=-1)), 1)
+
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(len(self.suggest('samsung')), 3)
+        self.assertEqual([query['sql'] for query in captured if 'backend_' in query['sql']], [])
+
+    def test_rebuilt_when_shop_version_changes(self):
+        """
+        Tests that a shop's suggestions are rebuilt after its catalog version
+        changes while other shops keep their index.
+        """
+
+        other = Shop.objects.create(name='Другой магазин', state=True)
+        product_info = ProductInfo.objects.create(
+            product=Product.objects.create(name='Телевизор Horizont', category=Category.objects.first()), shop=other,
+            external_id=1, quantity=1, price=100, price_rrc=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            offers_changed([product_info.id])
+            shop_catalog_changed(other.id)
+        self.assertEqual(self.suggest('horiz'), ['Телевизор Horizont'])
+        other_index = suggest_index.shops[other.id]
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        self.assertEqual(self.suggest('iphone'), [])
+        self.assertIs(suggest_index.shops[other.id], other_index)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/partner/state', {'state': 'on'}, format='json')
+        self.assertEqual(len(self.suggest('iphone')), 4)
+
+
+class CategoryTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list into an active shop owned by a partner and finish the import.
+        """
+
+        cache.clear()
+        self.user = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        self.shop = Shop.objects.create(name='Связной', state=True, user=self.user)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic(), open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+            shop_catalog_changed(self.shop.id)
+        self.client = APIClient()
+
+    def counts(self, **params):
+        return {category['name']: category['offer_count']
+                for category in self.client.get(reverse('backend:categories'), params).json()}
+
+    def test_counts_come_from_aggregate_table(self):
+        """
+        Tests that the categories carry their shops and in-stock offer counts
+        and that the endpoint does not read the goods tables.
+        """
+
+        expected = {category.name: ProductInfo.objects.filter(product__category=category, quantity__gt=0).count()
+                    for category in Category.objects.all()}
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('backend:categories'))
+        self.assertEqual({category['name']: category['offer_count'] for category in response.json()}, expected)
+        self.assertEqual(response.json()[0]['shops'],
+                         [{'id': self.shop.id, 'name': 'Связной', 'offer_count': expected[response.json()[0]['name']]}])
+        self.assertFalse([query for query in captured
+                          if 'backend_productinfo' in query['sql'] or 'backend_catalogentry' in query['sql']])
+        self.assertEqual(self.counts(shop_id=self.shop.id + 1), {})
+        self.assertEqual(self.client.get(reverse('backend:categories'), {'shop_id': 'x'}).status_code, 400)
+
+    def test_counts_follow_stock_and_state(self):
+        """
+        Tests that a stock update refreshes the counts and that a disabled shop drops out of the categories.
+        """
+
+        product_info = ProductInfo.objects.filter(shop=self.shop, quantity__gt=0).select_related(
+            'product__category').first()
+        category = product_info.product.category.name
+        before = self.counts()[category]
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('backend:partner-stock'), {'items': [[product_info.external_id, 1, 2, 0]]},
+                         format='json')
+        self.assertEqual(self.counts()[category], before - 1)
+
+        self.client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        categories = self.client.get(reverse('backend:categories')).json()
+        self.assertEqual({(category['offer_count'], len(category['shops'])) for category in categories}, {(0, 0)})
+
+
+class ListingCacheTestCase(TestCase):
+    def setUp(self):
+        """
+        Create two partner shops with one good each.
+        """
+
+        cache.clear()
+        category = Category.objects.create(id=1, name='Смартфоны')
+        self.shops = []
+        for number in range(2):
+            user = User.objects.create_user(f'shop{number}@example.com', 'testpassword', type='shop', is_active=True)
+            shop = Shop.objects.create(name=f'Магазин {number}', state=True, user=user)
+            refresh_catalog_entries([ProductInfo.objects.create(
+                product=Product.objects.create(name=f'Смартфон {number}', category=category), shop=shop,
+                external_id=1, quantity=1, price=100, price_rrc=110).id])
+            self.shops.append(shop)
+        self.client = APIClient()
+
+    def get(self, **params):
+        """
+        Returns the listing and the number of queries it made to the catalog table.
+        """
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('backend:shops'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len([query for query in captured if query['sql'].startswith('SELECT')
+                                                and 'backend_catalogentry' in query['sql']])
+
+    def test_other_shops_pages_survive(self):
+        """
+        Tests that a repeated request is served from the cache and that a state
+        change of one shop drops only its pages and the pages across all shops.
+        """
+
+        first, second = self.shops
+        self.assertEqual(self.get(shop_id=first.id)[1], 1)
+        self.assertEqual(self.get(shop_id=first.id)[1], 0)
+        self.assertEqual(len(self.get()[0]), 2)
+
+        self.client.force_authenticate(second.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        self.assertEqual(self.get(shop_id=first.id)[1], 0)
+        results, queries = self.get()
+        self.assertEqual(queries, 1)
+        self.assertEqual([product['shop'] for product in results], [first.id])
+
+    def test_stock_update_drops_shop_pages(self):
+        """
+        Tests that a stock update makes the shop's cached pages stale.
+        """
+
+        first = self.shops[0]
+        self.get(shop_id=first.id)
+        self.client.force_authenticate(first.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('backend:partner-stock'), {'items': [[1, 90, 100, 5]]}, format='json')
+        results, queries = self.get(shop_id=first.id)
+        self.assertEqual(queries, 1)
+        self.assertEqual(results[0]['price'], 90)
+
+    def test_shop_filter_and_key_use_one_shop(self):
+        """
+        Tests that a cached page filtered by shop is rebuilt when that shop's
+        version changes and that a repeated or non-integer shop_id is rejected.
+        """
+
+        first = self.shops[0]
+        # cachalot would answer the repeated catalog query from its cache
+        with cachalot_disabled():
+            self.get(shop_id=first.id)
+            self.assertEqual(self.get(shop_id=first.id)[1], 0)
+            with self.captureOnCommitCallbacks(execute=True):
+                bump_catalog_version(first.id)
+            self.assertEqual(self.get(shop_id=first.id)[1], 1)
+
+        for query in (f'shop_id={first.id}&shop_id={self.shops[1].id}', 'shop_id=x'):
+            self.assertEqual(self.client.get(reverse('backend:shops') + '?' + query).status_code, 400)
+
+    def test_shared_category_rename_drops_other_shops_pages(self):
+        """
+        Tests that a category renamed by one shop's import makes the cached
+        pages of every shop selling goods in it stale.
+        """
+
+        first, second = self.shops
+        self.get(shop_id=first.id)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            CatalogImporter(second).import_categories([{'id': 1, 'name': 'Телефоны'}])
+        results, queries = self.get(shop_id=first.id)
+        self.assertEqual(queries, 1)
+        self.assertEqual(results[0]['product']['category'], 'Телефоны')
+
+
+class PayloadsTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list and create a confirmed order and a basket.
+        """
+
+        cache.clear()
+        self.shop = Shop.objects.create(name='Связной', state=True)
+        with transaction.atomic(), open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+        self.user = User.objects.create_user('buyer@example.com', 'testpassword', is_active=True)
+        contact = Contact.objects.create(user=self.user, city='Москва', street='Тверская', phone='+79990000000')
+        product_infos = list(ProductInfo.objects.order_by('id')[:3])
+        for state, contact, items in (('new', contact, product_infos), ('basket', None, product_infos[:1])):
+            order = Order.objects.create(user=self.user, state=state, contact=contact)
+            for number, product_info in enumerate(items, start=1):
+                OrderItem.objects.create(order=order, product_info=product_info, quantity=number)
+        Order.objects.create(user=self.user, state='canceled')
+
+    def test_orders_match_serializer(self):
+        """
+        Tests that the values() based payload has the same shape and values as
+        OrderSerializer, including orders without items or contact.
+        """
+
+        orders = Order.objects.filter(user=self.user).annotate(
+            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        expected = OrderSerializer(orders.prefetch_related(
+            'ordered_items__product_info__product__category',
+            'ordered_items__product_info__product_parameters__parameter').select_related('contact'), many=True).data
+        with CaptureQueriesContext(connection) as captured:
+            payload = order_payload(orders)
+        self.assertEqual(json.loads(json.dumps(payload)), json.loads(json.dumps(expected)))
+        # orders, items, parameters, goods and contacts; silk may add EXPLAIN for each of them
+        self.assertEqual(len([query for query in captured if query['sql'].startswith('SELECT')]), 5)
+
+    def test_sparse_fields_and_compact_mode(self):
+        """
+        Tests that fields= limits product keys, that compact orders skip the
+        goods and parameter queries, and that unknown names are rejected.
+        """
+
+        client = APIClient()
+        results = client.get(reverse('backend:shops'), {'fields': 'price,id'}).json()['results']
+        self.assertEqual(set(results[0]), {'id', 'price'})
+        results = client.get(reverse('backend:shops'), {'compact': '1'}).json()['results']
+        self.assertNotIn('product_parameters', results[0])
+        self.assertEqual(client.get(reverse('backend:shops'), {'fields': 'id,secret'}).status_code, 400)
+
+        client.force_authenticate(self.user)
+        for params, tables in (({'compact': '1'}, ()), ({'expand': 'product_info'}, ('backend_productinfo',)),
+                               ({}, ('backend_productinfo', 'backend_productparameter'))):
+            # cachalot would answer the repeated goods query from its cache
+            with self.subTest(params=params), cachalot_disabled(), CaptureQueriesContext(connection) as captured:
+                # the order list is streamed, so the queries run while the body is read
+                client.get('/api/v1/order', params).getvalue()
+                read = {table for table in ('backend_productinfo', 'backend_productparameter')
+                        for query in captured if query['sql'].startswith(f'SELECT "{table}"')}
+                self.assertEqual(read, set(tables))
+        order = json.loads(client.get('/api/v1/order', {'compact': 'true'}).getvalue())[0]
+        self.assertIsInstance(order['ordered_items'][0]['product_info'], int)
+        self.assertIsInstance(order['contact'], int)
+        item = json.loads(client.get('/api/v1/order', {'expand': 'product_info', 'fields': 'id,price'}).getvalue())[0][
+            'ordered_items'][0]
+        self.assertEqual(set(item['product_info']), {'id', 'price'})
+        self.assertEqual(client.get('/api/v1/basket', {'expand': 'everything'}).status_code, 400)
+
+    @override_settings(ORDERS_STREAM_CHUNK_SIZE=1)
+    def test_orders_streamed_in_chunks(self):
+        """
+        Tests that the order list is streamed as one JSON array per chunk of
+        orders and matches the payload built in a single pass.
+        """
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/v1/order')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        with CaptureQueriesContext(connection) as captured:
+            chunks = list(response.streaming_content)
+        orders = json.loads(b''.join(chunks))
+        expected = order_payload(with_total_sum(Order.objects.filter(user=self.user).order_by('id')))
+        self.assertEqual(orders, json.loads(json.dumps(expected)))
+        # one chunk per order, the first one opening the array, and the closing bracket
+        self.assertEqual(len(chunks), len(expected) + 1)
+        # every chunk reads its own orders and items
+        order_queries = [query for query in captured if query['sql'].startswith('SELECT')
+                         and 'FROM "backend_order" ' in query['sql'] and 'backend_orderitem' in query['sql']]
+        self.assertEqual(len(order_queries), len(expected))
+
+        self.assertEqual(json.loads(client.get('/api/v1/order', {'state': 'confirmed'}).getvalue()), [])
+
+    def test_benchmark_report(self):
+        """
+        Tests that the serializer benchmark reports every variant for products and orders.
+        """
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_serializers', limit=10, repeat=1, output=output.name, stderr=io.StringIO())
+            report = json.load(output)
+        self.assertEqual([(result['case'], result['variant']) for result in report['results']],
+                         [('products', 'product_info_serializer'), ('products', 'catalog_entry_serializer'),
+                          ('products', 'payload'), ('products', 'payload_compact'), ('orders', 'order_serializer'),
+                          ('orders', 'payload'), ('orders', 'payload_compact')])
+        self.assertTrue(all(result['objects_per_second'] > 0 for result in report['results']))
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        """
+        Create a partner shop with two goods and a buyer with a basket holding one of them.
+        """
+
+        cache.clear()
+        self.partner = User.objects.create_user('shop@example.com', 'testpassword', type='shop', is_active=True)
+        shop = Shop.objects.create(name='Связной', state=True, user=self.partner)
+        category = Category.objects.create(id=1, name='Смартфоны')
+        self.product_infos = [ProductInfo.objects.create(
+            product=Product.objects.create(name=f'Смартфон {number}', category=category), shop=shop,
+            external_id=number, quantity=5, price=100, price_rrc=110) for number in range(2)]
+        refresh_catalog_entries([product_info.id for product_info in self.product_infos])
+        self.buyer = User.objects.create_user('buyer@example.com', 'testpassword', is_active=True)
+        basket = Order.objects.create(user=self.buyer, state='basket')
+        OrderItem.objects.create(order=basket, product_info=self.product_infos[0], quantity=1)
+        self.client = APIClient()
+
+    def get(self, url, etag=None):
+        """
+        Returns the response and the SELECT queries it made outside the cache and session tables.
+        """
+
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, **headers)
+        return response, [query['sql'] for query in captured if query['sql'].startswith('SELECT')
+                          and ('backend_catalogentry' in query['sql'] or 'backend_orderitem' in query['sql'])]
+
+    def test_products_not_modified(self):
+        """
+        Tests that a matching If-None-Match returns 304 without reading the
+        catalog and that a shop state change produces a new ETag.
+        """
+
+        response, _ = self.get(reverse('backend:shops'))
+        etag = response['ETag']
+        response, queries = self.get(reverse('backend:shops'), etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, [])
+
+        self.client.force_authenticate(self.partner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        response, _ = self.get(reverse('backend:shops'), etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_category_renamed_by_other_shop(self):
+        """
+        Tests that a category renamed by another shop's import changes the
+        ETag of this shop's listing instead of answering 304 with the old name.
+        """
+
+        url = f"{reverse('backend:shops')}?shop_id={self.product_infos[0].shop_id}"
+        response, _ = self.get(url)
+        etag = response['ETag']
+        other = Shop.objects.create(name='Другой магазин', state=True)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            CatalogImporter(other).import_categories([{'id': 1, 'name': 'Телефоны'}])
+        response, _ = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['product']['category'], 'Телефоны')
+
+    def test_shop_listing_etag_follows_stock(self):
+        """
+        Tests that the ETag of a listing filtered by shop changes after a stock
+        update of that shop and that a repeated shop_id gets no ETag at all.
+        """
+
+        shop_id = self.product_infos[0].shop_id
+        url = f"{reverse('backend:shops')}?shop_id={shop_id}"
+        response, _ = self.get(url)
+        etag = response['ETag']
+        self.client.force_authenticate(self.partner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('backend:partner-stock'), {'items': [[0, 90, 110, 5]]}, format='json')
+        response, _ = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['price'], 90)
+
+        response, _ = self.get(f'{url}&shop_id={shop_id + 1}', etag)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('ETag', response)
+
+    def test_basket_and_orders_not_modified(self):
+        """
+        Tests that basket and order lists answer 304 until an item is added or the order is confirmed.
+        """
+
+        self.client.force_authenticate(self.buyer)
+        response, _ = self.get('/api/v1/basket')
+        etag = response['ETag']
+        response, queries = self.get('/api/v1/basket', etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, [])
+
+        self.client.post('/api/v1/basket', {'items': [{'product_info': self.product_infos[1].id, 'quantity': 1}]},
+                         format='json')
+        response, _ = self.get('/api/v1/basket', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()[0]['ordered_items']), 2)
+
+        response, _ = self.get('/api/v1/order')
+        etag = response['ETag']
+        self.assertEqual(self.get('/api/v1/order', etag)[0].status_code, 304)
+        contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+79990000000')
+        with patch('backend.views.new_order.send'):
+            self.client.post('/api/v1/order', {'order_id': Order.objects.get(user=self.buyer).id,
+                                               'contact_id': contact.id}, format='json')
+        self.assertEqual(self.get('/api/v1/order', etag)[0].status_code, 200)
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list into an active shop.
+        """
+
+        # /products responses are cached in Redis, which is not rolled back with the database
+        cache.clear()
+        self.shop = Shop.objects.create(name='Связной', state=True)
+        self.client = APIClient()
+        self.run_import(SHOP_FEED.read_bytes())
+
+    def run_import(self, content):
+        with transaction.atomic():
+            feed = YamlFeed(io.BytesIO(content))
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+            importer.delete_missing()
+
+    def search(self, **params):
+        response = self.client.get(reverse('backend:shops'), params)
+        return [product['product']['name'] for product in response.json()['results']]
+
+    def test_ranked_prefix_and_multiword_search(self):
+        """
+        Tests that every word must match by prefix, that name matches rank
+        above parameter matches and that field filters search their column only.
+        """
+
+        self.assertEqual(self.search(q='iphone 512'), ['Смартфон Apple iPhone XS Max 512GB (золотистый)'])
+        # the category «Смартфоны» matches too, but ranks below the names
+        self.assertEqual([name.split()[0] for name in self.search(q='смартф')][:4], ['Смартфон'] * 4)
+        self.assertEqual(self.search(q='samsung galax'), ['Smartphone Samsung Galaxy S20 128GB (black)',
+                                                          'Smartphone Samsung Galaxy Note20 256GB (mystic bronze)'])
+        self.assertEqual(self.search(q='красный')[0], 'Смартфон Apple iPhone XR 256GB (красный)')
+        self.assertEqual(len(self.search(model='xr')), 3)
+        self.assertEqual(self.search(category_name='телевиз', product_name='sony'),
+                         ['Sony Bravia X900H 75" 4K UHD Smart TV'])
+        self.assertEqual(self.search(q='"OR* nothing'), [])
+
+    def test_index_follows_import(self):
+        """
+        Tests that renamed goods are found by the new name and goods removed
+        from the price list disappear from the index.
+        """
+
+        content = SHOP_FEED.read_text(encoding='utf-8')
+        content = content.replace('Sony Bravia X900H', 'Sony Bravia Z9')
+        start = content.index('  - id: 4216292')
+        end = content.index('  - id: 4216313')
+        self.run_import((content[:start] + content[end:]).encode())
+
+        self.assertEqual(self.search(q='bravia z9'), ['Sony Bravia Z9 75" 4K UHD Smart TV'])
+        self.assertEqual(self.search(product_name='x900h'), [])
+        self.assertEqual(self.search(q='iphone 512'), [])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM backend_productsearch')
+            self.assertEqual(cursor.fetchone()[0], ProductInfo.objects.count())
+
+    def test_orm_deletes_leave_index(self):
+        """
+        Tests that goods deleted without the search backend, by a cascade from
+        the shop or a queryset delete, leave no rows in the index.
+        """
+
+        ProductInfo.objects.filter(product__name__icontains='iphone').delete()
+        self.assertEqual(self.search(q='iphone'), [])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM backend_productsearch')
+            self.assertEqual(cursor.fetchone()[0], ProductInfo.objects.count())
+            self.shop.delete()
+            cursor.execute('SELECT count(*) FROM backend_productsearch')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_search_pages(self):
+        """
+        Tests that ranked results are paginated with a cursor without repeats.
+        """
+
+        url = reverse('backend:shops') + '?q=smart&limit=2'
+        seen = []
+        while url:
+            response = self.client.get(url).json()
+            seen.extend(product['id'] for product in response['results'])
+            url = response['next']
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(sorted(seen), sorted(self.client.get(reverse('backend:shops'), {'q': 'smart', 'limit': 100})
+                                              .json()['results'][i]['id'] for i in range(len(seen))))
+
+
+class ParameterFacetsTestCase(TestCase):
+    def setUp(self):
+        """
+        Import the sample price list into an active shop and build its facet index.
+        """
+
+        # /products responses are cached in Redis, which is not rolled back with the database
+        cache.clear()
+        self.shop = Shop.objects.create(name='Связной', state=True)
+        with transaction.atomic(), open(SHOP_FEED, 'rb') as file:
+            feed = YamlFeed(file)
+            importer = CatalogImporter(self.shop)
+            importer.import_categories(feed.categories)
+            importer.import_goods(feed.goods())
+        build_facets(self.shop.id)
+        self.addCleanup(cache.delete, facet_key(self.shop.id))
+        self.client = APIClient()
+
+    def get(self, **params):
+        return self.client.get(reverse('backend:shops'), {'limit': 100, 'facets': 'true', **params}).json()
+
+    def test_parameter_filters_and_counts(self):
+        """
+        Tests that values of one parameter are combined with OR, different
+        parameters with AND, and that each parameter's counts ignore its own filter.
+        """
+
+        response = self.get()
+        self.assertEqual(response['facets']['Цвет']['черный'],
+                         ProductParameter.objects.filter(parameter__name='Цвет', value='черный').count())
+
+        response = self.get(param=['Встроенная память (Гб):256', 'Встроенная память (Гб):512', 'Цвет:красный'])
+        self.assertEqual([product['product']['name'] for product in response['results']],
+                         ['Смартфон Apple iPhone XR 256GB (красный)'])
+        self.assertEqual(response['facets']['Встроенная память (Гб)'], {'256': 1})
+        self.assertEqual(response['facets']['Цвет']['красный'], 1)
+        self.assertEqual(response['facets']['Цвет']['золотистый'], 1)
+
+        response = self.get(category_id=224, param='Цвет:черный')
+        self.assertTrue(response['results'])
+        self.assertTrue(all(product['product']['category'] == 'Смартфоны' for product in response['results']))
+        self.assertEqual(sum(response['facets']['Цвет'].values()), ProductParameter.objects.filter(
+            parameter__name='Цвет', product_info__product__category_id=224).count())
+
+    def test_narrowed_counts_match_index(self):
+        """
+        Tests that counts for a narrowed listing come from grouped queries, one
+        per filtered parameter and one for the rest, and match the index counts.
+        """
+
+        filters = parse_parameter_filters(['Цвет:черный', 'Цвет:красный', 'Встроенная память (Гб):256'])
+        self.assertEqual(count_facets(CatalogEntry.objects.filter(shop_state=True), filters),
+                         facet_counts([self.shop.id], filters))
+
+        with cachalot_disabled(), CaptureQueriesContext(connection) as captured:
+            response = self.get(category_id=224, param=['Цвет:черный', 'Встроенная память (Гб):256'])
+        self.assertEqual(len([query for query in captured if query['sql'].startswith('SELECT')
+                              and 'backend_productparameter' in query['sql']
+                              and 'GROUP BY' in query['sql']]), 3)
+        self.assertTrue(response['facets'])
+
+        response = self.get(q='iphone', param='Цвет:красный')
+        self.assertEqual(sum(response['facets']['Цвет'].values()), len(self.get(q='iphone')['results']))
+
+    def test_invalid_filter(self):
+        """
+        Tests that a filter without a name and value separator is rejected.
+        """
+
+        response = self.client.get(reverse('backend:shops'), {'param': 'Цвет'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_is_rebuilt_after_import(self):
+        """
+        Tests that finishing an import refreshes the cached facet index.
+        """
+
+        ProductParameter.objects.filter(parameter__name='Цвет', value='черный').update(value='графит')
+        with self.captureOnCommitCallbacks(execute=True):
+            finish_import([], ImportJob.objects.create(user=User.objects.create_user(
+                'shop@example.com', 'testpassword', type='shop', is_active=True), shop=self.shop).id, {}, False,
+                {'stats': {'parsed': 0, 'inserted': 0, 'updated': 0, 'deleted': 0},
+                 'seen': list(ProductInfo.objects.values_list('id', flat=True))})
+        self.assertIn('графит', self.get()['facets']['Цвет'])
+
+    def test_numeric_range_filters(self):
+        """
+        Tests that numeric parameter values are stored on import and that
+        param_min/param_max select products whose value falls into the range.
+        """
+
+        diagonal = ProductParameter.objects.filter(parameter__name='Диагональ (дюйм)')
+        self.assertEqual(diagonal.filter(value='6.5').values_list('numeric_value', flat=True).first(), 6.5)
+        self.assertIsNone(ProductParameter.objects.filter(parameter__name='Разрешение (пикс)').values_list(
+            'numeric_value', flat=True).first())
+
+        response = self.get(param_min='Диагональ (дюйм):6', param_max='Диагональ (дюйм):6.2')
+        expected = set(diagonal.filter(value='6.1').values_list('product_info_id', flat=True))
+        self.assertTrue(expected)
+        self.assertEqual({product['id'] for product in response['results']}, expected)
+        self.assertEqual(sum(response['facets']['Диагональ (дюйм)'].values()), len(expected))
+
+        response = self.client.get(reverse('backend:shops'), {'param_min': 'Диагональ (дюйм):шесть'})
+        self.assertEqual(response.status_code, 400)
@@ -1,6 +1,6 @@
 from django.urls import path
-from backend.views import BasketView, ConfirmToken, ContactView,\
-LoginAccount, OrderView, PartnerOrders, PartnerState, PartnerUpdate, ProductInfoView, RegisterAccount
+from backend.views import BasketView, CategoryView, ConfirmToken, ContactView,\
+LoginAccount, OrderView, PartnerImports, PartnerExport, PartnerOrders, PartnerState, PartnerStock, PartnerUpdate, PartnerUpload, ProductBestOfferView, ProductInfoView, ProductSuggestView, RegisterAccount
 
 from django_rest_passwordreset.views import reset_password_request_token, reset_password_confirm
 
@@ -10,6 +10,10 @@ app_name = 'backend'
 
 urlpatterns = [
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/upload', PartnerUpload.as_view(), name='partner-upload'),
+    path('partner/stock', PartnerStock.as_view(), name='partner-stock'),
+    path('partner/export', PartnerExport.as_view(), name='partner-export'),
+    path('partner/imports', PartnerImports.as_view(), name='partner-imports'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('user/login', LoginAccount.as_view(), name='user-login'),
@@ -18,6 +22,9 @@ urlpatterns = [
     path('user/password_reset', reset_password_request_token, name='password-reset'),
     path('user/password_reset/confirm', reset_password_confirm, name='password-reset-confirm'),
     path('products', ProductInfoView.as_view(), name='shops'),
+    path('products/best', ProductBestOfferView.as_view(), name='products-best'),
+    path('products/suggest', ProductSuggestView.as_view(), name='products-suggest'),
+    path('categories', CategoryView.as_view(), name='categories'),
     path('basket', BasketView.as_view(), name='basket'),
     path('contact', ContactView.as_view(), name='contact'),
     path('order', OrderView.as_view(), name='order'),
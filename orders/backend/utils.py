@@ -0,0 +1,46 @@
+import json
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    Разбивает поток на пакеты
+    :param iterable: исходный поток
+    :param size: размер пакета
+    :return: генератор списков длиной не больше size
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_json_array(items):
+    """
+    Отдает JSON-массив по частям, по элементу за раз, в том же виде, что и JSONRenderer DRF
+    :param items: поток элементов
+    :return: генератор байтовых строк
+    """
+    separator = b'['
+    for item in items:
+        yield separator + json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode()
+        separator = b','
+    yield b']' if separator == b',' else b'[]'
+
+
+def int_params(params, names):
+    """
+    Целочисленные параметры запроса
+    :param params: QueryDict параметров запроса
+    :param names: имена параметров
+    :return: словарь имя -> число для переданных параметров
+    :raises ValueError: если значение не целое неотрицательное число или параметр указан несколько раз
+    """
+    values = {}
+    for name in names:
+        if name in params:
+            if len(params.getlist(name)) > 1:
+                raise ValueError(f'{name} должен быть указан один раз')
+            if not params[name].isdigit():
+                raise ValueError(f'{name} должен быть целым неотрицательным числом')
+            values[name] = int(params[name])
+    return values
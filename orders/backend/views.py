@@ -1,24 +1,41 @@
 # from django.shortcuts import render
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.forms import ValidationError
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from requests import get
 from rest_framework.views import APIView
 from django.core.validators import URLValidator
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
-from backend.models import STATE_CHOICES, Category, Contact, Order, OrderItem, Parameter, Product, ProductInfo, ProductParameter, Shop, ConfirmEmailToken
-from backend.serializers import ContactSerializer, OrderItemSerializer, OrderSerializer, ProductInfoSerializer, ShopSerializer, UserSerializer
+from backend.models import STATE_CHOICES, BestOffer, CatalogEntry, Category, CategoryCount, Contact, ImportJob, Order, OrderItem, Parameter, Product, ProductParameter, Shop, ConfirmEmailToken
+from backend.serializers import ContactSerializer, ImportJobSerializer, OrderItemSerializer, OrderSerializer, ShopSerializer, UserSerializer
 from backend.signals import new_user_registered, new_order
 from django.contrib.auth.password_validation import validate_password
 from rest_framework.request import Request
 from rest_framework.response import Response
-from django.db.models import Q, Sum, F
+from django.db.models import Q
 from distutils.util import strtobool
 from .tasks import create_thumbnail, do_import
-from backend.schema import BasketAddResponse, BasketAddUpdateRequest, BasketDeleteResponse, BasketUpdateResponse,\
-    ContactRequest, ContactResponse, LoginAccountRequest, LoginAccountResponse, OrderConfirmRequest, OrderResponse, OrderUpdateRequest,\
-    PartnerStateRequest, PartnerStateResponse, PartnerUpdateRequest, PartnerUpdateResponse, RegisterAccountRequest, RegisterAccountResponse
+from backend.feeds import FEED_FORMATS, FeedTooLarge, iter_feed, store_feed
+from backend.catalog import catalog_version, listing_cache_key, shop_state_changed
+from backend.facets import count_facets, facet_counts, filter_by_parameters, filter_by_ranges, parse_parameter_filters, \
+    parse_range_filters
+from backend.importer import export_categories, export_goods, export_parameters, parse_stock, update_stock
+from backend.etags import make_etag, not_modified, orders_etag
+from backend.jobs import ImportJobTracker
+from backend.payloads import BEST_OFFER_VALUES, best_offer_payload, catalog_payload, category_payload, catalog_values, iter_order_payloads, order_payload, parse_fieldset, \
+    with_total_sum
+from backend.pagination import ProductCursorPagination, ProductSearchPagination
+from backend.utils import int_params, iter_json_array
+from backend.search import get_search_backend, search_terms
+from backend.suggest import suggest_index
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from backend.schema import FIELDSET_PARAMETERS, BasketAddResponse, BestOfferPageResponse, CategoryResponse, ProductSuggestResponse, BasketAddUpdateRequest, BasketDeleteResponse, BasketUpdateResponse,\
+    ContactRequest, ContactResponse, LoginAccountRequest, LoginAccountResponse, OrderConfirmRequest, OrderResponse, OrderUpdateRequest, ProductInfoPageResponse,\
+    PartnerStateRequest, PartnerStateResponse, PartnerUpdateRequest, PartnerUpdateResponse, PartnerUploadRequest, PartnerStockRequest, PartnerStockResponse, RegisterAccountRequest, RegisterAccountResponse
 
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
@@ -146,11 +163,224 @@ class PartnerUpdate(APIView):
             except ValidationError as e:
                 return JsonResponse({'Status': False, 'Error': str(e)})
             else:
-                result = do_import.delay(url, request.user.id)
-                return JsonResponse({'Status': True})
+                job = ImportJob.objects.create(user=request.user, url=url)
+                do_import.delay(url, request.user.id, job_id=job.id)
+                return JsonResponse({'Status': True, 'job_id': job.id})
             
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'}, json_dumps_params={'ensure_ascii': False})                 
 
+class PartnerUpload(APIView):
+    """
+    Класс для загрузки файла прайса поставщиком вместо ссылки
+    """
+    @extend_schema(request={'multipart/form-data': PartnerUploadRequest,
+                            'application/octet-stream': OpenApiTypes.BINARY},
+                   parameters=[OpenApiParameter(name='filename', type=OpenApiTypes.STR,
+                                                location=OpenApiParameter.QUERY,
+                                                description='имя файла для тела запроса без multipart, '
+                                                            'по расширению определяется формат')],
+                   responses={'200:': PartnerUpdateResponse},
+                   tags=['PartnerUpdate'])
+    def post(self, request):
+        """
+        Store an uploaded price list and start its import.
+
+        The file is sent either as the `file` field of a multipart form or as the raw request body.
+        It is written to storage in chunks, and a gzip-compressed file is unpacked on the fly.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - {'Status': True, 'job_id': <id>}: The import job that processes the file.
+        - {'Status': False, 'Error': 'Прайс больше допустимого размера'}: If the file exceeds FEED_UPLOAD_MAX_SIZE.
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Необходима авторизация'}, status=403, json_dumps_params={'ensure_ascii': False})
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403, json_dumps_params={'ensure_ascii': False})
+
+        if int(request.META.get('CONTENT_LENGTH') or 0) > settings.FEED_UPLOAD_MAX_SIZE:
+            return JsonResponse({'Status': False, 'Error': 'Прайс больше допустимого размера'}, status=413,
+                                json_dumps_params={'ensure_ascii': False})
+
+        if request.content_type.startswith('multipart/form-data'):
+            file = request.FILES.get('file')
+            if file is None:
+                return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
+                                    json_dumps_params={'ensure_ascii': False})
+            chunks, filename, content_type = file.chunks(settings.FEED_CHUNK_SIZE), file.name, file.content_type
+        else:
+            stream = request.stream
+            if stream is None:
+                return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
+                                    json_dumps_params={'ensure_ascii': False})
+            chunks = iter(lambda: stream.read(settings.FEED_CHUNK_SIZE), b'')
+            filename, content_type = request.query_params.get('filename', ''), request.content_type
+
+        try:
+            upload = store_feed(chunks, filename)
+        except FeedTooLarge as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=413, json_dumps_params={'ensure_ascii': False})
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+        upload['content_type'] = content_type
+
+        job = ImportJob.objects.create(user=request.user)
+        do_import.delay('', request.user.id, job_id=job.id, upload=upload)
+        return JsonResponse({'Status': True, 'job_id': job.id})
+
+class PartnerStock(APIView):
+    """
+    Класс для быстрого обновления цен и остатков поставщиком без загрузки прайса
+    """
+    @extend_schema(request=PartnerStockRequest,
+                   responses={'200:': PartnerStockResponse},
+                   tags=['PartnerUpdate'])
+    def post(self, request):
+        """
+        Update price, recommended price and quantity of the partner's goods.
+
+        Args:
+        - request (Request): The Django request object. `items` is a list of
+          [external_id, price, price_rrc, quantity] or objects with these keys.
+
+        Returns:
+        - {'Status': True, 'updated': <n>, 'unchanged': <n>, 'not_found': [<external_id>, ...]}
+        - {'Status': False, 'Error': 'Магазин не найден'}: If the partner has not imported a price list yet.
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Необходима авторизация'}, status=403, json_dumps_params={'ensure_ascii': False})
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403, json_dumps_params={'ensure_ascii': False})
+
+        items = request.data.get('items')
+        if not items:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
+                                json_dumps_params={'ensure_ascii': False})
+        # размер проверяется до разбора строк, поэтому сначала нужно убедиться, что это список
+        if not isinstance(items, list):
+            return JsonResponse({'Status': False, 'Error': 'items должен быть списком'}, status=400,
+                                json_dumps_params={'ensure_ascii': False})
+        if len(items) > settings.STOCK_UPDATE_MAX_ITEMS:
+            return JsonResponse({'Status': False, 'Error': f'Не больше {settings.STOCK_UPDATE_MAX_ITEMS} строк за запрос'},
+                                status=413, json_dumps_params={'ensure_ascii': False})
+        try:
+            stock = parse_stock(items)
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if shop is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=404,
+                                json_dumps_params={'ensure_ascii': False})
+        with transaction.atomic():
+            result = update_stock(shop.id, stock)
+        return JsonResponse({'Status': True, **result})
+
+EXPORT_CONTENT_TYPES = {
+    'yaml': 'application/x-yaml; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+class PartnerExport(APIView):
+    """
+    Класс для выгрузки текущего каталога поставщика в формате прайса
+    """
+    @extend_schema(parameters=[OpenApiParameter(name='type', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+                                                enum=sorted(FEED_FORMATS), description='формат выгрузки, по умолчанию yaml')],
+                   responses={(200, 'application/octet-stream'): OpenApiTypes.BINARY},
+                   tags=['PartnerUpdate'])
+    def get(self, request):
+        """
+        Stream the partner's catalog in the same shape that do_import accepts.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - StreamingHttpResponse: The price list, written row by row as the catalog is read.
+        - {'Status': False, 'Error': 'Магазин не найден'}: If the partner has not imported a price list yet.
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Необходима авторизация'}, status=403, json_dumps_params={'ensure_ascii': False})
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403, json_dumps_params={'ensure_ascii': False})
+
+        feed_format = request.query_params.get('type', 'yaml')
+        if feed_format not in EXPORT_CONTENT_TYPES:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'},
+                                json_dumps_params={'ensure_ascii': False})
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if shop is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=404,
+                                json_dumps_params={'ensure_ascii': False})
+
+        parameters = export_parameters(shop.id) if feed_format == 'csv' else None
+        response = StreamingHttpResponse(
+            iter_feed(feed_format, shop.name, export_categories(shop.id), export_goods(shop.id), parameters),
+            content_type=EXPORT_CONTENT_TYPES[feed_format])
+        response['Content-Disposition'] = f'attachment; filename="shop-{shop.id}.{feed_format}"'
+        return response
+
+class PartnerImports(APIView):
+    """
+    Класс для просмотра хода и итогов импорта прайсов
+    """
+
+    @extend_schema(parameters=[OpenApiParameter(name='id', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+                                                description='id импорта, возвращенный partner/update')],
+                   responses={'200:': ImportJobSerializer(many=True)},
+                   tags=['PartnerImports'])
+    def get(self, request):
+        """
+        Retrieve the import jobs of the authenticated partner.
+
+        Counters of running jobs are read from the cache, so they show the progress of the import.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - Response: The list of import jobs, or a single job if the id query parameter is given.
+        - {'Status': False, 'Error': 'Необходима авторизация'}: If the user is not authenticated.
+        - {'Status': False, 'Error': 'Только для магазинов'}: If the user is not a shop.
+        - {'Status': False, 'Error': 'Импорт не найден'}: If there is no such job.
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Необходима авторизация'},\
+                status=403, json_dumps_params={'ensure_ascii': False})
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'},\
+                status=403, json_dumps_params={'ensure_ascii': False})
+
+        jobs = ImportJob.objects.filter(user_id=request.user.id)
+        job_id = request.query_params.get('id')
+        if job_id:
+            if not job_id.isdigit():
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'},
+                                    json_dumps_params={'ensure_ascii': False})
+            jobs = jobs.filter(id=job_id)
+            if not jobs:
+                return JsonResponse({'Status': False, 'Error': 'Импорт не найден'},
+                                    status=404, json_dumps_params={'ensure_ascii': False})
+        else:
+            jobs = jobs[:settings.IMPORT_JOBS_LIMIT]
+
+        jobs = list(jobs)
+        for job in jobs:
+            if job.state == 'running':
+                ImportJobTracker(job.id).apply(job)
+        serializer = ImportJobSerializer(jobs, many=True)
+        return Response(serializer.data[0] if job_id else serializer.data)
+
 class PartnerOrders(APIView):
     """
     Класс для получения заказов поставщиками
@@ -161,7 +391,8 @@ class PartnerOrders(APIView):
     - None
     """
 
-    @extend_schema(responses={'200:': OrderSerializer(many=True)},
+    @extend_schema(parameters=FIELDSET_PARAMETERS,
+                   responses={'200:': OrderSerializer(many=True)},
                    tags=['PartnerOrders'])
     def get(self, request):
         """
@@ -171,7 +402,7 @@ class PartnerOrders(APIView):
         - request (Request): The Django request object.
 
         Returns:
-        - Response: The response containing the orders associated with the partner.
+        - StreamingHttpResponse: The orders associated with the partner as a JSON array, written in chunks.
         - {'Status': False, 'Error': 'Необходима авторизация'}: If the user is not authenticated.
         - {'Status': False, 'Error': 'Только для магазинов'}: If the user is not a shop.
         """
@@ -183,14 +414,22 @@ class PartnerOrders(APIView):
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'},\
                 status=403, json_dumps_params={'ensure_ascii': False})
         
+        try:
+            fields, expand = parse_fieldset(request.query_params)
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
         order = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+            ordered_items__product_info__shop__user_id=request.user.id).exclude(state='basket')
+        etag = orders_etag(order, 'partner-orders', request.user.id, fields, sorted(expand))
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        response = StreamingHttpResponse(iter_json_array(iter_order_payloads(order, fields, expand)),
+                                         content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
 class PartnerState(APIView):
     """
@@ -253,7 +492,11 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                state = bool(strtobool(state))
+                with transaction.atomic():
+                    shops = Shop.objects.filter(user_id=request.user.id)
+                    shops.update(state=state)
+                    shop_state_changed(list(shops.values_list('id', flat=True)), state)
                 return JsonResponse({'Status': True})
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': 'Неправильно указан статус'})
@@ -276,9 +519,23 @@ class ProductInfoView(APIView):
         OpenApiParameter('category_id', OpenApiTypes.INT, required=False),
         OpenApiParameter('category_name', OpenApiTypes.STR, required=False),
         OpenApiParameter('product_name', OpenApiTypes.STR, required=False),
-        OpenApiParameter('model', OpenApiTypes.STR, required=False)
+        OpenApiParameter('model', OpenApiTypes.STR, required=False),
+        OpenApiParameter('q', OpenApiTypes.STR, required=False,
+                         description='поиск по названию, модели, категории и параметрам: все слова, по началу слова'),
+        OpenApiParameter('param', OpenApiTypes.STR, required=False, many=True,
+                         description='фильтр по параметру "название:значение", можно указать несколько раз: '
+                                     'значения одного параметра объединяются через ИЛИ, разных — через И'),
+        OpenApiParameter('param_min', OpenApiTypes.STR, required=False, many=True,
+                         description='нижняя граница числового параметра "название:число"'),
+        OpenApiParameter('param_max', OpenApiTypes.STR, required=False, many=True,
+                         description='верхняя граница числового параметра "название:число"'),
+        OpenApiParameter('facets', OpenApiTypes.BOOL, required=False,
+                         description='добавить в ответ число товаров по значениям параметров'),
+        OpenApiParameter('cursor', OpenApiTypes.STR, required=False, description='курсор из ссылки next или previous'),
+        OpenApiParameter('limit', OpenApiTypes.INT, required=False, description='размер страницы'),
+        *FIELDSET_PARAMETERS,
         ],
-                   responses={'200:': ProductInfoSerializer(many=True)},
+                   responses={'200:': ProductInfoPageResponse},
                    tags=['ProductInfoView'])
     def get(self, request: Request):
         """
@@ -288,41 +545,242 @@ class ProductInfoView(APIView):
         - request (Request): The Django request object.
 
         Returns:
-        - Response: The response containing the product information.
+        - Response: One page of the product information ordered by id (by relevance for searches), with
+          `next` and `previous` links that carry the cursor.
+        - {'Status': False, 'Error': 'shop_id должен быть целым неотрицательным числом'}: If shop_id or
+          category_id is not a number or is given more than once.
         """
-        query = Q(shop__state=True)
+        try:
+            ids = int_params(request.query_params, ('shop_id', 'category_id'))
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+        shop_id = ids.get('shop_id')
+
+        # ключ берется до чтения каталога: если импорт закончится во время запроса,
+        # ответ попадет в кэш под старой версией и читаться больше не будет;
+        # версия в ключе — того же магазина, по которому фильтруется выдача
+        cache_key = listing_cache_key(request.query_params, shop_id, request.build_absolute_uri(request.path))
+        etag = make_etag(cache_key)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        data = cache.get(cache_key)
+        if data is not None:
+            response = Response(data)
+            response['ETag'] = etag
+            patch_cache_control(response, no_cache=True)
+            return response
+
+        query = Q(shop_state=True)
         params = dict(request.query_params)
         
-        if 'shop_id' in params:
-            query &= Q(shop_id=params['shop_id'][0])
+        if shop_id is not None:
+            query &= Q(shop_id=shop_id)
 
-        if 'category_id' in params:
-            query &= Q(product__category_id=params['category_id'][0])
-            
-        if 'category_name' in params:            
-            query &= Q(product__category__name__contains=params['category_name'][0])
-            
-        if 'product_name' in params:
-            query &= Q(product__name__contains=params['product_name'][0])
+        if 'category_id' in ids:
+            query &= Q(category_id=ids['category_id'])
             
-        if 'model' in params:
-            query &= Q(model__contains=params['model'][0])
+        # выдача читается из одной таблицы CatalogEntry, где у каждого предложения уже есть статус магазина,
+        # названия и параметры: без join и prefetch страница выбирается по индексу (shop_state, ..., id)
+        queryset = CatalogEntry.objects.filter(query)
+
+        # поиск по названию, модели, категории и параметрам идет по индексу, а не LIKE '%...%'
+        paginator = ProductCursorPagination()
+        terms = search_terms({param: values[0] for param, values in params.items()})
+        if terms:
+            search_backend = get_search_backend()
+            queryset = search_backend.search(queryset, terms)
+            if search_backend.ranked:
+                paginator = ProductSearchPagination()
+
+        try:
+            parameter_filters = parse_parameter_filters(request.query_params.getlist('param'))
+            ranges = parse_range_filters(request.query_params.getlist('param_min'),
+                                         request.query_params.getlist('param_max'))
+            fields, _ = parse_fieldset(request.query_params)
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+        queryset = filter_by_ranges(queryset, ranges)
+        filtered = filter_by_parameters(queryset, parameter_filters)
+
+        # страница читается через values() только по запрошенным полям и собирается без моделей
+        # и CatalogEntrySerializer, для курсора по релевантности в строках нужен search_rank
+        values = catalog_values(fields) + (('search_rank',) if isinstance(paginator, ProductSearchPagination) else ())
+        page = paginator.paginate_queryset(filtered.values(*values), request, view=self)
+        response = paginator.get_paginated_response(catalog_payload(page, fields))
+
+        if request.query_params.get('facets', '').lower() in ('1', 'true', 'yes'):
+            # без поиска, категории и диапазонов счетчики берутся из обратного индекса параметров магазинов,
+            # для суженной выдачи их считает база сгруппированным запросом по подходящим товарам
+            if terms or ranges or 'category_id' in ids:
+                response.data['facets'] = count_facets(queryset, parameter_filters)
+            else:
+                shop_ids = Shop.objects.filter(state=True).values_list('id', flat=True)
+                if shop_id is not None:
+                    shop_ids = shop_ids.filter(id=shop_id)
+                response.data['facets'] = facet_counts(list(shop_ids), parameter_filters)
+        cache.set(cache_key, response.data, settings.PRODUCTS_CACHE_TIMEOUT)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
 
-        # фильтруем и отбрасываем дубликаты
-        queryset = ProductInfo.objects.filter(
-            query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+class CategoryView(APIView):
+    """
+    A class for listing categories.
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+    Methods:
+    - get: Retrieve the categories with their shops and in-stock offer counts.
+
+    Attributes:
+    - None
+    """
+    @extend_schema(parameters=[OpenApiParameter('shop_id', OpenApiTypes.INT, required=False)],
+                   responses={'200:': CategoryResponse(many=True)},
+                   tags=['ProductInfoView'])
+    def get(self, request: Request):
+        """
+        Retrieve the categories with the shops that accept orders and the number of offers in stock per shop.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - Response: The categories ordered by name, each with its total offer count and the counts per shop.
+        - {'Status': False, 'Error': 'shop_id должен быть целым неотрицательным числом'}: If shop_id is not a number.
+        """
+        try:
+            params = int_params(request.query_params, ('shop_id',))
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+
+        # числа меняются только вместе с версией каталога: после импорта и обновления остатков
+        etag = make_etag('categories', catalog_version(), request.get_full_path())
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        # числа предложений читаются из CategoryCount, которую пересчитывает импорт, а не COUNT по товарам
+        categories = Category.objects.order_by('name', 'id')
+        counts = CategoryCount.objects.filter(shop__state=True)
+        if 'shop_id' in params:
+            counts = counts.filter(shop_id=params['shop_id'])
+            categories = categories.filter(shop_counts__shop_id=params['shop_id'])
+        response = Response(category_payload(
+            categories.values('id', 'name'),
+            counts.order_by('category_id', 'shop_id').values_list('category_id', 'shop_id', 'shop__name', 'offer_count')))
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class ProductSuggestView(APIView):
+    """
+    A class for search box suggestions.
+
+    Methods:
+    - get: Retrieve the products whose name or model has a word starting with the typed text.
+
+    Attributes:
+    - None
+    """
+    @extend_schema(parameters=[
+        OpenApiParameter('q', OpenApiTypes.STR, required=True, description='введенная строка'),
+        OpenApiParameter('shop_id', OpenApiTypes.INT, required=False),
+        OpenApiParameter('limit', OpenApiTypes.INT, required=False, description='число подсказок'),
+        ],
+                   responses={'200:': ProductSuggestResponse},
+                   tags=['ProductInfoView'])
+    def get(self, request: Request):
+        """
+        Retrieve search box suggestions from the in-memory prefix index.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - Response: The products whose name or model has a word starting with `q`, ordered by the matched text.
+        - {'Status': False, 'Error': 'shop_id и limit должны быть числами, limit — больше нуля'}: If shop_id or limit
+          is not a number or limit is not positive.
+        """
+        try:
+            shop_id = int(request.query_params['shop_id']) if 'shop_id' in request.query_params else None
+            limit = int(request.query_params.get('limit', settings.SUGGEST_LIMIT))
+            if limit < 1:
+                raise ValueError(limit)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Error': 'shop_id и limit должны быть числами, limit — больше нуля'},
+                                status=400, json_dumps_params={'ensure_ascii': False})
+
+        # подсказки ищутся в отсортированных ключах в памяти процесса, база читается только
+        # при перестройке индекса после смены версии каталога
+        return Response({'suggestions': suggest_index.suggest(request.query_params.get('q', ''), shop_id, limit)})
+
+
+class ProductBestOfferView(APIView):
+    """
+    A class for listing the cheapest in-stock offer of each product across shops.
+
+    Methods:
+    - get: Retrieve the best offers based on the specified filters.
+
+    Attributes:
+    - None
+    """
+    @extend_schema(parameters=[
+        OpenApiParameter('category_id', OpenApiTypes.INT, required=False),
+        OpenApiParameter('product_id', OpenApiTypes.INT, required=False),
+        OpenApiParameter('cursor', OpenApiTypes.STR, required=False, description='курсор из ссылки next или previous'),
+        OpenApiParameter('limit', OpenApiTypes.INT, required=False, description='размер страницы'),
+        ],
+                   responses={'200:': BestOfferPageResponse},
+                   tags=['ProductInfoView'])
+    def get(self, request: Request):
+        """
+        Retrieve the best offer of each product: the cheapest offer in stock among the shops that accept orders,
+        with the number of such offers.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - Response: One page of the best offers ordered by product id, with `next` and `previous` links that
+          carry the cursor.
+        - {'Status': False, 'Error': 'category_id должен быть целым неотрицательным числом'}: If category_id or
+          product_id is not a number.
+        """
+        try:
+            params = int_params(request.query_params, ('category_id', 'product_id'))
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+
+        # лучшие предложения зависят от всех магазинов, поэтому ETag строится из общей версии каталога
+        etag = make_etag('best-offers', catalog_version(), request.get_full_path())
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        # выдача читается только из BestOffer, которую backend.catalog обновляет при импорте,
+        # обновлении остатков и смене статуса магазина
+        queryset = BestOffer.objects.all()
+        if 'category_id' in params:
+            queryset = queryset.filter(category_id=params['category_id'])
+        if 'product_id' in params:
+            queryset = queryset.filter(id=params['product_id'])
+
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(queryset.values(*BEST_OFFER_VALUES), request, view=self)
+        response = paginator.get_paginated_response(best_offer_payload(page))
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
 
-        return Response(serializer.data)
-    
 class BasketView(APIView):
     """
     Класс для работы с корзиной пользователя
     """
-    @extend_schema(responses={'200:': OrderSerializer(many=True)},
+    @extend_schema(parameters=FIELDSET_PARAMETERS,
+                   responses={'200:': OrderSerializer(many=True)},
                    tags=['BasketView'])
     def get(self, request):
         """
@@ -337,14 +795,20 @@ class BasketView(APIView):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Необходима авторизация'}, status=403, json_dumps_params={'ensure_ascii': False})
         
-        basket = Order.objects.filter(
-            user_id=request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        try:
+            fields, expand = parse_fieldset(request.query_params)
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+        basket = Order.objects.filter(user_id=request.user.id, state='basket')
+        etag = orders_etag(basket, 'basket', request.user.id, fields, sorted(expand))
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        response = Response(order_payload(with_total_sum(basket), fields, expand))
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
     @extend_schema(request=BasketAddUpdateRequest(many=True),
                    responses={'200:': BasketAddResponse},
@@ -376,6 +840,7 @@ class BasketView(APIView):
                         return JsonResponse({'Status': False, 'Errors': str(error)}, json_dumps_params={'ensure_ascii': False})
                     else:
                         objects_created += 1
+                        Order.objects.filter(id=basket.id).update(updated=timezone.now())
                 else:
                     return JsonResponse({'Status': False, 'Errors': serializer.errors})
             return JsonResponse({'Status': True, 'objects_created': objects_created}, json_dumps_params={'ensure_ascii': False})
@@ -406,6 +871,8 @@ class BasketView(APIView):
                     if item:
                         item.delete()
                         deleted_count += 1
+                if deleted_count:
+                    Order.objects.filter(id=basket.id).update(updated=timezone.now())
             return JsonResponse({'Status': True, 'deleted_count': deleted_count}, json_dumps_params={'ensure_ascii': False})
         return JsonResponse({'Status': False, 'Errors': 'Нету данных'}, json_dumps_params={'ensure_ascii': False})
     
@@ -437,6 +904,8 @@ class BasketView(APIView):
                 if type(order_item['product_info']) == int and type(order_item['quantity']) == int:
                     objects_updated += OrderItem.objects.filter(order_id=basket.id, id=order_item['product_info']).update(
                         quantity=order_item['quantity'])
+            if objects_updated:
+                Order.objects.filter(id=basket.id).update(updated=timezone.now())
             return JsonResponse({'Status': True, 'objects_updated': objects_updated}, json_dumps_params={'ensure_ascii': False})
         return JsonResponse({'Status': False, 'Errors': 'Нету данных'}, json_dumps_params={'ensure_ascii': False})
 
@@ -549,6 +1018,8 @@ class ContactView(APIView):
                 serializer = ContactSerializer(contact, data=request.data, partial=True)
                 if serializer.is_valid():
                     serializer.save()
+                    # контакт отдается в заказах, их ETag должен измениться
+                    Order.objects.filter(contact_id=contact.id).update(updated=timezone.now())
                     return JsonResponse({'Status': True})
                 else:
                      return JsonResponse({'Status': False, 'Errors': serializer.errors})
@@ -558,6 +1029,7 @@ class OrderView(APIView):
     @extend_schema(parameters=[
         OpenApiParameter('id', OpenApiTypes.INT, required=False),
         OpenApiParameter('state', OpenApiTypes.STR, required=False),
+        *FIELDSET_PARAMETERS,
         ],
                    responses={'200:': OrderSerializer(many=True)},
                    tags=['OrderView'])
@@ -569,7 +1041,7 @@ class OrderView(APIView):
         - request (Request): The Django request object containing the query parameters.
 
         Returns:
-        - JsonResponse: The response containing the orders associated with the user.
+        - StreamingHttpResponse: The orders associated with the user as a JSON array, written in chunks.
         - {'Status': False, 'Error': 'Необходима авторизация'}: If the user is not authenticated.
         """
         if not request.user.is_authenticated:
@@ -584,13 +1056,21 @@ class OrderView(APIView):
         if 'state' in params:
             orders = orders.filter(state=params['state'][0])
             
-        orders = orders.prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        try:
+            fields, expand = parse_fieldset(request.query_params)
+        except ValueError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+        etag = orders_etag(orders, 'orders', request.user.id, params.get('id'), params.get('state'), fields,
+                           sorted(expand))
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        response = StreamingHttpResponse(iter_json_array(iter_order_payloads(orders, fields, expand)),
+                                         content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
     @extend_schema(request=OrderConfirmRequest,
                    responses={'200:': OrderResponse},
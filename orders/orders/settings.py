@@ -195,6 +195,70 @@ ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 
+# результаты задач нужны для сбора частей импорта в chord
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", CELERY_BROKER_URL)
+CELERY_RESULT_EXPIRES = 24 * 3600
+
+# интервал (сек) опроса прайсов магазинов через celery beat, 0 — опрос выключен
+FEED_POLL_INTERVAL = int(os.getenv("FEED_POLL_INTERVAL", 0))
+
+if FEED_POLL_INTERVAL:
+    CELERY_BEAT_SCHEDULE = {
+        'poll-shop-feeds': {
+            'task': 'backend.tasks.poll_shop_feeds',
+            'schedule': FEED_POLL_INTERVAL,
+        },
+    }
+
+# размер пакета bulk-операций при импорте прайса
+IMPORT_BATCH_SIZE = 1000
+
+# прайс длиннее IMPORT_CHUNK_SIZE товаров импортируется параллельными задачами,
+# части ждут обработки в кэше не дольше IMPORT_CHUNK_TIMEOUT секунд
+IMPORT_CHUNK_SIZE = 20000
+IMPORT_CHUNK_TIMEOUT = 24 * 3600
+# число задач, которые пишут части одновременно; SQLite пропускает одного писателя за раз,
+# и параллельные части ждали бы блокировку до ошибки database is locked, поэтому для нее части
+# пишутся по очереди одной задачей
+IMPORT_CHUNK_CONCURRENCY = int(os.getenv(
+    "IMPORT_CHUNK_CONCURRENCY", 1 if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3' else 4))
+# сколько последних импортов отдает partner/imports
+IMPORT_JOBS_LIMIT = 20
+
+# наибольший размер страницы /products, который можно запросить параметром limit
+PRODUCTS_MAX_PAGE_SIZE = 500
+
+# время жизни закэшированных страниц /products (сек); устаревшие страницы не читаются
+# раньше за счет версии каталога магазина в ключе, а время жизни ограничивает память
+PRODUCTS_CACHE_TIMEOUT = 300
+
+# подсказки строки поиска: число подсказок по умолчанию и наибольшее, и как часто (сек)
+# процесс сверяет версию каталога, чтобы перестроить индекс подсказок в памяти
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_CHECK_INTERVAL = 1
+
+# класс поиска товаров (backend.search.SearchBackend), по умолчанию FTS5 для SQLite и поиск без индекса для остальных баз
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "")
+
+# наибольшее число строк в одном запросе partner/stock
+STOCK_UPDATE_MAX_ITEMS = 10000
+
+# по сколько заказов читается из базы при потоковой выдаче списков заказов
+ORDERS_STREAM_CHUNK_SIZE = 200
+
+# таймаут (сек) и размер блока (байт) при скачивании прайса
+FEED_DOWNLOAD_TIMEOUT = 60
+FEED_CHUNK_SIZE = 1024 * 1024
+# прайсы, загруженные через partner/upload: наибольший размер после распаковки (байт) и каталог в хранилище
+FEED_UPLOAD_MAX_SIZE = int(os.getenv("FEED_UPLOAD_MAX_SIZE", 512 * 1024 * 1024))
+FEED_UPLOAD_DIR = 'imports'
+
+# параллельная загрузка фото товаров: всего потоков, потоков на хост, таймаут (сек)
+PHOTO_FETCH_WORKERS = 8
+PHOTO_HOST_CONCURRENCY = 4
+PHOTO_FETCH_TIMEOUT = 10
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Partner and clients orders API',
     'DESCRIPTION': 'API for manage orders and products by partners and for order products by clients.',